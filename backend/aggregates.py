@@ -0,0 +1,261 @@
+"""Incrementally maintained aggregates behind the analytics queries.
+
+The aggregates are bootstrapped with one full scan and afterwards updated
+with deltas as order batches are ingested, so the time series, ranking,
+comparison, distribution and overview analyses never rescan raw rows.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Group-bys these aggregates keep current, as (fact table, group keys, grain)
+# -> the (function, column) metrics available for them
+MATERIALIZED_VIEWS: Dict[Tuple, frozenset] = {
+    ('orders', ('orders.order_date',), 'M'): frozenset({
+        ('sum', 'orders.total_amount'), ('count', None)}),
+    ('order_items', ('products.product_id',), None): frozenset({
+        ('sum', 'order_items.total_price'), ('count', None)}),
+    ('orders', ('customers.customer_id',), None): frozenset({
+        ('sum', 'orders.total_amount'), ('count', None)}),
+    ('order_items', ('products.category',), None): frozenset({
+        ('sum', 'order_items.total_price'), ('sum', 'order_items.quantity'), ('count', None)}),
+    ('orders', ('orders.order_status',), None): frozenset({('count', None)}),
+    ('customers', ('customers.customer_segment',), None): frozenset({('count', None)}),
+    ('orders', (), None): frozenset({('count', None), ('sum', 'orders.total_amount')}),
+}
+
+# Groups kept ranked by revenue per product and per customer; rankings of up
+# to this many groups are read from the maintained top-k instead of sorting
+TOP_K = 100
+
+
+def grouped_sum(positions: np.ndarray, values: np.ndarray, size: int):
+    """Sum values per group position; rows with position -1 are dropped (inner join)"""
+    matched = positions >= 0
+    positions = positions[matched]
+    sums = np.bincount(positions, weights=np.asarray(values, dtype=np.float64)[matched], minlength=size)
+    counts = np.bincount(positions, minlength=size)
+    return sums, counts
+
+
+def top_positions(values: np.ndarray, present: np.ndarray, k: int,
+                  candidates: Optional[np.ndarray] = None) -> np.ndarray:
+    """Positions of the k largest values among present groups, ties in position order"""
+    if candidates is None:
+        candidates = np.flatnonzero(present)
+    else:
+        candidates = candidates[present[candidates]]
+    order = np.argsort(-values[candidates], kind='stable')[:k]
+    return candidates[order]
+
+
+def present_counts(values: pd.Series) -> pd.Series:
+    """value_counts without the zero-count categories a categorical would report"""
+    counts = values.value_counts()
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+class TopK:
+    """Top-k group positions over a score array that only grows.
+
+    When a delta only increases scores, the new top-k is contained in the old
+    top-k plus the groups the delta touched, so updates cost O(k + touched)
+    instead of a full ranking.
+    """
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self.positions = np.empty(0, dtype=np.int64)
+
+    def rebuild(self, scores: np.ndarray, present: np.ndarray):
+        self.positions = top_positions(scores, present, self.k)
+
+    def update(self, scores: np.ndarray, present: np.ndarray, touched: np.ndarray):
+        candidates = np.union1d(self.positions, touched)
+        self.positions = top_positions(scores, present, self.k, candidates)
+
+    def covers(self, k: int) -> bool:
+        """Whether the k largest groups are all among the tracked ones"""
+        return k <= self.k or len(self.positions) < self.k
+
+
+class LakehouseAggregates:
+    """Delta-maintained aggregates over orders and order items"""
+
+    def __init__(self, num_products: int, num_customers: int,
+                 product_category: np.ndarray, categories: np.ndarray,
+                 customer_segments: pd.Series, top_k: int = TOP_K):
+        self.product_category = product_category
+        self.categories = categories
+
+        self.monthly = pd.DataFrame(
+            {'revenue': pd.Series(dtype=np.float64), 'orders': pd.Series(dtype=np.int64)}
+        )
+        self.product_revenue = np.zeros(num_products)
+        self.product_items = np.zeros(num_products, dtype=np.int64)
+        self.customer_spend = np.zeros(num_customers)
+        self.customer_orders = np.zeros(num_customers, dtype=np.int64)
+        self.category_revenue = np.zeros(len(categories))
+        self.category_quantity = np.zeros(len(categories), dtype=np.int64)
+        self.category_items = np.zeros(len(categories), dtype=np.int64)
+        self.status_counts = pd.Series(dtype=np.int64)
+        self.segment_counts = present_counts(customer_segments)
+        self.total_orders = 0
+        self.total_revenue = 0.0
+
+        self.top_products = TopK(top_k)
+        self.top_customers = TopK(top_k)
+
+    @classmethod
+    def build(cls, lakehouse, top_k: int = TOP_K) -> 'LakehouseAggregates':
+        """Bootstrap the aggregates with one full scan of the lakehouse"""
+        join_index = lakehouse.join_index()
+        aggregates = cls(
+            num_products=len(lakehouse.products),
+            num_customers=len(lakehouse.customers),
+            product_category=join_index['product_category'],
+            categories=join_index['categories'],
+            customer_segments=lakehouse.customers['customer_segment'],
+            top_k=top_k,
+        )
+        aggregates.apply(
+            lakehouse.orders, lakehouse.order_items,
+            join_index['order_customer'], join_index['item_product'],
+        )
+        return aggregates
+
+    def apply(self, orders: pd.DataFrame, order_items: pd.DataFrame,
+              order_customer: np.ndarray, item_product: np.ndarray):
+        """Fold a batch of new orders and order items into the aggregates"""
+        amounts = orders['total_amount'].to_numpy(dtype=np.float64)
+        item_revenue = order_items['total_price'].to_numpy(dtype=np.float64)
+        item_quantity = order_items['quantity'].to_numpy(dtype=np.int64)
+
+        # Monthly revenue and order count
+        months = orders['order_date'].dt.to_period('M').to_numpy()
+        monthly_delta = pd.DataFrame({
+            'revenue': amounts,
+            'orders': np.ones(len(orders), dtype=np.int64),
+        }).groupby(months).sum()
+        monthly_delta.index = monthly_delta.index.astype(str)
+        self.monthly = self.monthly.add(monthly_delta, fill_value=0).astype(
+            {'revenue': np.float64, 'orders': np.int64}
+        ).sort_index()
+
+        # Per-product revenue
+        revenue, items = grouped_sum(item_product, item_revenue, len(self.product_revenue))
+        self.product_revenue += revenue
+        self.product_items += items
+
+        # Per-customer spend
+        spend, customer_orders = grouped_sum(order_customer, amounts, len(self.customer_spend))
+        self.customer_spend += spend
+        self.customer_orders += customer_orders
+
+        # Per-category revenue and quantity
+        item_category = np.where(item_product >= 0, self.product_category[item_product], -1)
+        revenue, items = grouped_sum(item_category, item_revenue, len(self.categories))
+        quantity, _ = grouped_sum(item_category, item_quantity, len(self.categories))
+        self.category_revenue += revenue
+        self.category_quantity += quantity.astype(np.int64)
+        self.category_items += items
+
+        # Status counts and overview totals
+        self.status_counts = self.status_counts.add(
+            present_counts(orders['order_status']), fill_value=0
+        ).astype(np.int64)
+        self.total_orders += len(orders)
+        self.total_revenue += float(amounts.sum())
+
+        # Scores only grow while deltas are non-negative; otherwise rank from scratch
+        if (item_revenue >= 0).all():
+            self.top_products.update(self.product_revenue, self.product_items > 0,
+                                     np.unique(item_product[item_product >= 0]))
+        else:
+            self.top_products.rebuild(self.product_revenue, self.product_items > 0)
+        if (amounts >= 0).all():
+            self.top_customers.update(self.customer_spend, self.customer_orders > 0,
+                                      np.unique(order_customer[order_customer >= 0]))
+        else:
+            self.top_customers.rebuild(self.customer_spend, self.customer_orders > 0)
+
+    def view(self, fact: str, keys: Tuple[str, ...], grain: Optional[str]) -> Dict[str, Any]:
+        """One of the MATERIALIZED_VIEWS as group rows ordered by key.
+
+        Returns the key columns (or, for surrogate keys, the dimension row
+        positions) and each available metric by (function, column). Groups
+        without rows are left out, as a group-by would.
+        """
+        if keys == ('orders.order_date',):
+            return {
+                'columns': {keys[0]: self.monthly.index.to_numpy()},
+                'positions': {},
+                'metrics': {('sum', 'orders.total_amount'): self.monthly['revenue'].to_numpy(),
+                            ('count', None): self.monthly['orders'].to_numpy()},
+            }
+        if keys == ('products.product_id',):
+            present = np.flatnonzero(self.product_items > 0)
+            return {
+                'columns': {},
+                'positions': {'products': present},
+                'metrics': {('sum', 'order_items.total_price'): self.product_revenue[present],
+                            ('count', None): self.product_items[present]},
+            }
+        if keys == ('customers.customer_id',):
+            present = np.flatnonzero(self.customer_orders > 0)
+            return {
+                'columns': {},
+                'positions': {'customers': present},
+                'metrics': {('sum', 'orders.total_amount'): self.customer_spend[present],
+                            ('count', None): self.customer_orders[present]},
+            }
+        if keys == ('products.category',):
+            present = self.category_items > 0
+            return {
+                'columns': {keys[0]: self.categories[present]},
+                'positions': {},
+                'metrics': {('sum', 'order_items.total_price'): self.category_revenue[present],
+                            ('sum', 'order_items.quantity'): self.category_quantity[present],
+                            ('count', None): self.category_items[present]},
+            }
+        if keys in (('orders.order_status',), ('customers.customer_segment',)):
+            counts = (self.status_counts if fact == 'orders' else self.segment_counts).sort_index()
+            return {
+                'columns': {keys[0]: counts.index.to_numpy(dtype=object)},
+                'positions': {},
+                'metrics': {('count', None): counts.to_numpy()},
+            }
+        if keys == ():
+            return {
+                'columns': {},
+                'positions': {},
+                'metrics': {('count', None): np.array([self.total_orders]),
+                            ('sum', 'orders.total_amount'): np.array([self.total_revenue])},
+            }
+        raise KeyError(f"No maintained aggregate for {fact} grouped by {keys}")
+
+    def top(self, fact: str, keys: Tuple[str, ...], metric: Tuple[str, Optional[str]],
+            k: int) -> Optional[Dict[str, Any]]:
+        """The k groups of a view with the largest metric, largest first and ties in key order.
+
+        Shaped like view(), and read from the maintained top-k without
+        ranking every group. None when no top-k is kept for that ranking or
+        it is too short to hold k groups.
+        """
+        if keys == ('products.product_id',) and metric == ('sum', 'order_items.total_price'):
+            tracker, table, scores, counts = self.top_products, 'products', self.product_revenue, self.product_items
+        elif keys == ('customers.customer_id',) and metric == ('sum', 'orders.total_amount'):
+            tracker, table, scores, counts = self.top_customers, 'customers', self.customer_spend, self.customer_orders
+        else:
+            return None
+        if not tracker.covers(k):
+            return None
+        positions = tracker.positions[:k]
+        return {
+            'columns': {},
+            'positions': {table: positions},
+            'metrics': {metric: scores[positions], ('count', None): counts[positions]},
+        }
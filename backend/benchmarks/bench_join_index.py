@@ -0,0 +1,100 @@
+"""Per-query latency of the product/customer analyses: hash join vs join index.
+
+"before" re-runs the merge + groupby implementations the analyses used to
+use; "after" runs the same questions through LLMAnalytics, whose query plans
+join through the lakehouse's positional join index. Results are checked to
+match.
+
+    python benchmarks/bench_join_index.py --scales 1 10 100
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from main import DataLakehouse, LLMAnalytics  # noqa: E402
+from snapshot import DEFAULT_SNAPSHOT_ROOT  # noqa: E402
+
+
+def merge_top_products(lakehouse: DataLakehouse) -> List[float]:
+    product_revenue = lakehouse.order_items.merge(
+        lakehouse.products, on='product_id'
+    ).groupby(['product_id', 'product_name'])['total_price'].sum().reset_index()
+    return product_revenue.nlargest(10, 'total_price')['total_price'].tolist()
+
+
+def merge_top_customers(lakehouse: DataLakehouse) -> List[float]:
+    customer_revenue = lakehouse.orders.merge(
+        lakehouse.customers, on='customer_id'
+    ).groupby(['customer_id', 'first_name', 'last_name'])['total_amount'].sum().reset_index()
+    return customer_revenue.nlargest(10, 'total_amount')['total_amount'].tolist()
+
+
+def merge_categories(lakehouse: DataLakehouse) -> List[float]:
+    category_data = lakehouse.order_items.merge(
+        lakehouse.products, on='product_id'
+    ).groupby('category').agg({'total_price': 'sum', 'quantity': 'sum'}).reset_index()
+    return category_data['total_price'].tolist()
+
+
+def timed(fn: Callable[[], object], repeat: int) -> float:
+    """Median wall time of fn in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run(scale: float, repeat: int, snapshot_root: str) -> Dict[str, Dict[str, float]]:
+    lakehouse = DataLakehouse(scale=scale, snapshot_root=snapshot_root)
+    analytics = LLMAnalytics()
+    analytics.lakehouse = lakehouse
+
+    start = time.perf_counter()
+    lakehouse.join_index()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    def answer(question: str) -> Callable[[], Dict]:
+        parsed = analytics.parse_natural_language_query(question)
+        return lambda: analytics.execute_analytics_query(parsed)
+
+    cases = {
+        'top_products': (lambda: merge_top_products(lakehouse), answer('top products'), 'values'),
+        'top_customers': (lambda: merge_top_customers(lakehouse), answer('top customers'), 'values'),
+        'category_comparison': (lambda: merge_categories(lakehouse), answer('compare categories'), 'revenue'),
+    }
+    results = {'join_index_build': {'after_ms': build_ms}}
+    for name, (before, after, key) in cases.items():
+        if not np.allclose(before(), after()['data'][key]):
+            raise AssertionError(f"{name}: join index result differs from merge result")
+        results[name] = {'before_ms': timed(before, repeat), 'after_ms': timed(after, repeat)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--snapshot-root', default=os.getenv('LAKEHOUSE_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_ROOT))
+    args = parser.parse_args()
+
+    print(f"{'scale':>6} {'query':<22} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for scale in args.scales:
+        for name, timing in run(scale, args.repeat, args.snapshot_root).items():
+            before = timing.get('before_ms')
+            after = timing['after_ms']
+            speedup = f"{before / after:.1f}x" if before else '-'
+            before_text = f"{before:.2f}" if before else '-'
+            print(f"{scale:>6g} {name:<22} {before_text:>10} {after:>10.2f} {speedup:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""Benchmark and load-test suite for the lakehouse and the API.
+
+For each scale factor it times lakehouse construction (generation and
+snapshot load), every analysis kind, windowed queries answered exactly and
+approximately, query parsing throughput, response serialization and
+filtered, sorted table pages. It then drives the API in-process through
+httpx's ASGI transport with concurrent clients, reporting p50/p95/p99
+latency and requests per second. Results are written as JSON; with
+--baseline, the run is compared against an earlier results file and exits
+non-zero when a timing regressed by more than --tolerance.
+
+    python benchmarks/bench_suite.py --scales 1 10 --output bench.json
+    python benchmarks/bench_suite.py --scales 1 10 --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+
+import main  # noqa: E402
+from cache import ResultCache  # noqa: E402
+from encoding import ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, JSON_MEDIA_TYPE  # noqa: E402
+from main import AnalyticsResponse, DataLakehouse, LLMAnalytics  # noqa: E402
+from snapshot import DEFAULT_SNAPSHOT_ROOT  # noqa: E402
+
+# One question per analysis kind the planner produces
+ANALYSIS_QUERIES = {
+    'time_series': 'Show me revenue trends over time',
+    'time_series_last_30_days': 'Daily revenue trend for the last 30 days',
+    'top_products': 'Which are the top 10 products by revenue?',
+    'top_customers': 'Who are our top customers?',
+    'category_comparison': 'Compare performance across product categories',
+    'segment_distribution': 'What is the distribution of customer segments?',
+    'status_distribution': 'Order status distribution',
+    'overview': 'Give me an overview of the business',
+    'grouped': 'Average order value by customer segment and channel last 3 months',
+}
+
+# Windowed questions the approximate mode answers from samples and sketches
+APPROXIMATE_QUERIES = {
+    'top_products_window': 'Top 10 products by revenue in 2026',
+    'top_customers_window': 'Top 10 customers in 2026',
+    'trend_window': 'Revenue trend last 6 months',
+    'grouped_window': 'Average order value by channel last 3 months',
+    'overview_window': 'Give me an overview of the business in 2026',
+}
+
+# Request mixes for the load test: (method, path, JSON body)
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+LOAD_SCENARIOS: Dict[str, List[Request]] = {
+    'analytics_query': [('POST', '/analytics/query', {'query': query}) for query in ANALYSIS_QUERIES.values()],
+    'analytics_dashboard': [('GET', '/analytics/dashboard', None)],
+    'data_overview': [('GET', '/data/overview', None)],
+    'data_customers': [('GET', '/data/customers?limit=100', None)],
+    'data_products': [('GET', '/data/products?limit=100', None)],
+    'data_orders': [('GET', '/data/orders?limit=100', None)],
+    'data_filtered': [
+        ('GET', '/data/customers?customer_segment=Premium&state=Texas&limit=100', None),
+        ('GET', '/data/products?category=Electronics&max_price=50&sort=-rating&limit=100', None),
+        ('GET', '/data/orders?order_status=Cancelled&sort=-total_amount&limit=100', None),
+    ],
+}
+LOAD_SCENARIOS['mixed'] = [request for requests in LOAD_SCENARIOS.values() for request in requests]
+
+# Metric name suffixes compared against a baseline, and whether lower is better;
+# single-sample extremes are too noisy to compare
+COMPARED_SUFFIXES = {'_ms': True, '_us': True, 'per_second': False}
+UNCOMPARED_METRICS = {'min_ms', 'max_ms'}
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    """Latency summary of a list of millisecond samples"""
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {
+        'samples': len(samples_ms),
+        'min_ms': min(samples_ms),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': max(samples_ms),
+    }
+
+
+def sample(fn: Callable[[], object], repeat: int) -> List[float]:
+    """Wall time of repeat calls to fn, in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def bench_construction(scale: float, seed: int, snapshot_root: str, repeat: int) -> Dict[str, Any]:
+    """Lakehouse start-up: generating the tables vs loading their snapshot, and the first table alone"""
+    # Make sure the snapshot exists, so the load timings never include a build
+    DataLakehouse(scale=scale, seed=seed, snapshot_root=snapshot_root).load_tables()
+    return {
+        'generate': summarize(sample(
+            lambda: DataLakehouse(scale=scale, seed=seed, snapshot_root=None).load_tables(), repeat
+        )),
+        'snapshot_load': summarize(sample(
+            lambda: DataLakehouse(scale=scale, seed=seed, snapshot_root=snapshot_root).load_tables(), repeat
+        )),
+        # What a request for customers waits for right after start-up
+        'first_table_generate': summarize(sample(
+            lambda: DataLakehouse(scale=scale, seed=seed, snapshot_root=None).customers, repeat
+        )),
+        'first_table_snapshot': summarize(sample(
+            lambda: DataLakehouse(scale=scale, seed=seed, snapshot_root=snapshot_root).customers, repeat
+        )),
+    }
+
+
+def bench_analyses(analytics: LLMAnalytics, repeat: int) -> Dict[str, Any]:
+    """Execution time of each analysis kind, without the result cache"""
+    results = {}
+    for name, query in ANALYSIS_QUERIES.items():
+        parsed = analytics.parse_natural_language_query(query)
+        analytics.execute_analytics_query(parsed)  # warm lazily built indexes
+        results[name] = {'kind': parsed['plan'].kind,
+                         **summarize(sample(lambda: analytics.execute_analytics_query(parsed), repeat))}
+    return results
+
+
+def bench_approximate(analytics: LLMAnalytics, repeat: int) -> Dict[str, Any]:
+    """Exact vs approximate execution of windowed queries, without the result cache"""
+    results = {}
+    for name, query in APPROXIMATE_QUERIES.items():
+        timings = {}
+        for mode, approximate in (('exact', False), ('approximate', True)):
+            parsed = analytics.parse_natural_language_query(query, approximate)
+            analytics.execute_analytics_query(parsed)  # warm the sample, sketches and indexes
+            timings[mode] = summarize(sample(lambda: analytics.execute_analytics_query(parsed), repeat))
+        results[name] = timings
+    return results
+
+
+def bench_parsing(analytics: LLMAnalytics, repeat: int) -> Dict[str, Any]:
+    """Throughput of parse_natural_language_query over the analysis questions"""
+    queries = list(ANALYSIS_QUERIES.values())
+    per_query_us = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            query_start = time.perf_counter()
+            analytics.parse_natural_language_query(query)
+            per_query_us.append((time.perf_counter() - query_start) * 1e6)
+    elapsed = time.perf_counter() - start
+    return {
+        'queries': len(per_query_us),
+        'queries_per_second': len(per_query_us) / elapsed,
+        'p50_us': statistics.median(per_query_us),
+    }
+
+
+MEDIA_TYPES = {'json': JSON_MEDIA_TYPE, 'columnar': COLUMNAR_MEDIA_TYPE, 'arrow': ARROW_MEDIA_TYPE}
+
+
+def bench_serialization(lakehouse: DataLakehouse, analytics: LLMAnalytics, repeat: int) -> Dict[str, Any]:
+    """Encoding time of analysis responses and table pages, per negotiable media type"""
+    results = {}
+    for name, query in ANALYSIS_QUERIES.items():
+        result = analytics.execute_analytics_query(analytics.parse_natural_language_query(query))
+        response = AnalyticsResponse(**result)
+        body = {field: getattr(response, field) for field in AnalyticsResponse.model_fields}
+        results[name] = {}
+        for label, media_type in MEDIA_TYPES.items():
+            results[name][f'{label}_bytes'] = len(main._analysis_bytes(body, media_type))
+            results[name][f'{label}_ms'] = statistics.median(
+                sample(lambda: main._analysis_bytes(body, media_type), repeat)
+            )
+    with serving(lakehouse, result_cache=False):
+        for table in ('customers', 'products', 'orders'):
+            name = f'page_{table}'
+            results[name] = {}
+            for label, media_type in MEDIA_TYPES.items():
+                results[name][f'{label}_bytes'] = len(main._table_page_payload(table, 100, 0, None, media_type))
+                results[name][f'{label}_ms'] = statistics.median(
+                    sample(lambda: main._table_page_payload(table, 100, 0, None, media_type), repeat)
+                )
+    return results
+
+
+def bench_filtered_pages(lakehouse: DataLakehouse, repeat: int) -> Dict[str, Any]:
+    """Filtered and sorted /data pages, with the planner's driving index and the match count"""
+    last_day = lakehouse.orders['order_date'].max().date()
+    pages = {
+        'premium_customers_in_texas': main.CustomerPageQuery(customer_segment=['Premium'], state=['Texas']),
+        'cheap_electronics_by_rating': main.ProductPageQuery(category=['Electronics'], max_price=50, sort='-rating'),
+        'cancelled_orders_last_week': main.OrderPageQuery(order_status=['Cancelled'], max_order_date=last_day,
+                                                          min_order_date=last_day - timedelta(days=6)),
+        'one_customers_orders': main.OrderPageQuery(customer_id=['CUST_000042'], sort='-order_date'),
+        'largest_orders': main.OrderPageQuery(sort='-total_amount'),
+    }
+    results = {}
+    with serving(lakehouse, result_cache=False):
+        for name, query in pages.items():
+            table = {main.CustomerPageQuery: 'customers', main.ProductPageQuery: 'products',
+                     main.OrderPageQuery: 'orders'}[type(query)]
+            page = lambda: main._table_page_payload(table, query.limit, 0, None, JSON_MEDIA_TYPE, query)
+            info = json.loads(page())  # also builds the indexes the page uses
+            results[name] = {'index': info['index'], 'matches': info['total'],
+                             **summarize(sample(page, repeat))}
+    return results
+
+
+@contextmanager
+def serving(lakehouse: DataLakehouse, result_cache: bool) -> Iterator[None]:
+    """Point the app's module-level lakehouse and analytics at the given lakehouse"""
+    saved = main.lakehouse, main.llm_analytics
+    main.lakehouse = lakehouse
+    main.llm_analytics = LLMAnalytics(cache=ResultCache() if result_cache else None)
+    main.llm_analytics.lakehouse = lakehouse
+    try:
+        yield
+    finally:
+        main.lakehouse, main.llm_analytics = saved
+
+
+async def drive(client: httpx.AsyncClient, requests: List[Request], total: int, concurrency: int
+                ) -> Dict[str, Any]:
+    """Issue total requests from concurrency clients, cycling through the request mix"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    next_request = iter(range(total))
+
+    async def client_loop():
+        for i in next_request:
+            method, path, body = requests[i % len(requests)]
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            status = str(response.status_code)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        **summarize(latencies),
+        'requests_per_second': total / elapsed,
+        'errors': errors,
+        'statuses': statuses,
+    }
+
+
+async def load_test(total: int, concurrency: int) -> Dict[str, Any]:
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        for name, requests in LOAD_SCENARIOS.items():
+            # Warm-up pass: one round of the mix, not recorded
+            await drive(client, requests, len(requests), 1)
+            results[name] = await drive(client, requests, total, concurrency)
+    return results
+
+
+def run(scale: float, args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    if not args.skip_construction:
+        results['construction'] = bench_construction(scale, args.seed, args.snapshot_root, args.construct_repeat)
+
+    lakehouse = DataLakehouse(scale=scale, seed=args.seed, snapshot_root=args.snapshot_root)
+    lakehouse.warm_up()
+    analytics = LLMAnalytics()
+    analytics.lakehouse = lakehouse
+    results['analyses'] = bench_analyses(analytics, args.repeat)
+    results['approximate'] = bench_approximate(analytics, args.repeat)
+    results['parsing'] = bench_parsing(analytics, args.repeat)
+    results['serialization'] = bench_serialization(lakehouse, analytics, args.repeat)
+    results['filtered_pages'] = bench_filtered_pages(lakehouse, args.repeat)
+
+    if not args.skip_load:
+        with serving(lakehouse, result_cache=not args.no_result_cache):
+            results['load'] = asyncio.run(load_test(args.requests, args.concurrency))
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def flatten(results: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    """Compared metrics of a results tree, keyed by their dotted path"""
+    metrics = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f'{path}.'))
+        elif (isinstance(value, (int, float)) and key not in UNCOMPARED_METRICS
+              and any(key.endswith(suffix) for suffix in COMPARED_SUFFIXES)):
+            metrics[path] = float(value)
+    return metrics
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta_ms: float
+            ) -> List[Dict[str, Any]]:
+    """Metrics present in both runs, with their relative change and regression flag.
+
+    Latencies only regress when they also grew by at least min_delta_ms, so
+    jitter on microsecond timings is not reported.
+    """
+    before, after = flatten(baseline['results']), flatten(current['results'])
+    rows = []
+    for path in sorted(before.keys() & after.keys()):
+        lower_is_better = next(lower for suffix, lower in COMPARED_SUFFIXES.items() if path.endswith(suffix))
+        old, new = before[path], after[path]
+        change = (new - old) / old if old else 0.0
+        if lower_is_better:
+            delta_ms = (new - old) / 1000 if path.endswith('_us') else new - old
+            worse = change > tolerance and delta_ms >= min_delta_ms
+        else:
+            worse = change < -tolerance
+        rows.append({'metric': path, 'baseline': old, 'current': new, 'change': change, 'regression': worse})
+    return rows
+
+
+def print_summary(results: Dict[str, Any]):
+    for scale, scale_results in results['results'].items():
+        print(f"\nscale {scale}")
+        for name, timing in scale_results.get('construction', {}).items():
+            print(f"  construction {name:<28} p50 {timing['p50_ms']:>10.1f} ms")
+        for name, timing in scale_results['analyses'].items():
+            print(f"  analysis     {name:<28} p50 {timing['p50_ms']:>10.2f} ms  p95 {timing['p95_ms']:>8.2f} ms")
+        for name, timings in scale_results.get('approximate', {}).items():
+            print(f"  approximate  {name:<28} p50 {timings['approximate']['p50_ms']:>10.2f} ms  "
+                  f"exact p50 {timings['exact']['p50_ms']:>8.2f} ms")
+        parsing = scale_results['parsing']
+        print(f"  parsing      {'queries':<28} {parsing['queries_per_second']:>14,.0f} q/s")
+        for name, timing in scale_results['serialization'].items():
+            print(f"  serialize    {name:<28} " + "  ".join(
+                f"{label} {timing[f'{label}_ms']:.3f} ms / {timing[f'{label}_bytes']:,} B" for label in MEDIA_TYPES
+            ))
+        for name, load in scale_results.get('load', {}).items():
+            print(f"  load         {name:<28} p50 {load['p50_ms']:>10.2f} ms  p95 {load['p95_ms']:>8.2f} ms  "
+                  f"p99 {load['p99_ms']:>8.2f} ms  {load['requests_per_second']:>8.1f} req/s  "
+                  f"{load['errors']} errors")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=20, help='samples per micro-benchmark')
+    parser.add_argument('--construct-repeat', type=int, default=3, help='samples per construction benchmark')
+    parser.add_argument('--requests', type=int, default=400, help='requests per load scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients in the load test')
+    parser.add_argument('--no-result-cache', action='store_true', help='run the load test without the result cache')
+    parser.add_argument('--skip-construction', action='store_true')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--snapshot-root', default=os.getenv('LAKEHOUSE_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_ROOT))
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown (or throughput drop) reported as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='smallest absolute latency increase reported as a regression')
+    args = parser.parse_args()
+
+    results = {
+        **environment(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': {f'{scale:g}': run(scale, args) for scale in args.scales},
+    }
+    print_summary(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        regressions = [row for row in rows if row['regression']]
+        print(f"\nCompared {len(rows)} metrics against {args.baseline} "
+              f"(commit {baseline.get('git_commit')}, tolerance {args.tolerance:.0%})")
+        for row in regressions:
+            print(f"  REGRESSION {row['metric']:<60} {row['baseline']:>12.3f} -> {row['current']:>12.3f} "
+                  f"({row['change']:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print("  no regressions")
+
+
+if __name__ == '__main__':
+    main_cli()
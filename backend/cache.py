@@ -0,0 +1,124 @@
+"""Bounded, versioned result cache for analytics queries.
+
+Keys combine the normalized parsed query with the lakehouse data version, so
+results are reused until the underlying tables change. Entries are evicted
+in LRU order, can optionally expire after a TTL, and concurrent misses for
+the same key are coalesced into a single computation (single-flight).
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Parsed-query fields that describe how a query was phrased, not what it computes
+_PRESENTATION_KEYS = {'interpretation', 'original_query'}
+
+
+def query_cache_key(parsed_query: Dict[str, Any], data_version: int) -> Tuple:
+    """Normalize a parsed query into a hashable cache key"""
+    filters = {
+        key: value for key, value in parsed_query.items()
+        if key not in _PRESENTATION_KEYS and key not in ('analysis_type', 'data_scope')
+    }
+    return (
+        parsed_query.get('analysis_type', 'general'),
+        tuple(sorted(set(parsed_query.get('data_scope', [])))),
+        json.dumps(filters, sort_keys=True, default=str),
+        data_version,
+    )
+
+
+class ResultCache:
+    """Thread-safe LRU cache with optional TTL and single-flight misses"""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: Optional[float] = None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key: Hashable, now: float) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            del self._entries[key]
+            self.expirations += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key: Hashable, value: Any, now: float):
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing it at most once concurrently.
+
+        Exceptions raised by compute are propagated to every waiting caller
+        and are never cached.
+        """
+        with self._lock:
+            found, value = self._lookup(key, time.monotonic())
+            if found:
+                self.hits += 1
+                return value
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                self.misses += 1
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as exc:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(exc)
+            raise
+
+        with self._lock:
+            self._store(key, value, time.monotonic())
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,543 @@
+"""Out-of-core execution: aggregations over orders and order items streamed from a snapshot.
+
+With LAKEHOUSE_EXECUTION=chunked the fact tables are never loaded whole.
+Aggregations over them read the snapshot's memory-mapped files in chunks of
+ANALYTICS_CHUNK_ROWS orders plus the items of exactly those orders (both
+tables are stored in order id order), so every join resolves within its
+chunk. Each chunk runs through the ordinary executor and yields partial
+aggregates: sums and row counts per group, and for distinct counts the
+distinct (group, value) pairs. Partials are merged across chunks. Chunks
+whose order dates miss a query's window are skipped.
+
+Merged group state beyond ANALYTICS_SPILL_ROWS rows is hash-partitioned into
+Arrow files under ANALYTICS_SPILL_DIR and merged one partition at a time.
+With ANALYTICS_CHUNK_WORKERS set, chunks run in a pool of processes that map
+the same files; partials are still merged in chunk order, so results do not
+depend on the worker count. Memory follows the chunk size, the number of
+groups and the number of workers rather than the size of the tables.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from datagen import DEFAULT_CHUNK_ROWS
+from engine import PRIMARY_KEYS, Relation, group_rows, metric_values, run
+from metrics import count, instrumented
+from partitions import PARTITIONED_TABLES
+from plan import LEAVES, SAMPLE_UNIT_COLUMNS, Aggregate, Filter, GroupBy, Join, Metric, Node, Scan, table_of
+from snapshot import open_table, to_frame
+
+EXECUTION_MODES = ('memory', 'chunked')
+
+# Columns every chunk reads to join within itself and to the dimensions
+FACT_KEYS = {'orders': ['order_id', 'customer_id'], 'order_items': ['order_id', 'product_id']}
+# Row count per group, merged alongside the metrics; means divide by it
+ROWS = '__rows__'
+SPILL_PARTITIONS = 16
+
+# (orders start, orders stop, order items start, order items stop) of one chunk
+Bounds = Tuple[int, int, int, int]
+Partial = Dict[str, Any]
+
+
+class _Lazy(dict):
+    """A dict computing each missing entry on first access"""
+
+    def __init__(self, compute: Callable[[str], Any]):
+        super().__init__()
+        self._compute = compute
+
+    def __missing__(self, key: str) -> Any:
+        value = self[key] = self._compute(key)
+        return value
+
+
+class ChunkIndex:
+    """Row ranges of each chunk in orders and order items, with the chunk's order date range"""
+
+    def __init__(self, order_start: np.ndarray, order_stop: np.ndarray, item_start: np.ndarray,
+                 item_stop: np.ndarray, min_date: np.ndarray, max_date: np.ndarray):
+        self.order_start = order_start
+        self.order_stop = order_stop
+        self.item_start = item_start
+        self.item_stop = item_stop
+        self.min_date = min_date
+        self.max_date = max_date
+
+    def __len__(self) -> int:
+        return len(self.order_start)
+
+    @classmethod
+    def build(cls, orders: pa.Table, order_items: pa.Table, chunk_rows: int) -> 'ChunkIndex':
+        """Cut orders into chunks of chunk_rows and find the items of each by binary search"""
+        order_start = np.arange(0, orders.num_rows, chunk_rows, dtype=np.int64)
+        order_stop = np.minimum(order_start + chunk_rows, orders.num_rows)
+        order_ids = orders.column('order_id')
+        # Items before a chunk's first order id belong to earlier chunks
+        first_ids = np.array([order_ids[int(start)].as_py() for start in order_start[1:]], dtype=np.int64)
+        item_bounds = np.zeros(len(first_ids), dtype=np.int64)
+        for ids in order_items.column('order_id').chunks:
+            item_bounds += np.searchsorted(ids.to_numpy(), first_ids)
+        dates = orders.column('order_date')
+        min_date = np.empty(len(order_start), dtype='datetime64[ns]')
+        max_date = np.empty(len(order_start), dtype='datetime64[ns]')
+        for chunk, (start, stop) in enumerate(zip(order_start, order_stop)):
+            values = dates.slice(int(start), int(stop - start)).to_numpy()
+            min_date[chunk], max_date[chunk] = values.min(), values.max()
+        return cls(order_start, order_stop, np.r_[np.int64(0), item_bounds],
+                   np.r_[item_bounds, np.int64(order_items.num_rows)], min_date, max_date)
+
+    def bounds(self, chunk: int) -> Bounds:
+        return (int(self.order_start[chunk]), int(self.order_stop[chunk]),
+                int(self.item_start[chunk]), int(self.item_stop[chunk]))
+
+    def overlapping(self, time_range: Optional[Tuple[Optional[str], Optional[str]]]) -> np.ndarray:
+        """Chunks holding orders dated within [start, end)"""
+        keep = np.ones(len(self), dtype=bool)
+        start, end = time_range or (None, None)
+        if start:
+            keep &= self.max_date >= np.datetime64(start, 'ns')
+        if end:
+            keep &= self.min_date < np.datetime64(end, 'ns')
+        return np.flatnonzero(keep)
+
+
+class _SnapshotDimensions:
+    """Customers and products of a snapshot, for chunks run in pool workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @cached_property
+    def customers(self) -> pd.DataFrame:
+        return to_frame(open_table(self.path, 'customers'))
+
+    @cached_property
+    def products(self) -> pd.DataFrame:
+        return to_frame(open_table(self.path, 'products'))
+
+    @cached_property
+    def customer_index(self) -> pd.Index:
+        return pd.Index(self.customers['customer_id'])
+
+    @cached_property
+    def product_index(self) -> pd.Index:
+        return pd.Index(self.products['product_id'])
+
+
+class _Chunk:
+    """One chunk of orders and their items, shaped like the lakehouse for the executor.
+
+    dimensions supplies customers and products with their id indexes (the
+    lakehouse itself, or _SnapshotDimensions in a worker). Fact columns are
+    converted to pandas, and join positions computed, only when read.
+    """
+
+    # Aggregations over a chunk run in memory
+    chunks = None
+
+    def __init__(self, dimensions, orders: pa.Table, order_items: pa.Table):
+        self.dimensions = dimensions
+        self._facts = _Lazy(lambda table: to_frame({'orders': orders, 'order_items': order_items}[table]))
+        self._join_index = _Lazy(self._join_positions)
+
+    @property
+    def customers(self) -> pd.DataFrame:
+        return self.dimensions.customers
+
+    @property
+    def products(self) -> pd.DataFrame:
+        return self.dimensions.products
+
+    @property
+    def orders(self) -> pd.DataFrame:
+        return self._facts['orders']
+
+    @property
+    def order_items(self) -> pd.DataFrame:
+        return self._facts['order_items']
+
+    def _join_positions(self, key: str) -> np.ndarray:
+        if key == 'item_product':
+            return self.dimensions.product_index.get_indexer(self.order_items['product_id'])
+        if key == 'order_customer':
+            return self.dimensions.customer_index.get_indexer(self.orders['customer_id'])
+        if key == 'item_order':
+            # Both tables are sorted by order id
+            ids = self.order_items['order_id'].to_numpy()
+            table_ids = self.orders['order_id'].to_numpy()
+            positions = np.searchsorted(table_ids, ids)
+            found = positions < len(table_ids)
+            found[found] = table_ids[positions[found]] == ids[found]
+            return np.where(found, positions, -1)
+        raise KeyError(key)
+
+    def join_index(self) -> Dict[str, np.ndarray]:
+        return self._join_index
+
+    def time_slice(self, start: Optional[str], end: Optional[str]) -> Dict[str, np.ndarray]:
+        """Positions of the chunk's orders and order items dated within [start, end)"""
+
+        def rows(table: str) -> np.ndarray:
+            dates = self.orders['order_date'].to_numpy()
+            keep = np.ones(len(dates), dtype=bool)
+            if start:
+                keep &= dates >= np.datetime64(start)
+            if end:
+                keep &= dates < np.datetime64(end)
+            if table == 'orders':
+                return np.flatnonzero(keep)
+            item_order = self._join_index['item_order']
+            matched = item_order >= 0
+            kept = np.zeros(len(item_order), dtype=bool)
+            kept[matched] = keep[item_order[matched]]
+            return np.flatnonzero(kept)
+
+        return _Lazy(rows)
+
+
+class _FactFiles:
+    """The memory-mapped orders and order items files of a snapshot"""
+
+    def __init__(self, path: str):
+        self.orders = open_table(path, 'orders')
+        self.order_items = open_table(path, 'order_items')
+
+    def chunk(self, bounds: Bounds, columns: Dict[str, List[str]], dimensions) -> _Chunk:
+        order_start, order_stop, item_start, item_stop = bounds
+        return _Chunk(
+            dimensions,
+            self.orders.slice(order_start, order_stop - order_start).select(columns['orders']),
+            self.order_items.slice(item_start, item_stop - item_start).select(columns['order_items']),
+        )
+
+
+def _grouping(node: Aggregate) -> Tuple[Tuple[str, ...], Optional[str]]:
+    return (node.source.keys, node.source.grain) if isinstance(node.source, GroupBy) else ((), None)
+
+
+def _positional(key: str) -> bool:
+    """Whether the executor groups a key by row position (surrogate keys) rather than by value"""
+    table, column = key.split('.', 1)
+    return PRIMARY_KEYS.get(table) == column
+
+
+def _partial(node: Aggregate, chunk: _Chunk) -> Partial:
+    """Mergeable partial aggregates of one chunk.
+
+    'sums' holds the key columns, the row count and every metric that adds
+    up across chunks; 'distinct' holds, per distinct count that does not,
+    the distinct (key columns, value) pairs.
+    """
+    keys, grain = _grouping(node)
+    relation = run(node.source.source if keys else node.source, chunk)
+    if keys:
+        positions, labels, valid, group_of_row, groups = group_rows(relation, keys, grain)
+    else:
+        positions, labels, valid, group_of_row, groups = {}, {}, None, np.zeros(relation.length, dtype=np.int64), 1
+
+    key_columns: Dict[str, Any] = {}
+    for key in keys:
+        table, column = key.split('.', 1)
+        if _positional(key):
+            key_columns[key] = positions[table]
+        else:
+            dtype = getattr(chunk, table)[column].dtype
+            # Categorical keys keep their categories, so merged groups sort as the executor's do
+            key_columns[key] = (pd.Categorical(labels[key], dtype=dtype)
+                                if isinstance(dtype, pd.CategoricalDtype) else labels[key])
+
+    sums = {**key_columns, ROWS: np.bincount(group_of_row, minlength=groups)}
+    distinct = {}
+    for metric in node.metrics:
+        if metric.func == 'mean':
+            sums[metric.name] = metric_values(Metric(metric.name, 'sum', metric.column), relation, valid,
+                                              group_of_row, groups)
+        elif metric.func == 'count_distinct' and metric.column not in SAMPLE_UNIT_COLUMNS:
+            values = np.asarray(relation.column(metric.column))
+            if valid is not None:
+                values = values[valid]
+            pairs = pd.DataFrame({'group': group_of_row, 'value': values}).drop_duplicates()
+            group = pairs['group'].to_numpy()
+            distinct[metric.name] = pd.DataFrame({**{key: column[group] for key, column in key_columns.items()},
+                                                  'value': pairs['value'].to_numpy()})
+        else:
+            # Chunks hold whole orders, so distinct orders add up like counts
+            sums[metric.name] = metric_values(metric, relation, valid, group_of_row, groups)
+    return {'sums': pd.DataFrame(sums), 'distinct': distinct}
+
+
+class _Merger:
+    """Group state merged from partials: summed per key, or deduplicated for distinct pairs.
+
+    Up to spill_rows rows are held in memory. Beyond that the merged state is
+    hash-partitioned into Arrow files, and result() merges one partition at
+    a time. Distinct pairs are partitioned on the whole pair, summed state on
+    its keys.
+    """
+
+    def __init__(self, keys: Sequence[str], distinct: bool, spill_rows: int, spill_dir: Optional[str]):
+        self.keys = list(keys)
+        self.distinct = distinct
+        self.spill_rows = spill_rows
+        self.spill_dir = spill_dir
+        self._frames: List[pd.DataFrame] = []
+        self._rows = 0
+        self._directory: Optional[str] = None
+        self._writers: Dict[int, Any] = {}
+        self._schema: Optional[pa.Schema] = None
+
+    def add(self, frame: pd.DataFrame):
+        self._frames.append(frame)
+        self._rows += len(frame)
+        if self._rows > self.spill_rows:
+            merged = self._combine(pd.concat(self._frames, ignore_index=True))
+            self._frames, self._rows = [merged], len(merged)
+            if len(merged) > self.spill_rows // 2:
+                self._spill(merged)
+                self._frames, self._rows = [], 0
+
+    def _combine(self, frame: pd.DataFrame) -> pd.DataFrame:
+        if self.distinct:
+            return frame.drop_duplicates(ignore_index=True)
+        if not self.keys:
+            return pd.DataFrame({column: [frame[column].sum()] for column in frame.columns})
+        return frame.groupby(self.keys, sort=False, observed=True).sum().reset_index()
+
+    def _counts(self, pairs: pd.DataFrame) -> pd.DataFrame:
+        """Distinct values per group"""
+        if not self.keys:
+            return pd.DataFrame({'count': [len(pairs)]})
+        return pairs.groupby(self.keys, sort=False, observed=True).size().rename('count').reset_index()
+
+    def _spill(self, frame: pd.DataFrame):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix='lakehouse-spill-', dir=self.spill_dir)
+        hashed = frame if self.distinct else frame[self.keys]
+        partition = pd.util.hash_pandas_object(hashed, index=False).to_numpy() % SPILL_PARTITIONS
+        table = pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+        self._schema = table.schema
+        for part in np.unique(partition):
+            if part not in self._writers:
+                sink = pa.OSFile(os.path.join(self._directory, f'{part}.arrow'), 'wb')
+                self._writers[part] = (sink, ipc.new_stream(sink, self._schema))
+            self._writers[part][1].write_table(table.take(np.flatnonzero(partition == part)))
+        count('rows_spilled', len(frame))
+
+    def _spilled(self) -> Iterator[pd.DataFrame]:
+        for sink, writer in self._writers.values():
+            writer.close()
+            sink.close()
+        for part in sorted(self._writers):
+            with pa.memory_map(os.path.join(self._directory, f'{part}.arrow'), 'r') as source:
+                yield ipc.open_stream(source).read_all().to_pandas()
+
+    def result(self) -> pd.DataFrame:
+        """Merged state: summed rows per group, or distinct counts per group in a 'count' column"""
+        frame = self._combine(pd.concat(self._frames, ignore_index=True)) if self._frames else None
+        self._frames = []
+        if self._directory is None:
+            return self._counts(frame) if self.distinct else frame
+        try:
+            if frame is not None and len(frame):
+                self._spill(frame)
+            # Partitions hold disjoint groups, or disjoint pairs whose counts add up
+            parts = [self._combine(part) for part in self._spilled()]
+            if not self.distinct:
+                return pd.concat(parts, ignore_index=True)
+            counts = pd.concat([self._counts(part) for part in parts], ignore_index=True)
+            return counts.groupby(self.keys, sort=False, observed=True).sum().reset_index()
+        finally:
+            self.close()
+
+    def close(self):
+        for sink, writer in self._writers.values():
+            if not sink.closed:
+                writer.close()
+                sink.close()
+        self._writers = {}
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+
+# Fact files and dimensions opened by each pool worker, by snapshot path
+_worker_files: Dict[str, Tuple[_FactFiles, _SnapshotDimensions]] = {}
+
+
+def _pooled_partial(path: str, node: Aggregate, bounds: Bounds, columns: Dict[str, List[str]]
+                    ) -> Tuple[Partial, Dict[str, float]]:
+    """_partial in a pool worker, with the counters it recorded"""
+    if path not in _worker_files:
+        _worker_files[path] = (_FactFiles(path), _SnapshotDimensions(path))
+    files, dimensions = _worker_files[path]
+    partial, timer = instrumented(_partial, node, files.chunk(bounds, columns, dimensions))
+    return partial, timer.counters
+
+
+class ChunkedFacts:
+    """Orders and order items of a snapshot, aggregated chunk by chunk"""
+
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, workers: int = 0,
+                 spill_rows: int = 1_000_000, spill_dir: Optional[str] = None):
+        if chunk_rows < 1 or workers < 0 or spill_rows < 1:
+            raise ValueError("chunk_rows and spill_rows must be >= 1 and workers >= 0")
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.spill_rows = spill_rows
+        self.spill_dir = spill_dir
+        self._files = _FactFiles(path)
+        self.index = ChunkIndex.build(self._files.orders, self._files.order_items, chunk_rows)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, path: str) -> 'ChunkedFacts':
+        return cls(
+            path,
+            chunk_rows=int(os.getenv('ANALYTICS_CHUNK_ROWS', str(DEFAULT_CHUNK_ROWS))),
+            workers=int(os.getenv('ANALYTICS_CHUNK_WORKERS', '0')),
+            spill_rows=int(os.getenv('ANALYTICS_SPILL_ROWS', '1000000')),
+            spill_dir=os.getenv('ANALYTICS_SPILL_DIR') or None,
+        )
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        return {'orders': self._files.orders.num_rows, 'order_items': self._files.order_items.num_rows}
+
+    def streams(self, node: Node) -> bool:
+        """Whether node is an aggregation over orders or order items that chunks can compute"""
+        if not isinstance(node, Aggregate):
+            return False
+        below = node.source
+        while isinstance(below, (GroupBy, Join, Filter)):
+            below = below.source
+        keys, _ = _grouping(node)
+        # Order and item positions are local to a chunk
+        return (isinstance(below, Scan) and below.table in PARTITIONED_TABLES
+                and not any(_positional(key) and table_of(key) in PARTITIONED_TABLES for key in keys))
+
+    def _columns(self, node: Aggregate) -> Tuple[Scan, Dict[str, List[str]]]:
+        """The scan below node and the fact columns its chunks read"""
+        columns = {table: list(keys) for table, keys in FACT_KEYS.items()}
+        read = [metric.column for metric in node.metrics if metric.column]
+        below: Node = node.source
+        while not isinstance(below, LEAVES):
+            if isinstance(below, GroupBy):
+                read += below.keys
+            elif isinstance(below, Join):
+                read += below.columns
+            elif isinstance(below, Filter):
+                read.append(below.column)
+            below = below.source
+        read += below.columns
+        if below.time_range is not None:
+            read.append('orders.order_date')
+        for column in read:
+            table, name = column.split('.', 1)
+            if table in columns and name not in columns[table]:
+                columns[table].append(name)
+        return below, columns
+
+    def _pool_executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # Spawned rather than forked: the server process runs threads
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _partials(self, node: Aggregate, chunks: Sequence[Bounds], columns: Dict[str, List[str]],
+                  dimensions) -> Iterator[Partial]:
+        """Partials of the chunks, in chunk order"""
+        if not self.workers:
+            for bounds in chunks:
+                yield _partial(node, self._files.chunk(bounds, columns, dimensions))
+            return
+        pool = self._pool_executor()
+        # At most two chunks per worker in flight, so finished partials never pile up
+        pending = deque()
+        try:
+            for bounds in chunks:
+                pending.append(pool.submit(_pooled_partial, self.path, node, bounds, columns))
+                if len(pending) >= 2 * self.workers:
+                    yield self._counted(pending.popleft().result())
+            while pending:
+                yield self._counted(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _counted(result: Tuple[Partial, Dict[str, float]]) -> Partial:
+        partial, counters = result
+        for name, value in counters.items():
+            count(name, value)
+        return partial
+
+    def aggregate(self, node: Aggregate, dimensions) -> Relation:
+        """Run an aggregation (see streams()) over every chunk its time range touches.
+
+        dimensions is the lakehouse, which supplies customers and products;
+        the result is a relation over it, like the executor's own.
+        """
+        keys, _ = _grouping(node)
+        scan, columns = self._columns(node)
+        chunks = [self.index.bounds(chunk) for chunk in self.index.overlapping(scan.time_range)]
+        # With no chunk to read, an empty one still gives the result its columns
+        chunks = chunks or [(0, 0, 0, 0)]
+
+        sums = _Merger(keys, False, self.spill_rows, self.spill_dir)
+        distinct: Dict[str, _Merger] = {}
+        try:
+            for partial in self._partials(node, chunks, columns, dimensions):
+                sums.add(partial['sums'])
+                for name, pairs in partial['distinct'].items():
+                    distinct.setdefault(name, _Merger(keys, True, self.spill_rows, self.spill_dir)).add(pairs)
+            merged = sums.result()
+            for name, merger in distinct.items():
+                counts = merger.result().rename(columns={'count': name})
+                if keys:
+                    merged = merged.merge(counts, on=list(keys), how='left')
+                    merged[name] = merged[name].fillna(0).astype(np.int64)
+                else:
+                    merged[name] = counts[name].to_numpy()
+        finally:
+            sums.close()
+            for merger in distinct.values():
+                merger.close()
+        if keys:
+            merged = merged.sort_values(list(keys), ignore_index=True)
+
+        positions: Dict[str, Optional[np.ndarray]] = {}
+        result: Dict[str, Any] = {}
+        for key in keys:
+            if _positional(key):
+                positions[table_of(key)] = merged[key].to_numpy(dtype=np.int64)
+            else:
+                result[key] = np.asarray(merged[key], dtype=object)
+        for metric in node.metrics:
+            values = merged[metric.name].to_numpy()
+            if metric.func == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    values = values / merged[ROWS].to_numpy()
+            result[metric.name] = values
+        return Relation(dimensions, len(merged), positions, result)
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,268 @@
+"""Vectorized synthetic data generator for the e-commerce lakehouse.
+
+Tables are sized by a TPC-H style scale factor: scale 1.0 produces the
+original 1,000 customers, 500 products and 5,000 orders (~15,000 order
+items). Every column is drawn as a whole NumPy array, Faker is only used to
+pre-draw a small pool of realistic strings, and all randomness flows from a
+single seed so that runs are reproducible.
+
+Tables come out in the compact schema from schema.py: integer surrogate
+keys and categorical low-cardinality columns.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from faker import Faker
+
+from schema import (
+    CATEGORIES, CHANNELS, CUSTOMER_SEGMENTS, GENDERS, ORDER_STATUSES, PAYMENT_METHODS,
+    SHIPPING_METHODS, SIZES, SUBCATEGORIES, categorical_from_codes,
+)
+
+# Row counts at scale factor 1.0
+BASE_CUSTOMERS = 1000
+BASE_PRODUCTS = 500
+BASE_ORDERS = 5000
+
+DEFAULT_CHUNK_ROWS = 250_000
+FAKER_POOL_SIZE = 2000
+
+# Stream tags keep each table's random stream independent of the others
+_STREAM_CUSTOMERS = 1
+_STREAM_PRODUCTS = 2
+_STREAM_ORDERS = 3
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    return np.round(values, 2)
+
+
+class DataGenerator:
+    """Seeded, scale-factor driven generator for the lakehouse tables"""
+
+    def __init__(self, scale: float = 1.0, seed: int = 42,
+                 as_of: Optional[datetime] = None, pool_size: int = FAKER_POOL_SIZE):
+        if scale <= 0:
+            raise ValueError("scale must be positive")
+        self.scale = scale
+        self.seed = seed
+        # Anchor generated dates to midnight so the same seed yields the same data all day
+        self.as_of = as_of or datetime.combine(datetime.now().date(), datetime.min.time())
+        self.pool_size = pool_size
+
+        self.num_customers = max(1, int(round(BASE_CUSTOMERS * scale)))
+        self.num_products = max(1, int(round(BASE_PRODUCTS * scale)))
+        self.num_orders = max(1, int(round(BASE_ORDERS * scale)))
+
+        self._pool: Optional[Dict[str, np.ndarray]] = None
+        # Tables may be generated from several threads; the pool is drawn once
+        self._pool_lock = threading.Lock()
+        self._product_prices: Optional[np.ndarray] = None
+
+    def _rng(self, stream: int, block: int = 0) -> np.random.Generator:
+        return np.random.default_rng([self.seed, stream, block])
+
+    @property
+    def pool(self) -> Dict[str, np.ndarray]:
+        """Pre-drawn pool of Faker strings, sampled by index for every table"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self._draw_pool()
+        return self._pool
+
+    def _draw_pool(self) -> Dict[str, np.ndarray]:
+        fake = Faker()
+        fake.seed_instance(self.seed)
+        n = self.pool_size
+        return {
+            'first_name': np.array([fake.first_name() for _ in range(n)], dtype=object),
+            'last_name': np.array([fake.last_name() for _ in range(n)], dtype=object),
+            'email_user': np.array([fake.user_name() for _ in range(n)], dtype=object),
+            'email_domain': np.array([fake.free_email_domain() for _ in range(n)], dtype=object),
+            'phone': np.array([fake.phone_number() for _ in range(n)], dtype=object),
+            'address': np.array([fake.address() for _ in range(n)], dtype=object),
+            'city': np.array([fake.city() for _ in range(n)], dtype=object),
+            'state': np.array([fake.state() for _ in range(n)], dtype=object),
+            'country': np.array([fake.country() for _ in range(n)], dtype=object),
+            'postal_code': np.array([fake.postcode() for _ in range(n)], dtype=object),
+            'catch_phrase': np.array([fake.catch_phrase() for _ in range(n)], dtype=object),
+            'company': np.array([fake.company() for _ in range(n)], dtype=object),
+            'color': np.array([fake.color_name() for _ in range(n)], dtype=object),
+        }
+
+    def _draw(self, rng: np.random.Generator, field: str, size: int) -> np.ndarray:
+        values = self.pool[field]
+        return values[rng.integers(0, len(values), size)]
+
+    def _draw_categorical(self, rng: np.random.Generator, field: str, size: int) -> pd.Categorical:
+        """Draw from the pool as a categorical whose categories are the pool's distinct values"""
+        categories, codes = np.unique(self.pool[field], return_inverse=True)
+        return pd.Categorical.from_codes(codes[rng.integers(0, len(codes), size)], categories=categories)
+
+    def _choice(self, rng: np.random.Generator, column: str, values: List[str], size: int) -> pd.Categorical:
+        return categorical_from_codes(column, values, rng.integers(0, len(values), size))
+
+    def _random_datetimes(self, rng: np.random.Generator, start: datetime,
+                          end: datetime, size: int, unit: str = 'us') -> np.ndarray:
+        start64 = np.datetime64(start).astype(f'datetime64[{unit}]')
+        span = int((np.datetime64(end).astype(f'datetime64[{unit}]') - start64).astype(np.int64))
+        offsets = rng.integers(0, span + 1, size).astype(f'timedelta64[{unit}]')
+        return start64 + offsets
+
+    def customers(self) -> pd.DataFrame:
+        """Generate the customers table"""
+        rng = self._rng(_STREAM_CUSTOMERS)
+        n = self.num_customers
+        first_names = self._draw(rng, 'first_name', n)
+        last_names = self._draw(rng, 'last_name', n)
+        email_numbers = rng.integers(1, 10000, n).astype(str)
+        emails = (self._draw(rng, 'email_user', n).astype(str).astype(object)
+                  + email_numbers.astype(object) + '@'
+                  + self._draw(rng, 'email_domain', n))
+        registration = self._random_datetimes(
+            rng, self.as_of - timedelta(days=730), self.as_of, n, unit='D'
+        )
+        return pd.DataFrame({
+            'customer_id': np.arange(1, n + 1, dtype=np.int32),
+            'first_name': first_names,
+            'last_name': last_names,
+            'email': emails,
+            'phone': self._draw(rng, 'phone', n),
+            'address': self._draw(rng, 'address', n),
+            'city': self._draw(rng, 'city', n),
+            'state': self._draw_categorical(rng, 'state', n),
+            'country': self._draw_categorical(rng, 'country', n),
+            'postal_code': self._draw(rng, 'postal_code', n),
+            'registration_date': registration.astype('datetime64[ns]'),
+            'age': rng.integers(18, 81, n).astype(np.int16),
+            'gender': self._choice(rng, 'gender', GENDERS, n),
+            'customer_segment': self._choice(rng, 'customer_segment', CUSTOMER_SEGMENTS, n),
+            'lifetime_value': _round2(rng.uniform(100, 10000, n)),
+        })
+
+    def products(self) -> pd.DataFrame:
+        """Generate the products table"""
+        rng = self._rng(_STREAM_PRODUCTS)
+        n = self.num_products
+        category_idx = rng.integers(0, len(CATEGORIES), n)
+        subcategory_idx = category_idx * 5 + rng.integers(0, 5, n)
+        dims = rng.integers(5, 51, (3, n)).astype(str).astype(object)
+        prices = _round2(rng.uniform(10, 1000, n))
+        self._product_prices = prices
+        return pd.DataFrame({
+            'product_id': np.arange(1, n + 1, dtype=np.int32),
+            'product_name': self._draw(rng, 'catch_phrase', n),
+            'category': categorical_from_codes('category', CATEGORIES, category_idx),
+            'subcategory': categorical_from_codes('subcategory', SUBCATEGORIES, subcategory_idx),
+            'brand': self._draw(rng, 'company', n),
+            'price': prices,
+            'cost': _round2(rng.uniform(5, 500, n)),
+            'weight': _round2(rng.uniform(0.1, 50, n)),
+            'dimensions': dims[0] + 'x' + dims[1] + 'x' + dims[2],
+            'color': self._draw(rng, 'color', n),
+            'size': self._choice(rng, 'size', SIZES, n),
+            'stock_quantity': rng.integers(0, 1001, n).astype(np.int32),
+            'supplier_id': rng.integers(1, 101, n).astype(np.int16),
+            'rating': np.round(rng.uniform(1, 5, n), 1),
+            'reviews_count': rng.integers(0, 1001, n).astype(np.int32),
+        })
+
+    @property
+    def product_prices(self) -> np.ndarray:
+        if self._product_prices is None:
+            self.products()
+        return self._product_prices
+
+    def _order_dates(self, rng: np.random.Generator, start: int, stop: int) -> np.ndarray:
+        """Order dates over the past year, increasing with the order number.
+
+        Order i falls at a random point within the i-th of num_orders equal
+        slices of the year, so ids are assigned in date order (as a live
+        store would) and each month is a contiguous run of orders.
+        """
+        start64 = np.datetime64(self.as_of - timedelta(days=365)).astype('datetime64[us]')
+        span = int((np.datetime64(self.as_of).astype('datetime64[us]') - start64).astype(np.int64))
+        slots = (np.arange(start, stop) + rng.random(stop - start)) / self.num_orders
+        return start64 + (slots * span).astype(np.int64).astype('timedelta64[us]')
+
+    def _orders_block(self, block: int, start: int, stop: int,
+                      item_offset: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        rng = self._rng(_STREAM_ORDERS, block)
+        n = stop - start
+        order_ids = np.arange(start + 1, stop + 1, dtype=np.int64)
+
+        orders = pd.DataFrame({
+            'order_id': order_ids,
+            'customer_id': rng.integers(1, self.num_customers + 1, n).astype(np.int32),
+            'order_date': self._order_dates(rng, start, stop).astype('datetime64[ns]'),
+            'order_status': self._choice(rng, 'order_status', ORDER_STATUSES, n),
+            'payment_method': self._choice(rng, 'payment_method', PAYMENT_METHODS, n),
+            'shipping_method': self._choice(rng, 'shipping_method', SHIPPING_METHODS, n),
+            'shipping_cost': _round2(rng.uniform(5, 50, n)),
+            'tax_amount': _round2(rng.uniform(10, 200, n)),
+            'discount_amount': _round2(rng.uniform(0, 100, n)),
+            'total_amount': _round2(rng.uniform(50, 2000, n)),
+            'shipping_address': self._draw(rng, 'address', n),
+            'billing_address': self._draw(rng, 'address', n),
+            'currency': categorical_from_codes('currency', ['USD'], np.zeros(n, dtype=np.int64)),
+            'channel': self._choice(rng, 'channel', CHANNELS, n),
+        })
+
+        # Each order gets 1-5 line items; expand orders by their item counts
+        items_per_order = rng.integers(1, 6, n)
+        num_items = int(items_per_order.sum())
+        item_order_ids = np.repeat(order_ids, items_per_order)
+        product_idx = rng.integers(0, self.num_products, num_items)
+        quantity = rng.integers(1, 6, num_items)
+        unit_price = self.product_prices[product_idx] * rng.uniform(0.8, 1.2, num_items)
+
+        order_items = pd.DataFrame({
+            'order_item_id': np.arange(item_offset + 1, item_offset + num_items + 1, dtype=np.int64),
+            'order_id': item_order_ids,
+            'product_id': (product_idx + 1).astype(np.int32),
+            'quantity': quantity.astype(np.int16),
+            'unit_price': _round2(unit_price),
+            'total_price': _round2(unit_price * quantity),
+            'discount_percentage': np.round(rng.uniform(0, 20, num_items), 1),
+        })
+        return orders, order_items
+
+    def iter_order_chunks(self, chunk_rows: int = DEFAULT_CHUNK_ROWS
+                          ) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame]]:
+        """Yield (orders, order_items) chunks of at most chunk_rows orders each.
+
+        Only one chunk is held in memory at a time, so callers that write each
+        chunk out (e.g. to Parquet) keep memory flat as the scale factor grows.
+        Each chunk draws from its own seeded stream, so output is reproducible
+        for a given seed, scale and chunk_rows.
+        """
+        item_offset = 0
+        for block, start in enumerate(range(0, self.num_orders, chunk_rows)):
+            stop = min(start + chunk_rows, self.num_orders)
+            orders, order_items = self._orders_block(block, start, stop, item_offset)
+            item_offset += len(order_items)
+            yield orders, order_items
+
+    def order_tables(self, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Generate orders and order_items fully materialized in memory"""
+        order_chunks: List[pd.DataFrame] = []
+        item_chunks: List[pd.DataFrame] = []
+        for orders, order_items in self.iter_order_chunks(chunk_rows):
+            order_chunks.append(orders)
+            item_chunks.append(order_items)
+        return pd.concat(order_chunks, ignore_index=True), pd.concat(item_chunks, ignore_index=True)
+
+    def generate(self, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict[str, pd.DataFrame]:
+        """Generate all four tables fully materialized in memory"""
+        customers = self.customers()
+        products = self.products()
+        orders, order_items = self.order_tables(chunk_rows)
+        return {
+            'customers': customers,
+            'products': products,
+            'orders': orders,
+            'order_items': order_items,
+        }
@@ -0,0 +1,179 @@
+"""Response encoding: orjson with native NumPy support, and columnar payloads.
+
+JSON is produced by orjson, which writes numeric NumPy arrays and scalars
+straight from their buffers, so analysis results and table columns are
+encoded without first being turned into Python lists and dicts. Endpoints
+returning tables can also answer in a column-oriented JSON layout or as an
+Arrow IPC stream; the client picks one with the Accept header.
+"""
+import io
+from itertools import repeat
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from fastapi.responses import JSONResponse
+
+JSON_MEDIA_TYPE = 'application/json'
+COLUMNAR_MEDIA_TYPE = 'application/vnd.lakehouse.columnar+json'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+TABLE_MEDIA_TYPES = (JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, ARROW_MEDIA_TYPE)
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(value: Any) -> Any:
+    """Encode the values orjson has no native support for"""
+    if isinstance(value, np.ndarray):
+        # Object, string and non-contiguous arrays
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, (pd.Series, pd.Index, pd.Categorical)):
+        return np.asarray(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_bytes(payload: Any) -> bytes:
+    """JSON-encode a payload; NaN and infinities become null"""
+    return orjson.dumps(payload, default=_default, option=_JSON_OPTIONS)
+
+
+class LakehouseJSONResponse(JSONResponse):
+    """Default response class: orjson instead of the stdlib json module"""
+
+    def render(self, content: Any) -> bytes:
+        return json_bytes(content)
+
+
+def negotiate(accept: Optional[str], offered: Sequence[str]) -> Optional[str]:
+    """The offered media type the Accept header prefers, or None if it accepts none.
+
+    Each type takes the quality of the most specific range matching it; ties
+    go to the earlier offer, so a missing header or `*/*` gets the first
+    (default) type.
+    """
+    if not accept:
+        return offered[0]
+    ranges: Dict[str, float] = {}
+    for entry in accept.split(','):
+        media_range, *params = [part.strip() for part in entry.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges[media_range.lower()] = quality
+
+    def quality_of(media_type: str) -> float:
+        kind = media_type.split('/', 1)[0]
+        for media_range in (media_type, f'{kind}/*', '*/*'):
+            if media_range in ranges:
+                return ranges[media_range]
+        return 0.0
+
+    best = max(offered, key=quality_of)
+    return best if quality_of(best) > 0 else None
+
+
+def frame_columns(frame: pd.DataFrame) -> Dict[str, Any]:
+    """A frame as {column: values}, numeric columns as NumPy arrays"""
+    return {column: frame[column].to_numpy() for column in frame.columns}
+
+
+def _value_fragments(values: pd.Series) -> list:
+    """A column's values as JSON fragments, one bytes object per row"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Each label is encoded once and taken by code; code -1 (missing) takes the trailing null
+        labels = [json_bytes(label) for label in values.cat.categories.tolist()] + [b'null']
+        return np.array(labels, dtype=object)[values.cat.codes.to_numpy()].tolist()
+    array = values.to_numpy()
+    if array.dtype.kind in 'biuf' or (array.dtype.kind == 'M' and not np.isnat(array).any()):
+        # orjson writes the whole array from its buffer; numbers and ISO dates contain no commas
+        return orjson.dumps(array, option=_JSON_OPTIONS)[1:-1].split(b',')
+    if array.dtype.kind == 'M':
+        array = np.where(np.isnat(array), None, values.dt.to_pydatetime())
+    return [json_bytes(value) for value in array.tolist()]
+
+
+def records_json(frame: pd.DataFrame) -> bytes:
+    """A frame as a JSON array of row objects, encoded column by column.
+
+    orjson encodes each column on its own, numeric and datetime columns
+    straight from their NumPy buffers, and the rows are joined from the
+    encoded fragments. Unlike DataFrame.to_dict('records') no value is
+    boxed into a per-row dict.
+    """
+    if not len(frame) or not len(frame.columns):
+        return json_bytes([{} for _ in range(len(frame))])
+    parts = []
+    for position, name in enumerate(frame.columns):
+        prefix = (b'{' if position == 0 else b',') + json_bytes(str(name)) + b':'
+        parts += [repeat(prefix), _value_fragments(frame[name])]
+    parts.append(repeat(b'}'))
+    return b'[' + b','.join(map(b''.join, zip(*parts))) + b']'
+
+
+def table_columns(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten an analysis result's data into equal-length columns.
+
+    Analysis results are mostly column arrays already; nested dicts of
+    scalars (e.g. overview metrics) and lone scalars become one-row columns.
+    """
+    columns: Dict[str, Any] = {}
+    for name, value in data.items():
+        if isinstance(value, dict):
+            columns.update({key: [item] for key, item in value.items()})
+        elif isinstance(value, (list, tuple, np.ndarray, pd.Series, pd.Index)):
+            columns[name] = value
+        else:
+            columns[name] = [value]
+    return columns
+
+
+def _metadata_value(value: Any) -> bytes:
+    return value.encode('utf-8') if isinstance(value, str) else json_bytes(value)
+
+
+def _ipc_bytes(table: pa.Table, metadata: Optional[Dict[str, Any]]) -> bytes:
+    if metadata:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            **{key.encode('utf-8'): _metadata_value(value) for key, value in metadata.items()},
+        })
+    buffer = io.BytesIO()
+    with ipc.new_stream(buffer, table.schema) as writer:
+        writer.write_table(table)
+    return buffer.getvalue()
+
+
+def arrow_bytes(columns: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """Columns as an Arrow IPC stream with one record batch.
+
+    Metadata values are stored on the schema: strings as-is, anything else
+    as JSON.
+    """
+    arrays = {}
+    for name, values in columns.items():
+        if isinstance(values, (pd.Series, pd.Index)):
+            arrays[name] = pa.Array.from_pandas(values)
+        elif isinstance(values, np.ndarray) and values.dtype != object:
+            arrays[name] = pa.array(values)
+        else:
+            arrays[name] = pa.array(list(values))
+    return _ipc_bytes(pa.table(arrays), metadata)
+
+
+def frame_arrow_bytes(frame: pd.DataFrame, metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """A frame as an Arrow IPC stream, keeping its column types"""
+    return _ipc_bytes(pa.Table.from_pandas(frame, preserve_index=False), metadata)
@@ -0,0 +1,575 @@
+"""Vectorized executor for the query plans built in plan.py.
+
+Intermediate results are relations: a row count, the row positions each
+reached table contributes (positions into the lakehouse tables) and any
+computed columns. Base columns are only gathered when an operator reads
+them, so a plan touches exactly the columns the planner kept. Joins follow
+the lakehouse's shared positional join index instead of hashing keys, and
+group-bys run on integer codes with np.bincount.
+
+Scans of the stratified sample (approximate plans) produce relations that
+also know each row's sampled order and month. Aggregating one yields
+weighted estimates plus a `<metric>_error` column with the half-width of
+the 95% confidence interval. Sketch-backed nodes report their bounds the
+same way.
+
+A lakehouse in chunked execution mode (see chunked.py) streams the
+aggregations over its fact tables instead, including the ones maintained
+aggregates would otherwise answer.
+
+Scans report the rows they read and operators the bytes of the arrays they
+allocate to the current request's metrics (see metrics.py).
+"""
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import count
+from plan import (
+    LEAVES, SAMPLE_UNIT_COLUMNS, Aggregate, DistinctSketch, Filter, GroupBy, HeavyHitters, Join,
+    MaterializedScan, Metric, Node, Order, QuantileSketch, Quantiles, QueryPlan, SampleScan, Scan, TopK,
+    share_work, unmaterialize,
+)
+from sketches import SAMPLE_MAX_FRACTION, Z_95
+from timefilter import truncate_dates
+
+# How each table is reached from the table referencing it: (source table, join index key)
+JOIN_PATHS = {
+    'orders': ('order_items', 'item_order'),
+    'products': ('order_items', 'item_product'),
+    'customers': ('orders', 'order_customer'),
+}
+PRIMARY_KEYS = {
+    'customers': 'customer_id',
+    'products': 'product_id',
+    'orders': 'order_id',
+    'order_items': 'order_item_id',
+}
+
+# Group-by key spaces up to this many slots per input row use a dense bincount
+_DENSE_GROUPS_PER_ROW = 4
+
+
+def _allocated(*arrays: Any):
+    count('bytes_allocated', sum(getattr(array, 'nbytes', 0) for array in arrays))
+
+
+class Design:
+    """Sampling design of a sampled relation: each row's sampled order and month (stratum)"""
+
+    def __init__(self, unit: np.ndarray, stratum: np.ndarray, population: np.ndarray,
+                 sampled: np.ndarray, units: int, note: str):
+        self.unit = unit
+        self.stratum = stratum
+        self.population = population
+        self.sampled = sampled
+        self.units = max(units, 1)
+        self.note = note
+
+    def take(self, rows: np.ndarray) -> 'Design':
+        return Design(self.unit[rows], self.stratum[rows], self.population, self.sampled, self.units, self.note)
+
+    @property
+    def weights(self) -> np.ndarray:
+        """Orders each sampled order stands for, per stratum"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.sampled > 0, self.population / np.maximum(self.sampled, 1), 0.0)
+
+
+class Relation:
+    """Rows of an intermediate result, as base-table positions plus computed columns"""
+
+    def __init__(self, lakehouse, length: int,
+                 positions: Optional[Dict[str, Optional[np.ndarray]]] = None,
+                 columns: Optional[Dict[str, Any]] = None,
+                 design: Optional[Design] = None, approximation: Optional[str] = None):
+        self.lakehouse = lakehouse
+        self.length = length
+        # None stands for "the first `length` rows, in order" of a scanned table
+        self.positions: Dict[str, Optional[np.ndarray]] = positions or {}
+        self.columns: Dict[str, Any] = columns or {}
+        # Set for rows of the stratified sample
+        self.design = design
+        # How approximate columns were estimated, for results built from samples or sketches
+        self.approximation = approximation
+
+    def table_positions(self, table: str) -> Optional[np.ndarray]:
+        """Positions of each row in a base table, joining through the join index if needed"""
+        if table not in self.positions:
+            if table not in JOIN_PATHS:
+                raise ValueError(f"Cannot join {table} from {sorted(self.positions)}")
+            source, key = JOIN_PATHS[table]
+            source_positions = self.table_positions(source)
+            index = self.lakehouse.join_index()[key]
+            if source_positions is None:
+                self.positions[table] = index[:self.length]
+            else:
+                self.positions[table] = index[source_positions]
+                _allocated(self.positions[table])
+        return self.positions[table]
+
+    def column(self, name: str) -> Any:
+        """Values of a computed or base column for every row"""
+        if name not in self.columns:
+            table, column = name.split('.', 1)
+            positions = self.table_positions(table)
+            series = getattr(self.lakehouse, table)[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                codes = series.cat.codes.to_numpy()
+                codes = codes[:self.length] if positions is None else codes[positions]
+                self.columns[name] = pd.Categorical.from_codes(codes, dtype=series.dtype)
+            elif isinstance(series.dtype, np.dtype):
+                values = series.to_numpy()
+                self.columns[name] = values[:self.length] if positions is None else values[positions]
+            else:
+                # Extension (e.g. string) columns: gather before converting, not after
+                rows = series.iloc[:self.length] if positions is None else series.take(positions)
+                self.columns[name] = rows.to_numpy()
+            _allocated(self.columns[name])
+        return self.columns[name]
+
+    def take(self, rows: np.ndarray) -> 'Relation':
+        """Relation holding the given rows, in the given order"""
+        positions = {
+            table: rows if table_rows is None else table_rows[rows]
+            for table, table_rows in self.positions.items()
+        }
+        columns = {name: values[rows] for name, values in self.columns.items()}
+        _allocated(*positions.values(), *columns.values())
+        design = self.design.take(rows) if self.design is not None else None
+        return Relation(self.lakehouse, len(rows), positions, columns, design, self.approximation)
+
+
+def _key_codes(relation: Relation, key: str, grain: Optional[str]
+               ) -> Tuple[np.ndarray, int, Optional[np.ndarray], Optional[str]]:
+    """Integer group codes for a key: (codes, code space, labels by code, table if positional).
+
+    Surrogate keys group on dimension row positions, categoricals on their
+    codes and other columns on codes factorized once over the base table.
+    Codes are -1 for rows without a value.
+    """
+    table, column = key.split('.', 1)
+    lakehouse = relation.lakehouse
+    if key not in relation.columns and PRIMARY_KEYS.get(table) == column:
+        positions = relation.table_positions(table)
+        if positions is None:
+            positions = np.arange(relation.length)
+        return positions, len(getattr(lakehouse, table)), None, table
+
+    if key not in relation.columns:
+        series = getattr(lakehouse, table)[column]
+        if not isinstance(series.dtype, pd.CategoricalDtype) and series.dtype.kind != 'M':
+            codes, uniques = pd.factorize(series, sort=True)
+            positions = relation.table_positions(table)
+            codes = codes[:relation.length] if positions is None else codes[positions]
+            return codes, len(uniques), np.asarray(uniques, dtype=object), None
+
+    values = relation.column(key)
+    if isinstance(values, pd.Categorical):
+        return values.codes.astype(np.int64), len(values.categories), np.asarray(values.categories, dtype=object), None
+    if np.asarray(values).dtype.kind == 'M':
+        buckets, codes = np.unique(truncate_dates(np.asarray(values), grain or 'D'), return_inverse=True)
+        return codes, len(buckets), buckets.astype(str).astype(object), None
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, len(uniques), np.asarray(uniques, dtype=object), None
+
+
+def metric_values(metric: Metric, relation: Relation, valid: Optional[np.ndarray],
+            group_of_row: np.ndarray, groups: int) -> np.ndarray:
+    if metric.func == 'count':
+        return np.bincount(group_of_row, minlength=groups)
+    values = np.asarray(relation.column(metric.column))
+    if valid is not None:
+        values = values[valid]
+    if metric.func == 'count_distinct':
+        value_codes, uniques = pd.factorize(values)
+        pairs = np.unique(group_of_row * max(len(uniques), 1) + value_codes)
+        return np.bincount(pairs // max(len(uniques), 1), minlength=groups)
+    if groups == 1:
+        # A single group (e.g. a global total) uses numpy's more accurate pairwise sum
+        sums = np.array([values.sum(dtype=np.float64)])
+    else:
+        sums = np.bincount(group_of_row, weights=values.astype(np.float64), minlength=groups)
+    if metric.func == 'sum':
+        return sums.astype(np.int64) if values.dtype.kind in 'iu' else sums
+    if metric.func == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / np.bincount(group_of_row, minlength=groups)
+    raise ValueError(f"Unknown aggregate function: {metric.func}")
+
+
+def _variance(y: np.ndarray, pair_group: np.ndarray, pair_stratum: np.ndarray, groups: int,
+              design: Design) -> np.ndarray:
+    """Variance of stratified totals: the sum over months of N^2 (1 - n/N) s^2 / n.
+
+    y holds one observation per (group, sampled order) pair; sampled orders
+    of a month missing from a group observe zero.
+    """
+    strata = max(len(design.population), 1)
+    cells, inverse = np.unique(pair_group * strata + pair_stratum, return_inverse=True)
+    s1 = np.bincount(inverse, weights=y, minlength=len(cells))
+    s2 = np.bincount(inverse, weights=y * y, minlength=len(cells))
+    stratum = cells % strata
+    n = design.sampled[stratum].astype(np.float64)
+    population = design.population[stratum].astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spread = np.where(n > 1, (s2 - s1 * s1 / n) / (n - 1), 0.0)
+        cell_variance = np.where(n > 0, population * population * (1 - n / population) * spread / n, 0.0)
+    return np.bincount(cells // strata, weights=np.maximum(cell_variance, 0.0), minlength=groups)
+
+
+def _estimate(metric: Metric, relation: Relation, valid: Optional[np.ndarray], group_of_row: np.ndarray,
+              groups: int, design: Design) -> Tuple[np.ndarray, np.ndarray]:
+    """Estimate of a metric per group from sampled rows, and its 95% error bound"""
+    # All rows of one sampled order within a group form a single observation
+    pairs, first, inverse = np.unique(group_of_row * design.units + design.unit,
+                                      return_index=True, return_inverse=True)
+    pair_group = pairs // design.units
+    pair_stratum = design.stratum[first]
+    weight = design.weights[pair_stratum]
+    rows = np.bincount(inverse, minlength=len(pairs)).astype(np.float64)
+    integral = True
+    if metric.func == 'count':
+        y = rows
+    elif metric.func == 'count_distinct':
+        if metric.column not in SAMPLE_UNIT_COLUMNS:
+            raise ValueError(f"Cannot estimate distinct {metric.column} from a sample of orders")
+        y = np.ones(len(pairs))
+    else:
+        values = np.asarray(relation.column(metric.column))
+        integral = values.dtype.kind in 'iu'
+        if valid is not None:
+            values = values[valid]
+        y = np.bincount(inverse, weights=values.astype(np.float64), minlength=len(pairs))
+
+    total = np.bincount(pair_group, weights=y * weight, minlength=groups)
+    if metric.func == 'mean':
+        # Ratio estimator, with the variance of its linearization
+        counts = np.bincount(pair_group, weights=rows * weight, minlength=groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = total / counts
+            residual = y - np.nan_to_num(ratio)[pair_group] * rows
+            error = Z_95 * np.sqrt(_variance(residual, pair_group, pair_stratum, groups, design)) / counts
+        return ratio, error
+    if metric.func not in ('count', 'count_distinct', 'sum'):
+        raise ValueError(f"Unknown aggregate function: {metric.func}")
+    error = Z_95 * np.sqrt(_variance(y, pair_group, pair_stratum, groups, design))
+    return (np.rint(total).astype(np.int64) if integral else total), error
+
+
+def _aggregate_columns(node: Aggregate, relation: Relation, valid: Optional[np.ndarray],
+                       group_of_row: np.ndarray, groups: int) -> Dict[str, Any]:
+    if relation.design is None:
+        return {metric.name: metric_values(metric, relation, valid, group_of_row, groups) for metric in node.metrics}
+    design = relation.design if valid is None else relation.design.take(valid)
+    columns = {}
+    for metric in node.metrics:
+        columns[metric.name], columns[f'{metric.name}_error'] = _estimate(
+            metric, relation, valid, group_of_row, groups, design
+        )
+    return columns
+
+
+def group_rows(relation: Relation, keys: Sequence[str], grain: Optional[str]
+               ) -> Tuple[Dict[str, np.ndarray], Dict[str, Any], Optional[np.ndarray], np.ndarray, int]:
+    """Groups of a relation's rows by key, ordered by key.
+
+    Returns the key values per group (dimension row positions for surrogate
+    keys, labels otherwise), the mask of rows with every key present (None
+    when all are), each kept row's group and the number of groups.
+    """
+    parts = [_key_codes(relation, key, grain) for key in keys]
+    sizes = [max(size, 1) for _, size, _, _ in parts]
+    combined = np.asarray(parts[0][0], dtype=np.int64)
+    valid = combined >= 0
+    for (codes, _, _, _), size in zip(parts[1:], sizes[1:]):
+        codes = np.asarray(codes, dtype=np.int64)
+        valid &= codes >= 0
+        combined = combined * size + codes
+
+    # Rows without a key value (unmatched joins, missing values) are dropped
+    all_valid = bool(valid.all())
+    if not all_valid:
+        combined = combined[valid]
+    total = int(np.prod(sizes))
+    if total <= _DENSE_GROUPS_PER_ROW * max(len(combined), 1):
+        groups = np.flatnonzero(np.bincount(combined, minlength=total))
+        lookup = np.full(total, -1, dtype=np.int64)
+        lookup[groups] = np.arange(len(groups))
+        group_of_row = lookup[combined]
+    else:
+        groups, group_of_row = np.unique(combined, return_inverse=True)
+
+    positions: Dict[str, np.ndarray] = {}
+    columns: Dict[str, Any] = {}
+    for key, (_, _, labels, table), key_codes in zip(keys, parts, np.unravel_index(groups, sizes)):
+        if table is not None:
+            positions[table] = key_codes
+        else:
+            columns[key] = labels[key_codes]
+    _allocated(combined, valid, group_of_row, *positions.values(), *columns.values())
+    return positions, columns, None if all_valid else valid, group_of_row, len(groups)
+
+
+def _aggregate(node: Aggregate, relation: Relation) -> Relation:
+    keys, grain = (node.source.keys, node.source.grain) if isinstance(node.source, GroupBy) else ((), None)
+    approximation = relation.design.note if relation.design is not None else None
+    if not keys:
+        group_of_row = np.zeros(relation.length, dtype=np.int64)
+        columns = _aggregate_columns(node, relation, None, group_of_row, 1)
+        return Relation(relation.lakehouse, 1, {}, columns, approximation=approximation)
+
+    positions, columns, valid, group_of_row, groups = group_rows(relation, keys, grain)
+    aggregated = _aggregate_columns(node, relation, valid, group_of_row, groups)
+    _allocated(*aggregated.values())
+    columns.update(aggregated)
+    return Relation(relation.lakehouse, groups, positions, columns, approximation=approximation)
+
+
+def _materialized(node: MaterializedScan, lakehouse) -> Relation:
+    view = lakehouse.aggregates.view(node.fact, node.keys, node.grain)
+    columns = dict(view['columns'])
+    for metric in node.metrics:
+        columns[metric.name] = view['metrics'][(metric.func, metric.column)]
+    length = len(next(iter(view['metrics'].values())))
+    return Relation(lakehouse, length, dict(view['positions']), columns)
+
+
+def _maintained_top(node: TopK, lakehouse) -> Optional[Relation]:
+    """A ranking of a maintained aggregate, read from its maintained top-k.
+
+    None when the aggregates keep no top-k for the ranked metric or it is
+    shorter than k; the view is then read whole and ranked.
+    """
+    scan = node.source
+    ranked = {metric.name: metric for metric in scan.metrics}.get(node.by)
+    top = lakehouse.aggregates.top(scan.fact, scan.keys, (ranked.func, ranked.column), node.k) if ranked else None
+    if top is None:
+        return None
+    columns = dict(top['columns'])
+    for metric in scan.metrics:
+        columns[metric.name] = top['metrics'][(metric.func, metric.column)]
+    return Relation(lakehouse, len(next(iter(top['positions'].values()))), dict(top['positions']), columns)
+
+
+def _sampled(node: SampleScan, lakehouse) -> Optional[Relation]:
+    """Rows of the stratified sample within the scan's time range.
+
+    None when the sample holds too large a share of the orders of the months
+    it touches to be worth estimating from; the scan is then run exactly.
+    """
+    sample = lakehouse.sketches.sample
+    if node.table == 'orders':
+        state = sample.state
+    else:
+        state, item_positions, item_unit = sample.items(lakehouse)
+    in_window = np.ones(len(state.positions), dtype=bool)
+    start, end = node.time_range or (None, None)
+    if start:
+        in_window &= state.dates >= np.datetime64(start)
+    if end:
+        in_window &= state.dates < np.datetime64(end)
+    touched = np.bincount(state.stratum[in_window], minlength=len(state.months)) > 0
+    if state.sampled[touched].sum() > SAMPLE_MAX_FRACTION * state.population[touched].sum():
+        return None
+
+    if node.table == 'orders':
+        unit = np.flatnonzero(in_window)
+        positions = state.positions[unit]
+    else:
+        rows = np.flatnonzero(in_window[item_unit])
+        positions, unit = item_positions[rows], item_unit[rows]
+    units = int(np.count_nonzero(in_window))
+    months = int(np.count_nonzero(touched))
+    design = Design(unit, state.stratum[unit], state.population, state.sampled, len(state.positions),
+                    f"95% confidence, stratified sample of {units:,} orders over {months} month{'s' if months != 1 else ''}")
+    _allocated(positions, design.unit, design.stratum)
+    return Relation(lakehouse, len(positions), {node.table: positions}, design=design)
+
+
+def _sketched(node: Node, lakehouse) -> Relation:
+    """Results of the nodes answered from the monthly sketches"""
+    sketches = lakehouse.sketches
+    start, end = node.time_range or (None, None)
+    if isinstance(node, HeavyHitters):
+        hits = sketches.heavy_hitters(lakehouse, node.key, start, end, node.k)
+        columns = {node.metric.name: hits['estimate'], f'{node.metric.name}_error': hits['error']}
+        return Relation(lakehouse, len(hits['positions']), {node.key.split('.', 1)[0]: hits['positions']},
+                        columns, approximation=hits['note'])
+    if isinstance(node, DistinctSketch):
+        distinct = sketches.distinct_customers(lakehouse, start, end)
+        columns = {node.metric.name: np.array([round(distinct['estimate'])]),
+                   f'{node.metric.name}_error': np.array([distinct['error']])}
+        return Relation(lakehouse, 1, {}, columns, approximation=distinct['note'])
+    quantiles = sketches.order_value_quantiles(lakehouse, node.quantiles, start, end)
+    columns = {'quantile': np.array(node.quantiles), 'value': quantiles['values'], 'value_error': quantiles['error']}
+    return Relation(lakehouse, len(node.quantiles), {}, columns, approximation=quantiles['note'])
+
+
+def _top_rows(values: np.ndarray, k: int) -> np.ndarray:
+    """Rows of the k largest values, largest first and ties in row order"""
+    if k >= len(values):
+        return np.argsort(-values, kind='stable')
+    # Only rows reaching the k-th largest value can rank; sort just those
+    threshold = np.partition(values, len(values) - k)[len(values) - k]
+    candidates = np.flatnonzero(values >= threshold)
+    return candidates[np.argsort(-values[candidates], kind='stable')[:k]]
+
+
+def _run(node: Node, lakehouse, memo: Dict[Node, Relation]) -> Relation:
+    if node in memo:
+        return memo[node]
+    if isinstance(node, SampleScan):
+        relation = _sampled(node, lakehouse)
+        if relation is None:
+            relation = _run(Scan(node.table, node.columns, node.time_range), lakehouse, memo)
+        else:
+            count('rows_scanned', relation.length)
+    elif isinstance(node, Scan):
+        if node.time_range is not None:
+            rows = lakehouse.time_slice(*node.time_range)[node.table]
+            relation = Relation(lakehouse, len(rows), {node.table: rows})
+            _allocated(rows)
+        else:
+            relation = Relation(lakehouse, len(getattr(lakehouse, node.table)), {node.table: None})
+        count('rows_scanned', relation.length)
+    elif isinstance(node, MaterializedScan):
+        if lakehouse.chunks is not None:
+            # Maintained aggregates are built from the whole fact tables; stream the group-by instead
+            relation = _run(unmaterialize(node), lakehouse, memo)
+        else:
+            relation = _materialized(node, lakehouse)
+            count('rows_scanned', relation.length)
+    elif isinstance(node, TopK) and isinstance(node.source, MaterializedScan) and lakehouse.chunks is None:
+        relation = _maintained_top(node, lakehouse)
+        if relation is None:
+            source = _run(node.source, lakehouse, memo)
+            relation = source.take(_top_rows(np.asarray(source.column(node.by)), node.k))
+        else:
+            count('rows_scanned', relation.length)
+    elif isinstance(node, (HeavyHitters, DistinctSketch, QuantileSketch)):
+        relation = _sketched(node, lakehouse)
+        count('rows_scanned', relation.length)
+    elif isinstance(node, GroupBy):
+        raise ValueError("GroupBy must feed an Aggregate")
+    elif isinstance(node, Aggregate):
+        if lakehouse.chunks is not None and lakehouse.chunks.streams(node):
+            relation = lakehouse.chunks.aggregate(node, lakehouse)
+        else:
+            source = node.source.source if isinstance(node.source, GroupBy) else node.source
+            relation = _aggregate(node, _run(source, lakehouse, memo))
+    else:
+        source = _run(node.source, lakehouse, memo)
+        if isinstance(node, Filter):
+            values = np.asarray(source.column(node.column))
+            keep = np.ones(source.length, dtype=bool)
+            if node.start is not None:
+                keep &= values >= np.datetime64(node.start)
+            if node.end is not None:
+                keep &= values < np.datetime64(node.end)
+            relation = source.take(np.flatnonzero(keep))
+        elif isinstance(node, Join):
+            positions = source.table_positions(node.table)
+            # Inner join: drop rows whose foreign key has no match
+            relation = source if positions is None or source.length == 0 or positions.min() >= 0 \
+                else source.take(np.flatnonzero(positions >= 0))
+        elif isinstance(node, TopK):
+            relation = source.take(_top_rows(np.asarray(source.column(node.by)), node.k))
+        elif isinstance(node, Quantiles):
+            values = np.asarray(source.column(node.column), dtype=np.float64)
+            quantiles = np.quantile(values, node.quantiles) if len(values) else np.full(len(node.quantiles), np.nan)
+            relation = Relation(lakehouse, len(node.quantiles), {},
+                                {'quantile': np.array(node.quantiles), 'value': quantiles})
+        elif isinstance(node, Order):
+            order = pd.Series(np.asarray(source.column(node.by))).sort_values(
+                ascending=not node.descending, kind='stable'
+            ).index.to_numpy()
+            relation = source.take(order)
+        else:
+            raise ValueError(f"Unknown plan node: {type(node).__name__}")
+    memo[node] = relation
+    return relation
+
+
+def run(node: Node, lakehouse, memo: Optional[Dict[Node, Relation]] = None) -> Relation:
+    """Run one optimized plan node; identical subplans within memo run once"""
+    return _run(node, lakehouse, {} if memo is None else memo)
+
+
+def output_columns(node: Node) -> List[str]:
+    """Columns a node's result exposes, in order"""
+    if isinstance(node, (Scan, SampleScan)):
+        return list(node.columns)
+    if isinstance(node, MaterializedScan):
+        return list(node.keys) + [metric.name for metric in node.metrics]
+    if isinstance(node, HeavyHitters):
+        return [node.key, node.metric.name]
+    if isinstance(node, DistinctSketch):
+        return [node.metric.name]
+    if isinstance(node, (Quantiles, QuantileSketch)):
+        return ['quantile', 'value']
+    if isinstance(node, Aggregate):
+        keys = list(node.source.keys) if isinstance(node.source, GroupBy) else []
+        return keys + [metric.name for metric in node.metrics]
+    if isinstance(node, Join):
+        return output_columns(node.source) + [c for c in node.columns if c not in output_columns(node.source)]
+    return output_columns(node.source)
+
+
+def execute(plan: QueryPlan, lakehouse, memo: Optional[Dict[Node, Relation]] = None,
+            shared: Optional[Dict[Node, Node]] = None) -> Dict[str, pd.DataFrame]:
+    """Run every output of an optimized plan; identical subplans run once.
+
+    Approximate columns come with a `<column>_error` column, and the frame's
+    attrs['approximation'] says how they were estimated. Plans run with the
+    same memo also share subplans across each other; `shared` maps output
+    nodes to their plan.share_work rewrites (see Batch).
+    """
+    memo = {} if memo is None else memo
+    shared = shared or {}
+    results = {}
+    for name, node in plan.outputs:
+        relation = _run(shared.get(node, node), lakehouse, memo)
+        columns = {}
+        for column in output_columns(node):
+            columns[column] = relation.column(column)
+            if f'{column}_error' in relation.columns:
+                columns[f'{column}_error'] = relation.columns[f'{column}_error']
+        results[name] = pd.DataFrame(columns, index=pd.RangeIndex(relation.length))
+        if relation.approximation:
+            results[name].attrs['approximation'] = relation.approximation
+    return results
+
+
+def _nodes(node: Node) -> Iterator[Node]:
+    yield node
+    if not isinstance(node, LEAVES):
+        yield from _nodes(node.source)
+
+
+class Batch:
+    """A batch of optimized plans run with one memo, so work they share runs once.
+
+    Plans are executed on demand, in any order; a plan whose result is
+    cached elsewhere never runs.
+    """
+
+    def __init__(self, plans: Sequence[QueryPlan], lakehouse):
+        self.plans = list(plans)
+        self.lakehouse = lakehouse
+        self.shared = share_work([node for plan in self.plans for _, node in plan.outputs])
+        self.memo: Dict[Node, Relation] = {}
+        self.planned: Set[Node] = set()
+        self.subplans = 0
+
+    def execute(self, index: int) -> Dict[str, pd.DataFrame]:
+        plan = self.plans[index]
+        nodes = {subplan for _, node in plan.outputs for subplan in _nodes(self.shared[node])}
+        self.planned |= nodes
+        self.subplans += len(nodes)
+        return execute(plan, self.lakehouse, self.memo, self.shared)
+
+    def stats(self) -> Dict[str, int]:
+        """Subplans of the executed plans, counted per plan, and how many actually ran"""
+        return {'subplans': self.subplans, 'executed': len(self.planned & self.memo.keys())}
@@ -0,0 +1,89 @@
+"""Bounded worker pool for running CPU-heavy pandas work off the event loop.
+
+Requests beyond the worker count wait in a bounded queue; once both are
+full, new submissions fail fast with ExecutorOverloaded so the API can shed
+load with a 503 instead of letting latency grow without limit.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+EXECUTOR_KINDS = ('thread', 'process')
+
+
+class ExecutorOverloaded(Exception):
+    """Raised when the executor's workers and queue are both full"""
+
+
+class BoundedExecutor:
+    """Thread or process pool with a cap on queued work"""
+
+    def __init__(self, kind: str = 'thread', max_workers: int = 4, max_queue: int = 32):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"executor kind must be one of {EXECUTOR_KINDS}")
+        if max_workers < 1 or max_queue < 0:
+            raise ValueError("max_workers must be >= 1 and max_queue >= 0")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        # Process workers are spawned rather than forked: a fork would copy locks
+        # that the server's threads (such as the warm-up) hold at that moment
+        self._pool: Executor = (
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analytics')
+            if kind == 'thread' else ProcessPoolExecutor(max_workers=max_workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> 'BoundedExecutor':
+        return cls(
+            kind=os.getenv('ANALYTICS_EXECUTOR', 'thread'),
+            max_workers=int(os.getenv('ANALYTICS_WORKERS', str(min(4, os.cpu_count() or 1)))),
+            max_queue=int(os.getenv('ANALYTICS_MAX_QUEUE', '32')),
+        )
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn in the pool, or raise ExecutorOverloaded if the queue is full"""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorOverloaded(
+                    f"{self._in_flight} requests in flight (limit {self.max_workers + self.max_queue})"
+                )
+            self._in_flight += 1
+        try:
+            future = self._pool.submit(partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release(None)
+            raise
+        # Release the slot when the work finishes, even if the caller stops waiting
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+            self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'kind': self.kind,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.max_workers),
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
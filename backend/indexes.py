@@ -0,0 +1,312 @@
+"""Secondary indexes and an access planner for filtered, sorted table pages.
+
+Two kinds of index cover the filterable columns:
+
+- SortedIndex: a table's row positions ordered by one column, and the
+  column's values in that order. Ties keep row order. A range or
+  equality predicate is two binary searches. Its matching rows are one
+  contiguous slice of the positions, already sorted by the column.
+- CategoryIndex: posting lists for a categorical column. The category's
+  code comes from a dict lookup of its label. An offsets array then gives
+  that code's slice of row positions.
+
+select() takes each predicate's exact match count from its index in
+O(log n). It drives the lookup from the most selective predicate and checks
+the others only on those candidate rows. A filtered page therefore costs
+time in proportion to its candidates, not the table. When even the best index
+keeps a large share of the rows, one vectorized pass over the columns is
+cheaper than gathering and sorting candidates, so the planner scans instead.
+A sort on another column makes candidates costlier (they must be sorted), so
+that case switches to scanning sooner; the scan then reads matches in order
+from the sort column's index.
+
+Rows are only ever appended (ingested orders). An index absorbs them by
+merging its sorted tail in, not by being rebuilt.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from export import keyset_start
+from schema import format_id
+
+# Scan instead of using an index once it keeps more than this share of the rows,
+# or more than the smaller share when its matches must be re-sorted on another column
+MAX_INDEX_SELECTIVITY = 0.3
+MAX_RESORT_SELECTIVITY = 0.05
+
+
+@dataclass(frozen=True)
+class Range:
+    """low <= column <= high; a missing bound is open, and high_inclusive=False makes high exclusive"""
+    column: str
+    low: Any = None
+    high: Any = None
+    high_inclusive: bool = True
+
+
+@dataclass(frozen=True)
+class In:
+    """column equals one of values (category labels for categorical columns)"""
+    column: str
+    values: Tuple[Any, ...]
+
+
+Predicate = Union[Range, In]
+
+
+def _position_dtype(rows: int) -> type:
+    return np.int32 if rows <= np.iinfo(np.int32).max else np.int64
+
+
+def column_values(column: pd.Series) -> np.ndarray:
+    """The values an index orders by: codes for categoricals, else the column itself"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy()
+    return column.to_numpy()
+
+
+def _keys(values: Sequence[Any], dtype: np.dtype) -> np.ndarray:
+    """Equality keys as an array of the column's dtype, dropping keys it cannot hold"""
+    if dtype.kind == 'M':
+        return np.asarray([np.datetime64(value, 'ns') for value in values], dtype=dtype)
+    keys = np.asarray(values)
+    if keys.dtype.kind in 'iu' and dtype.kind in 'iu':
+        # A wider key dtype would make NumPy cast the whole column to compare
+        limits = np.iinfo(dtype)
+        keys = keys[(keys >= limits.min) & (keys <= limits.max)]
+    return keys.astype(dtype) if len(keys) else np.empty(0, dtype)
+
+
+class SortedIndex:
+    """Row positions ordered by a column's values, for range and equality lookups"""
+
+    def __init__(self, order: np.ndarray, values: np.ndarray):
+        self.order = order
+        self.values = values
+        # NaN and NaT sort last and match no predicate
+        self.valid = len(values) - int(np.count_nonzero(pd.isna(values)))
+
+    @classmethod
+    def build(cls, column: pd.Series) -> 'SortedIndex':
+        values = column_values(column)
+        order = np.argsort(values, kind='stable').astype(_position_dtype(len(values)))
+        return cls._of(column, order, values[order])
+
+    @classmethod
+    def _of(cls, column: pd.Series, order: np.ndarray, values: np.ndarray) -> 'SortedIndex':
+        return cls(order, values)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def nbytes(self) -> int:
+        return self.order.nbytes + self.values.nbytes
+
+    def extended(self, column: pd.Series) -> 'SortedIndex':
+        """A new index that also covers the rows appended to column since this one was built"""
+        known = len(self)
+        if known >= len(column):
+            return self
+        tail = column_values(column.iloc[known:])
+        tail_order = np.argsort(tail, kind='stable')
+        tail_values = tail[tail_order]
+        # Appended rows go after every existing row with an equal value, so ties stay in row order
+        at = np.searchsorted(self.values[:self.valid], tail_values, side='right')
+        at[pd.isna(tail_values)] = len(self)
+        dtype = _position_dtype(len(column))
+        order = np.insert(self.order.astype(dtype, copy=False), at, (known + tail_order).astype(dtype))
+        return self._of(column, order, np.insert(self.values, at, tail_values))
+
+    def _bound(self, value: Any) -> Any:
+        return np.datetime64(value, 'ns') if self.values.dtype.kind == 'M' else value
+
+    def slices(self, predicate: Predicate) -> List[Tuple[int, int]]:
+        """Start/stop offsets into order of the rows matching the predicate, in value order"""
+        values = self.values[:self.valid]
+        if isinstance(predicate, In):
+            keys = np.unique(_keys(predicate.values, values.dtype))
+            starts = np.searchsorted(values, keys, side='left')
+            stops = np.searchsorted(values, keys, side='right')
+            return [(int(start), int(stop)) for start, stop in zip(starts, stops) if stop > start]
+        start = 0 if predicate.low is None else int(np.searchsorted(values, self._bound(predicate.low), 'left'))
+        stop = self.valid if predicate.high is None else int(np.searchsorted(
+            values, self._bound(predicate.high), 'right' if predicate.high_inclusive else 'left'))
+        return [(start, stop)] if stop > start else []
+
+
+class CategoryIndex(SortedIndex):
+    """Posting lists of a categorical column: each code's row positions as one slice of order"""
+
+    def __init__(self, order: np.ndarray, values: np.ndarray, categories: Sequence[Any]):
+        super().__init__(order, values)
+        self.codes = {label: code for code, label in enumerate(categories)}
+        # offsets[code]:offsets[code + 1] is the code's posting list; missing values (-1) come first
+        counts = np.bincount(values + 1, minlength=len(categories) + 1)
+        self.offsets = np.cumsum(counts)
+
+    @classmethod
+    def _of(cls, column: pd.Series, order: np.ndarray, values: np.ndarray) -> 'CategoryIndex':
+        return cls(order, values, column.cat.categories)
+
+    def slices(self, predicate: Predicate) -> List[Tuple[int, int]]:
+        if not isinstance(predicate, In):
+            raise ValueError(f"{predicate.column} only supports equality filters")
+        codes = sorted({self.codes[value] for value in predicate.values if value in self.codes})
+        return [(int(self.offsets[code]), int(self.offsets[code + 1])) for code in codes
+                if self.offsets[code + 1] > self.offsets[code]]
+
+
+def build_index(column: pd.Series) -> SortedIndex:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return CategoryIndex.build(column)
+    return SortedIndex.build(column)
+
+
+class TableIndexes:
+    """The indexes of one table, each built the first time a query filters or sorts on its column.
+
+    Instances cover a fixed number of rows. extended() returns a new one for
+    a grown table, so readers holding the old one stay consistent.
+    """
+
+    def __init__(self, rows: int, indexes: Optional[Dict[str, SortedIndex]] = None):
+        self.rows = rows
+        self._indexes = dict(indexes or {})
+
+    def extended(self, frame: pd.DataFrame) -> 'TableIndexes':
+        if len(frame) == self.rows:
+            return self
+        return TableIndexes(len(frame), {column: index.extended(frame[column])
+                                         for column, index in list(self._indexes.items())})
+
+    def index(self, frame: pd.DataFrame, column: str) -> SortedIndex:
+        """The column's index; frame must be the table these indexes cover"""
+        index = self._indexes.get(column)
+        if index is None:
+            index = self._indexes.setdefault(column, build_index(frame[column].iloc[:self.rows]))
+        return index
+
+    @property
+    def nbytes(self) -> int:
+        return sum(index.nbytes for index in list(self._indexes.values()))
+
+
+def _matches(frame: pd.DataFrame, predicate: Predicate, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Boolean mask of the rows (all, or the given positions) that satisfy the predicate"""
+    column = frame[predicate.column]
+    values = column_values(column)
+    if rows is not None:
+        values = values[rows]
+    if isinstance(predicate, In):
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            labels = set(predicate.values)
+            keys = [code for code, label in enumerate(column.cat.categories) if label in labels]
+        else:
+            keys = predicate.values
+        return np.isin(values, _keys(keys, values.dtype))
+    bound = (lambda value: np.datetime64(value, 'ns')) if values.dtype.kind == 'M' else (lambda value: value)
+    keep = np.ones(len(values), dtype=bool)
+    if predicate.low is not None:
+        keep &= values >= bound(predicate.low)
+    if predicate.high is not None:
+        keep &= values <= bound(predicate.high) if predicate.high_inclusive else values < bound(predicate.high)
+    return keep
+
+
+@dataclass(frozen=True)
+class Selection:
+    """The rows of a filtered or sorted page request, and how the planner found them.
+
+    positions are ascending by (sort value, row), or by row without a sort,
+    with values holding the sort values alongside; a descending request
+    reads them back to front, ties included.
+    """
+    positions: np.ndarray
+    values: Optional[np.ndarray]
+    sort: Optional[str]
+    descending: bool
+    index: Optional[str]  # the column whose index drove the lookup; None for a full scan
+    examined: int  # rows the remaining predicates were checked against
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def page(self, start: int, limit: int) -> np.ndarray:
+        """Row positions of the result rows [start, start + limit)"""
+        if not self.descending:
+            return self.positions[start:start + limit]
+        stop = max(len(self) - start, 0)
+        return self.positions[max(stop - limit, 0):stop][::-1]
+
+    def offset_after(self, frame: pd.DataFrame, key: str, cursor: int) -> int:
+        """Result offset just past the row with surrogate key cursor.
+
+        The cursor row need not match the filters. With a sort it must
+        exist, since its sort value places it; raises ValueError otherwise.
+        """
+        if self.sort is None:
+            return int(np.searchsorted(self.positions, keyset_start(frame, key, cursor), side='left'))
+        row = keyset_start(frame, key, cursor) - 1
+        if row < 0 or frame[key].iat[row] != cursor:
+            raise ValueError(f"Unknown cursor: {format_id(key, cursor)}")
+        value = column_values(frame[self.sort])[row]
+        lo = int(np.searchsorted(self.values, value, side='left'))
+        hi = int(np.searchsorted(self.values, value, side='right'))
+        ties = self.positions[lo:hi]
+        if not self.descending:
+            return lo + int(np.searchsorted(ties, row, side='right'))
+        return len(self) - hi + (hi - lo - int(np.searchsorted(ties, row, side='left')))
+
+
+def select(frame: pd.DataFrame, indexes: TableIndexes, predicates: Sequence[Predicate],
+           sort: Optional[str] = None, descending: bool = False) -> Selection:
+    """Rows matching every predicate, ordered by sort (else by row), with the planner's choice"""
+    rows = len(frame)
+    sorted_by = indexes.index(frame, sort) if sort is not None else None
+    if not predicates:
+        if sorted_by is None:
+            return Selection(np.arange(rows), None, None, False, None, 0)
+        return Selection(sorted_by.order, sorted_by.values, sort, descending, sort, 0)
+
+    # Every predicate's match count is exact and cheap to get from its index
+    lookups = [(predicate, indexes.index(frame, predicate.column).slices(predicate)) for predicate in predicates]
+    driver, slices = min(lookups, key=lambda lookup: sum(stop - start for start, stop in lookup[1]))
+    candidates = sum(stop - start for start, stop in slices)
+
+    resort = sort is not None and sort != driver.column
+    if candidates > (MAX_RESORT_SELECTIVITY if resort else MAX_INDEX_SELECTIVITY) * rows:
+        keep = np.ones(rows, dtype=bool)
+        for predicate in predicates:
+            keep &= _matches(frame, predicate)
+        if sorted_by is None:
+            return Selection(np.flatnonzero(keep), None, None, False, None, rows)
+        # Reading the sort column's index in order avoids sorting the matches
+        ordered = keep[sorted_by.order]
+        return Selection(sorted_by.order[ordered], sorted_by.values[ordered], sort, descending, None, rows)
+
+    index = indexes.index(frame, driver.column)
+    positions = np.concatenate([index.order[start:stop] for start, stop in slices]) if slices \
+        else np.empty(0, dtype=index.order.dtype)
+    values = None
+    if sort is not None and not resort:
+        # The driving slices are already in (value, row) order
+        values = np.concatenate([index.values[start:stop] for start, stop in slices]) if slices \
+            else index.values[:0]
+    else:
+        positions = np.sort(positions)
+    keep = np.ones(len(positions), dtype=bool)
+    for predicate in predicates:
+        if predicate is not driver:
+            keep &= _matches(frame, predicate, positions)
+    positions = positions[keep]
+    if values is not None:
+        values = values[keep]
+    elif sort is not None:
+        values = column_values(frame[sort])[positions]
+        by_value = np.argsort(values, kind='stable')
+        positions, values = positions[by_value], values[by_value]
+    return Selection(positions, values, sort, descending, driver.column, candidates)
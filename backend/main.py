@@ -1,18 +1,53 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import pandas as pd
 import numpy as np
-import json
 import asyncio
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from functools import cached_property
 import random
-from typing import List, Dict, Any, Optional
+from typing import Annotated, List, Dict, Any, Literal, Optional, Tuple
 import os
-from faker import Faker
+import threading
+import time
 
-app = FastAPI(title="E-Commerce Lakehouse LLM Analytics Copilot", version="1.0.0")
+from aggregates import LakehouseAggregates
+from cache import ResultCache, query_cache_key
+from chunked import EXECUTION_MODES, ChunkedFacts
+from datagen import DataGenerator
+from encoding import (ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, JSON_MEDIA_TYPE, TABLE_MEDIA_TYPES,
+                      LakehouseJSONResponse, arrow_bytes, frame_arrow_bytes, frame_columns, records_json,
+                      json_bytes, negotiate, table_columns)
+from engine import Batch, execute
+from executor import BoundedExecutor, ExecutorOverloaded
+from export import (DEFAULT_EXPORT_CHUNK_ROWS, EXPORT_FORMATS, arrow_stream, keyset_start, ndjson_stream,
+                    take_rows)
+from indexes import In, Predicate, Range, TableIndexes, select
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, attach, count, instrumented, label, registry, stage
+from partitions import PARTITIONED_TABLES, PartitionIndex
+from plan import (LABEL_COLUMNS, ROW_COUNT, Aggregate, Metric, QueryPlan, Scan, build_plan, extract_dimensions,
+                  extract_limit, extract_metrics, optimize)
+from schema import (CATEGORIES, CHANNELS, CUSTOMER_SEGMENTS, GENDERS, ID_FORMATS, ORDER_STATUSES, PAYMENT_METHODS,
+                    SHIPPING_METHODS, SIZES, SUBCATEGORIES, conform, format_id, format_id_columns, parse_id, parse_ids)
+from shared import SHARED_DIR_ENV
+from sketches import LakehouseSketches
+from snapshot import DEFAULT_SNAPSHOT_ROOT, TABLES, load_table, read_manifest, snapshot_path, write_snapshot
+from timefilter import GRAIN_ADJECTIVES, GRAINS, parse_grain, parse_time_filter
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve right away; tables load in the background, or on demand if a request gets there first
+    if os.getenv('LAKEHOUSE_WARM_UP', '1') != '0':
+        asyncio.get_running_loop().run_in_executor(None, _warm_up)
+    yield
+    executor.shutdown()
+    lakehouse.close()
+
+app = FastAPI(title="E-Commerce Lakehouse LLM Analytics Copilot", version="1.0.0", lifespan=lifespan,
+              default_response_class=LakehouseJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -21,15 +56,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
-
-# Initialize Faker for synthetic data
-fake = Faker()
+# Stage timings in Server-Timing headers and request metrics for /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Data models
 class QueryRequest(BaseModel):
     query: str
     context: Optional[Dict[str, Any]] = None
+    # Answer from samples and sketches, with error bounds, where the query allows it
+    approximate: bool = False
 
 class AnalyticsResponse(BaseModel):
     data: Dict[str, Any]
@@ -37,121 +74,515 @@ class AnalyticsResponse(BaseModel):
     visualization_type: str
     query_interpretation: str
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(min_length=1, max_length=100)
+    approximate: bool = False
+
+class OrderItemIn(BaseModel):
+    product_id: str
+    quantity: int = Field(gt=0)
+    unit_price: float = Field(ge=0)
+    discount_percentage: float = Field(0.0, ge=0, le=100)
+
+class OrderIn(BaseModel):
+    customer_id: str
+    order_date: Optional[datetime] = None
+    order_status: str = 'Pending'
+    payment_method: str = 'Credit Card'
+    shipping_method: str = 'Standard'
+    shipping_cost: float = Field(0.0, ge=0)
+    tax_amount: float = Field(0.0, ge=0)
+    discount_amount: float = Field(0.0, ge=0)
+    total_amount: Optional[float] = Field(None, ge=0)
+    shipping_address: str = ''
+    billing_address: str = ''
+    currency: str = 'USD'
+    channel: str = 'Website'
+    items: List[OrderItemIn] = Field(min_length=1)
+
+class OrderBatchRequest(BaseModel):
+    orders: List[OrderIn] = Field(min_length=1, max_length=10000)
+
+# Largest page a /data/* request may ask for; the whole table is available from /export
+MAX_PAGE_ROWS = 10_000
+
+def _sort_options(*columns: str):
+    """Accepted sort values: a column, or the column prefixed with '-' for descending order"""
+    return Literal[tuple(columns) + tuple(f'-{column}' for column in columns)]
+
+class TablePageQuery(BaseModel):
+    """Query parameters of a /data/* page.
+
+    The per-table subclasses add typed filters, served from the table's
+    secondary indexes (see indexes.py). A list parameter matches any of its
+    values (repeat it: ?state=Texas&state=Ohio). min_<column> and max_<column>
+    are inclusive bounds, and a max date includes that whole day. sort orders
+    by a column, descending with a leading '-'; ties follow id order (reversed
+    for descending).
+    """
+    # Paging lives in the model too: FastAPI only reads a query parameter model
+    # that is the endpoint's sole query parameter
+    limit: int = Field(100, ge=1, le=MAX_PAGE_ROWS)
+    offset: int = Field(0, ge=0)
+    # Last id seen; the page starts after it
+    after: Optional[str] = None
+
+class CustomerPageQuery(TablePageQuery):
+    state: Optional[List[str]] = None
+    country: Optional[List[str]] = None
+    customer_segment: Optional[List[Literal[tuple(CUSTOMER_SEGMENTS)]]] = None
+    gender: Optional[List[Literal[tuple(GENDERS)]]] = None
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    min_lifetime_value: Optional[float] = None
+    max_lifetime_value: Optional[float] = None
+    min_registration_date: Optional[date] = None
+    max_registration_date: Optional[date] = None
+    sort: Optional[_sort_options('age', 'lifetime_value', 'registration_date')] = None
+
+class ProductPageQuery(TablePageQuery):
+    category: Optional[List[Literal[tuple(CATEGORIES)]]] = None
+    subcategory: Optional[List[Literal[tuple(SUBCATEGORIES)]]] = None
+    size: Optional[List[Literal[tuple(SIZES)]]] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_rating: Optional[float] = None
+    max_rating: Optional[float] = None
+    min_stock_quantity: Optional[int] = None
+    max_stock_quantity: Optional[int] = None
+    sort: Optional[_sort_options('price', 'rating', 'stock_quantity', 'reviews_count')] = None
+
+class OrderPageQuery(TablePageQuery):
+    customer_id: Optional[List[str]] = None
+    order_status: Optional[List[Literal[tuple(ORDER_STATUSES)]]] = None
+    payment_method: Optional[List[Literal[tuple(PAYMENT_METHODS)]]] = None
+    shipping_method: Optional[List[Literal[tuple(SHIPPING_METHODS)]]] = None
+    channel: Optional[List[Literal[tuple(CHANNELS)]]] = None
+    min_order_date: Optional[date] = None
+    max_order_date: Optional[date] = None
+    min_total_amount: Optional[float] = None
+    max_total_amount: Optional[float] = None
+    sort: Optional[_sort_options('order_date', 'total_amount')] = None
+
+# Tables held in memory in every execution mode
+DIMENSION_TABLES = [table for table in TABLES if table not in PARTITIONED_TABLES]
+
 # In-memory data store (simulating lakehouse)
 class DataLakehouse:
-    def __init__(self):
-        self.customers = self._generate_customers(1000)
-        self.products = self._generate_products(500)
-        self.orders = self._generate_orders(5000)
-        self.order_items = self._generate_order_items()
-        
-    def _generate_customers(self, count: int) -> pd.DataFrame:
-        customers = []
-        for i in range(count):
-            customers.append({
-                'customer_id': f'CUST_{i+1:06d}',
-                'first_name': fake.first_name(),
-                'last_name': fake.last_name(),
-                'email': fake.email(),
-                'phone': fake.phone_number(),
-                'address': fake.address(),
-                'city': fake.city(),
-                'state': fake.state(),
-                'country': fake.country(),
-                'postal_code': fake.postcode(),
-                'registration_date': fake.date_between(start_date='-2y', end_date='today'),
-                'age': random.randint(18, 80),
-                'gender': random.choice(['M', 'F', 'Other']),
-                'customer_segment': random.choice(['Premium', 'Standard', 'Basic']),
-                'lifetime_value': round(random.uniform(100, 10000), 2)
-            })
-        return pd.DataFrame(customers)
-    
-    def _generate_products(self, count: int) -> pd.DataFrame:
-        categories = ['Electronics', 'Clothing', 'Home & Garden', 'Sports', 'Books', 'Beauty', 'Toys']
-        products = []
-        for i in range(count):
-            category = random.choice(categories)
-            products.append({
-                'product_id': f'PROD_{i+1:06d}',
-                'product_name': fake.catch_phrase(),
-                'category': category,
-                'subcategory': f'{category} Subcategory {random.randint(1, 5)}',
-                'brand': fake.company(),
-                'price': round(random.uniform(10, 1000), 2),
-                'cost': round(random.uniform(5, 500), 2),
-                'weight': round(random.uniform(0.1, 50), 2),
-                'dimensions': f'{random.randint(5, 50)}x{random.randint(5, 50)}x{random.randint(5, 50)}',
-                'color': fake.color_name(),
-                'size': random.choice(['XS', 'S', 'M', 'L', 'XL', 'XXL', 'One Size']),
-                'stock_quantity': random.randint(0, 1000),
-                'supplier_id': f'SUPP_{random.randint(1, 100):03d}',
-                'rating': round(random.uniform(1, 5), 1),
-                'reviews_count': random.randint(0, 1000)
-            })
-        return pd.DataFrame(products)
-    
-    def _generate_orders(self, count: int) -> pd.DataFrame:
-        orders = []
-        for i in range(count):
-            order_date = fake.date_time_between(start_date='-1y', end_date='now')
-            orders.append({
-                'order_id': f'ORD_{i+1:08d}',
-                'customer_id': f'CUST_{random.randint(1, 1000):06d}',
-                'order_date': order_date,
-                'order_status': random.choice(['Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled']),
-                'payment_method': random.choice(['Credit Card', 'Debit Card', 'PayPal', 'Bank Transfer']),
-                'shipping_method': random.choice(['Standard', 'Express', 'Next Day', 'International']),
-                'shipping_cost': round(random.uniform(5, 50), 2),
-                'tax_amount': round(random.uniform(10, 200), 2),
-                'discount_amount': round(random.uniform(0, 100), 2),
-                'total_amount': round(random.uniform(50, 2000), 2),
-                'shipping_address': fake.address(),
-                'billing_address': fake.address(),
-                'currency': 'USD',
-                'channel': random.choice(['Website', 'Mobile App', 'Phone', 'Store'])
-            })
-        return pd.DataFrame(orders)
-    
-    def _generate_order_items(self) -> pd.DataFrame:
-        order_items = []
-        for _, order in self.orders.iterrows():
-            num_items = random.randint(1, 5)
-            for j in range(num_items):
-                product = self.products.sample(1).iloc[0]
-                quantity = random.randint(1, 5)
-                unit_price = product['price'] * random.uniform(0.8, 1.2)  # Some price variation
-                order_items.append({
-                    'order_item_id': f'OI_{len(order_items)+1:08d}',
-                    'order_id': order['order_id'],
-                    'product_id': product['product_id'],
-                    'quantity': quantity,
-                    'unit_price': round(unit_price, 2),
-                    'total_price': round(unit_price * quantity, 2),
-                    'discount_percentage': round(random.uniform(0, 20), 1)
-                })
-        return pd.DataFrame(order_items)
+    """The four tables, each loaded on first use.
+
+    Construction only decides where the tables come from. A table is read
+    (or generated) the first time something asks for it, so a request that
+    needs customers never waits for order_items. warm_up() loads everything
+    ahead of requests, and table_states() reports progress.
+
+    In chunked execution mode, analytics stream orders and order items from
+    the snapshot (see chunked.py) and only the dimensions are held in
+    memory; endpoints that page through or export raw orders still load them.
+    """
+
+    def __init__(self, scale: float = 1.0, seed: int = 42, snapshot_root: Optional[str] = None,
+                 shared_path: Optional[str] = None, execution: str = 'memory'):
+        if execution not in EXECUTION_MODES:
+            raise ValueError(f"execution must be one of {EXECUTION_MODES}")
+        self.scale = scale
+        self.seed = seed
+        self.execution = execution
+        self.snapshot_path = None
+        # Tables published in shared memory by shared.py, mapped by every worker
+        self.shared = shared_path is not None
+
+        if shared_path is not None:
+            manifest = read_manifest(shared_path)
+            if manifest is None:
+                raise RuntimeError(f"No shared lakehouse tables at {shared_path}")
+            self.scale, self.seed = manifest['scale'], manifest['seed']
+            self.snapshot_path = shared_path
+        elif snapshot_root:
+            # Build the columnar snapshot once, then memory-map it on every start
+            self.snapshot_path = snapshot_path(snapshot_root, scale, seed)
+        self._generator = DataGenerator(scale=scale, seed=seed) if self.snapshot_path is None else None
+        # The time the data was generated at; read from the snapshot manifest on first use
+        self._as_of: Optional[datetime] = self._generator.as_of if self._generator is not None else None
+        if execution == 'chunked' and self._generator is not None:
+            raise RuntimeError("Chunked execution streams a snapshot; set LAKEHOUSE_SNAPSHOT_DIR")
+
+        self._tables: Dict[str, pd.DataFrame] = {}
+        self._load_states: Dict[str, Dict[str, Any]] = {table: {'state': 'pending'} for table in TABLES}
+        self._snapshot_lock = threading.Lock()
+        # Generated orders and order items come from one pass, so they share a lock
+        orders_lock = threading.Lock()
+        self._load_locks = {
+            'customers': threading.Lock(),
+            'products': threading.Lock(),
+            'orders': orders_lock,
+            'order_items': orders_lock if self._generator is not None else threading.Lock(),
+        }
+        # Ingested batches wait here until a reader needs the raw rows,
+        # so appends are compacted with one concat instead of one per request
+        self._pending: Dict[str, List[pd.DataFrame]] = {'orders': [], 'order_items': []}
+        self._write_lock = threading.RLock()
+        # Set when orders and order items are loaded
+        self._next_order_number = 0
+        self._next_order_item_number = 0
+
+        # Bumped whenever table contents change; derived structures are keyed on it
+        self.data_version = 0
+        self._join_index: Optional[Dict[str, Any]] = None
+        self._join_index_version = -1
+        self._aggregates: Optional[LakehouseAggregates] = None
+        self._sketches: Optional[LakehouseSketches] = None
+        self._partitions: Optional[PartitionIndex] = None
+        self._chunks: Optional[ChunkedFacts] = None
+        self._indexes: Dict[str, TableIndexes] = {}
+        # Per-column bytes of each table and the data version they were measured at
+        self._column_bytes: Dict[str, Tuple[int, pd.Series]] = {}
+
+    def _ensure_snapshot(self):
+        # The lock serializes builds within this process; write_snapshot publishes
+        # atomically, so workers in other processes building it too are safe
+        with self._snapshot_lock:
+            if read_manifest(self.snapshot_path) is None:
+                write_snapshot(self.snapshot_path, scale=self.scale, seed=self.seed)
+
+    def _read(self, name: str) -> Dict[str, pd.DataFrame]:
+        """Read or generate a table; generating orders also yields their items"""
+        if self._generator is None:
+            self._ensure_snapshot()
+            return {name: load_table(self.snapshot_path, name)}
+        if name in ('orders', 'order_items'):
+            orders, order_items = self._generator.order_tables()
+            return {'orders': orders, 'order_items': order_items}
+        return {name: getattr(self._generator, name)()}
+
+    def _load(self, name: str) -> pd.DataFrame:
+        """A table as loaded, without pending ingested batches; loads it on first use"""
+        table = self._tables.get(name)
+        if table is not None:
+            return table
+        with self._load_locks[name]:
+            if name not in self._tables:
+                self._load_states[name] = {'state': 'loading'}
+                start = time.perf_counter()
+                try:
+                    tables = self._read(name)
+                except Exception as e:
+                    # The next access retries
+                    self._load_states[name] = {'state': 'failed', 'error': str(e)}
+                    raise
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                for table_name, frame in tables.items():
+                    if table_name == 'orders':
+                        self._next_order_number = len(frame) + 1
+                    elif table_name == 'order_items':
+                        self._next_order_item_number = len(frame) + 1
+                    self._tables[table_name] = frame
+                    self._load_states[table_name] = {'state': 'loaded', 'rows': len(frame),
+                                                     'load_ms': round(elapsed_ms, 1)}
+            return self._tables[name]
+
+    def table_states(self) -> Dict[str, Dict[str, Any]]:
+        """Load state of each table: pending, loading, loaded (with rows and load time), failed,
+        or streamed (with rows and chunks) for fact tables in chunked execution mode"""
+        return {table: dict(state) for table, state in self._load_states.items()}
+
+    def loaded_tables(self) -> List[str]:
+        return [table for table in TABLES if table in self._tables]
+
+    @property
+    def ready(self) -> bool:
+        if self.execution == 'chunked':
+            return self._chunks is not None and all(table in self._tables for table in DIMENSION_TABLES)
+        return len(self._tables) == len(TABLES)
+
+    def load_tables(self):
+        """Load every table that is not loaded yet"""
+        for table in TABLES:
+            self._load(table)
+
+    def warm_up(self):
+        """Load every table, then build the indexes and aggregates analytics use"""
+        if self.chunks is not None:
+            # Only the dimensions are held in memory; analytics stream the fact tables
+            for table in DIMENSION_TABLES:
+                self._load(table)
+            return
+        self.load_tables()
+        self.join_index()
+        self.partitions()
+        self.aggregates
+
+    def _table(self, name: str) -> pd.DataFrame:
+        self._load(name)
+        if self._pending.get(name):
+            with self._write_lock:
+                if self._pending[name]:
+                    self._tables[name] = pd.concat(
+                        [self._tables[name], *self._pending[name]], ignore_index=True
+                    )
+                    self._pending[name] = []
+        return self._tables[name]
+
+    @property
+    def customers(self) -> pd.DataFrame:
+        return self._table('customers')
+
+    @property
+    def products(self) -> pd.DataFrame:
+        return self._table('products')
+
+    @property
+    def orders(self) -> pd.DataFrame:
+        return self._table('orders')
+
+    @property
+    def order_items(self) -> pd.DataFrame:
+        return self._table('order_items')
+
+    @property
+    def as_of(self) -> datetime:
+        """The "now" of the data: when it was generated, or the latest ingested order date if later.
+
+        Relative date ranges ("last 30 days", "this month") are measured from
+        here rather than from the wall clock, which moves on while a snapshot
+        stays put.
+        """
+        if self._as_of is None:
+            if not self.shared:
+                self._ensure_snapshot()
+            self._as_of = datetime.fromisoformat(read_manifest(self.snapshot_path)['as_of'])
+        return self._as_of
+
+    def mark_changed(self):
+        """Record that table contents changed so derived structures get rebuilt"""
+        self.data_version += 1
+
+    @cached_property
+    def product_index(self) -> pd.Index:
+        return pd.Index(self.products['product_id'])
+
+    @cached_property
+    def customer_index(self) -> pd.Index:
+        return pd.Index(self.customers['customer_id'])
+
+    def _order_positions(self, order_ids: pd.Series) -> np.ndarray:
+        """Row positions of order ids, found by binary search since orders are sorted by id"""
+        ids = order_ids.to_numpy()
+        table_ids = self.orders['order_id'].to_numpy()
+        positions = np.searchsorted(table_ids, ids)
+        found = positions < len(table_ids)
+        found[found] = table_ids[positions[found]] == ids[found]
+        return np.where(found, positions, -1)
+
+    def join_index(self) -> Dict[str, Any]:
+        """Integer-positional join index from fact rows into dimension rows.
+
+        Built once and refreshed per data version, so analytics can gather
+        dimension attributes with array indexing instead of a hash join per
+        request. Appended fact rows only have their own positions looked up.
+        Positions are -1 where the foreign key has no matching dimension row.
+        """
+        with self._write_lock:
+            if self._join_index is None:
+                category_codes, categories = pd.factorize(self.products['category'], sort=True)
+                self._join_index = {
+                    'item_product': np.empty(0, dtype=np.intp),
+                    'item_order': np.empty(0, dtype=np.intp),
+                    'order_customer': np.empty(0, dtype=np.intp),
+                    'product_category': category_codes,
+                    'categories': np.asarray(categories),
+                }
+            if self._join_index_version != self.data_version:
+                for key, lookup, table, column in (
+                    ('item_product', self.product_index.get_indexer, self.order_items, 'product_id'),
+                    ('item_order', self._order_positions, self.order_items, 'order_id'),
+                    ('order_customer', self.customer_index.get_indexer, self.orders, 'customer_id'),
+                ):
+                    known = len(self._join_index[key])
+                    if known < len(table):
+                        tail = lookup(table[column].iloc[known:])
+                        self._join_index[key] = np.concatenate([self._join_index[key], tail])
+                self._join_index_version = self.data_version
+            return self._join_index
+
+    def partitions(self) -> PartitionIndex:
+        """Monthly partitions of orders/order_items, extended as batches arrive"""
+        with self._write_lock:
+            if self._partitions is None:
+                self._partitions = PartitionIndex.build(self.orders, self.order_items)
+            else:
+                self._partitions = self._partitions.extended(self.orders, self.order_items)
+            return self._partitions
+
+    def indexes(self, table: str) -> Tuple[pd.DataFrame, TableIndexes]:
+        """A table and its secondary indexes, extended over rows ingested since they were last used.
+
+        Each column's index is built the first time a page filters or sorts
+        on it.
+        """
+        with self._write_lock:
+            frame = self._table(table)
+            indexes = self._indexes.get(table) or TableIndexes(len(frame))
+            self._indexes[table] = indexes = indexes.extended(frame)
+            return frame, indexes
+
+    def time_slice(self, start: Optional[str], end: Optional[str]) -> Dict[str, Any]:
+        """Row positions of orders and order items dated within [start, end).
+
+        Only partitions whose date range overlaps the window are read.
+        """
+        with self._write_lock:
+            partitions = self.partitions()
+            orders, order_items = self.orders, self.order_items
+        return partitions.scan(
+            orders, order_items,
+            np.datetime64(start, 'ns') if start else None,
+            np.datetime64(end, 'ns') if end else None
+        )
+
+    @property
+    def aggregates(self) -> LakehouseAggregates:
+        """Delta-maintained aggregates, bootstrapped with one scan on first use"""
+        if self._aggregates is None:
+            with self._write_lock:
+                if self._aggregates is None:
+                    self._aggregates = LakehouseAggregates.build(self)
+        return self._aggregates
+
+    @property
+    def chunks(self) -> Optional[ChunkedFacts]:
+        """Chunk-by-chunk access to the snapshot's fact tables in chunked execution mode, else None"""
+        if self.execution != 'chunked':
+            return None
+        if self._chunks is None:
+            with self._write_lock:
+                if self._chunks is None:
+                    self._ensure_snapshot()
+                    chunks = ChunkedFacts.from_env(self.snapshot_path)
+                    for table, rows in chunks.rows.items():
+                        if table not in self._tables:
+                            self._load_states[table] = {'state': 'streamed', 'rows': rows,
+                                                        'chunks': len(chunks.index)}
+                    self._chunks = chunks
+        return self._chunks
+
+    def close(self):
+        """Stop the chunk worker processes, if any"""
+        if self._chunks is not None:
+            self._chunks.close()
+
+    @property
+    def sketches(self) -> LakehouseSketches:
+        """Stratified sample and per-month sketches for approximate queries, built on first use"""
+        if self._sketches is None:
+            with self._write_lock:
+                if self._sketches is None:
+                    self._sketches = LakehouseSketches.build(self)
+        return self._sketches
+
+    def ingest_orders(self, orders: pd.DataFrame, order_items: pd.DataFrame):
+        """Append a batch of orders and their items and update the aggregates.
+
+        Both frames use surrogate integer keys. Order and item ids are
+        assigned here. order_items must carry an 'order_ref' column with the
+        position of its order within the batch. Raises ValueError if a
+        customer or product id is unknown or a categorical value is outside
+        its vocabulary.
+        """
+        order_customer = self.customer_index.get_indexer(orders['customer_id'])
+        item_product = self.product_index.get_indexer(order_items['product_id'])
+        for column, keys, positions in (('customer_id', orders['customer_id'], order_customer),
+                                        ('product_id', order_items['product_id'], item_product)):
+            unknown = keys[positions < 0]
+            if len(unknown):
+                raise ValueError(f"Unknown {column}: {format_id(column, unknown.iloc[0])}")
+
+        with self._write_lock:
+            # Loading them sets the next ids
+            order_table, item_table = self._load('orders'), self._load('order_items')
+            orders = orders.copy()
+            order_items = order_items.copy()
+            order_ids = np.arange(self._next_order_number, self._next_order_number + len(orders))
+            item_ids = np.arange(self._next_order_item_number,
+                                 self._next_order_item_number + len(order_items))
+            orders['order_id'] = order_ids
+            order_items['order_item_id'] = item_ids
+            order_items['order_id'] = order_ids[order_items.pop('order_ref').to_numpy()]
+            orders = conform(orders, order_table)
+            order_items = conform(order_items, item_table)
+
+            # Fold the batch into the aggregates and sketches before it becomes visible
+            if self._aggregates is not None:
+                self._aggregates.apply(orders, order_items, order_customer, item_product)
+            if self._sketches is not None:
+                self._sketches.apply(orders, order_items, order_customer, item_product,
+                                     first_position=self._next_order_number - 1)
+            latest = orders['order_date'].max()
+            if pd.notna(latest) and latest > self.as_of:
+                self._as_of = latest.to_pydatetime()
+            self._pending['orders'].append(orders)
+            self._pending['order_items'].append(order_items)
+            self._next_order_number += len(orders)
+            self._next_order_item_number += len(order_items)
+            self.mark_changed()
+        return orders, order_items
+
+    def _table_bytes(self, name: str) -> pd.Series:
+        """Bytes per column of a table, measured once per data version.
+
+        A deep measurement walks every string payload, so it is not repeated
+        for each /data/memory request or metrics scrape.
+        """
+        cached = self._column_bytes.get(name)
+        if cached is None or cached[0] != self.data_version:
+            # Read the version first: a batch ingested meanwhile forces a fresh measurement
+            version = self.data_version
+            cached = (version, self._table(name).memory_usage(index=False, deep=True))
+            self._column_bytes[name] = cached
+        return cached[1]
+
+    def memory_usage(self, tables: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Bytes held per table and column, including string payloads"""
+        report = {}
+        for name in TABLES if tables is None else tables:
+            usage = self._table_bytes(name)
+            report[name] = {
+                'rows': len(self._table(name)),
+                'total_bytes': int(usage.sum()),
+                'index_bytes': self._indexes[name].nbytes if name in self._indexes else 0,
+                'columns': {column: int(nbytes) for column, nbytes in usage.items()}
+            }
+        return report
 
 # Initialize data lakehouse
-lakehouse = DataLakehouse()
+lakehouse = DataLakehouse(
+    scale=float(os.getenv('LAKEHOUSE_SCALE', '1.0')),
+    seed=int(os.getenv('LAKEHOUSE_SEED', '42')),
+    snapshot_root=os.getenv('LAKEHOUSE_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_ROOT),
+    shared_path=os.getenv(SHARED_DIR_ENV),
+    execution=os.getenv('LAKEHOUSE_EXECUTION', 'memory')
+)
 
 class LLMAnalytics:
-    def __init__(self):
+    def __init__(self, cache: Optional[ResultCache] = None):
         self.lakehouse = lakehouse
+        self.cache = cache
     
-    def parse_natural_language_query(self, query: str) -> Dict[str, Any]:
+    def parse_natural_language_query(self, query: str, approximate: bool = False) -> Dict[str, Any]:
         """Parse natural language query and determine analytics approach"""
         query_lower = query.lower()
         
         # Determine query type and relevant data
         analysis_type = "general"
         data_scope = []
-        time_filter = None
-        group_by = []
-        metrics = []
+        time_filter = parse_time_filter(query, self.lakehouse.as_of)
+        grain = parse_grain(query, time_filter)
+        group_by = extract_dimensions(query)
+        metrics = extract_metrics(query)
         
         # Keywords for different analysis types
-        if any(word in query_lower for word in ['trend', 'over time', 'monthly', 'daily', 'weekly']):
+        if any(word in query_lower for word in ['trend', 'over time', 'monthly', 'daily', 'weekly',
+                                                 'per day', 'per week', 'per month']):
             analysis_type = "time_series"
         elif any(word in query_lower for word in ['top', 'best', 'highest', 'lowest', 'ranking']):
             analysis_type = "ranking"
@@ -174,18 +605,60 @@ class LLMAnalytics:
         if not data_scope:
             data_scope = ['orders']
         
-        return {
+        parsed_query = {
             'analysis_type': analysis_type,
             'data_scope': data_scope,
+            'time_filter': time_filter,
+            'grain': grain,
+            'group_by': group_by,
+            'metrics': metrics,
+            'limit': extract_limit(query),
+            # Samples and sketches are built from the whole fact tables, so streamed lakehouses answer exactly
+            'approximate': approximate and self.lakehouse.execution == 'memory'
+        }
+        # Logical plan: scans, joins, group-bys and aggregates the question needs
+        plan = build_plan(parsed_query)
+        
+        interpretation = f"Analyzing {', '.join(data_scope)} with {analysis_type} approach"
+        if plan.kind == 'grouped':
+            interpretation += f" by {', '.join(column.split('.', 1)[1] for column in group_by)}"
+        if time_filter:
+            interpretation += f" ({time_filter['label']})"
+        
+        return {
+            **parsed_query,
+            'plan': plan,
             'original_query': query,
-            'interpretation': f"Analyzing {', '.join(data_scope)} with {analysis_type} approach"
+            'interpretation': interpretation
         }
     
     def execute_analytics_query(self, parsed_query: Dict[str, Any]) -> Dict[str, Any]:
         """Execute analytics based on parsed query"""
-        analysis_type = parsed_query['analysis_type']
-        data_scope = parsed_query['data_scope']
+        plan = parsed_query.get('plan') or build_plan(parsed_query)
+        return self._answer(parsed_query, lambda: self._run_plan(plan))
+    
+    def execute_batch(self, parsed_queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Execute several parsed queries, running the work their plans share once.
+
+        Each query is answered (and cached) as if asked alone; the plans of
+        the queries the cache misses run with one memo, after their shared
+        scans, joins and group-bys have been spelled identically.
+        """
+        plans = [parsed_query.get('plan') or build_plan(parsed_query) for parsed_query in parsed_queries]
+        with stage('optimize'):
+            batch = Batch([optimize(plan) for plan in plans], self.lakehouse)
+        
+        def run(index: int) -> Dict[str, Any]:
+            with stage('execute'):
+                results = batch.execute(index)
+            return self._present(plans[index], results)
         
+        answers = [self._answer(parsed_query, lambda index=index: run(index))
+                   for index, parsed_query in enumerate(parsed_queries)]
+        return {'results': answers, 'subplans': batch.stats()}
+    
+    def _answer(self, parsed_query: Dict[str, Any], compute) -> Dict[str, Any]:
+        """A query's response: its computed (or cached) result, or the error it raised"""
         result = {
             'data': {},
             'insights': [],
@@ -194,16 +667,12 @@ class LLMAnalytics:
         }
         
         try:
-            if analysis_type == "time_series":
-                result.update(self._time_series_analysis(data_scope))
-            elif analysis_type == "ranking":
-                result.update(self._ranking_analysis(data_scope))
-            elif analysis_type == "comparison":
-                result.update(self._comparison_analysis(data_scope))
-            elif analysis_type == "distribution":
-                result.update(self._distribution_analysis(data_scope))
+            if self.cache is None:
+                result.update(compute())
             else:
-                result.update(self._general_analysis(data_scope))
+                # Results are reused until the lakehouse data version changes
+                key = query_cache_key(parsed_query, self.lakehouse.data_version)
+                result.update(self.cache.get_or_compute(key, compute))
                 
         except Exception as e:
             result['insights'] = [f"Error processing query: {str(e)}"]
@@ -211,170 +680,539 @@ class LLMAnalytics:
         
         return result
     
-    def _time_series_analysis(self, data_scope: List[str]) -> Dict[str, Any]:
-        """Perform time series analysis"""
-        orders_with_items = self.lakehouse.orders.merge(
-            self.lakehouse.order_items.groupby('order_id')['total_price'].sum().reset_index(),
-            on='order_id'
-        )
-        
-        # Monthly revenue trend
-        orders_with_items['order_date'] = pd.to_datetime(orders_with_items['order_date'])
-        monthly_data = orders_with_items.groupby(orders_with_items['order_date'].dt.to_period('M')).agg({
-            'total_amount': 'sum',
-            'order_id': 'count'
-        }).reset_index()
-        
-        monthly_data['month'] = monthly_data['order_date'].astype(str)
+    def _run_plan(self, plan: QueryPlan) -> Dict[str, Any]:
+        """Optimize and execute a query plan, then shape the result for its kind"""
+        with stage('optimize'):
+            optimized = optimize(plan)
+        with stage('execute'):
+            results = execute(optimized, self.lakehouse)
+        return self._present(plan, results)
+    
+    def _present(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Shape a plan's results for its kind"""
+        with stage('present'):
+            presented = getattr(self, f'_present_{plan.kind}')(plan, results)
+        if plan.approximate:
+            presented['insights'] = presented['insights'] + (
+                _approximation_insights(results)
+                or ["Exact result: this query was answered without sampling"]
+            )
+        return presented
+    
+    def _no_orders(self, plan: QueryPlan, visualization_type: str) -> Dict[str, Any]:
+        period = f" for {plan.time_label}" if plan.time_label else ""
+        return {
+            'data': {'labels': [], 'values': []},
+            'visualization_type': visualization_type,
+            'insights': [f"No orders found{period}"]
+        }
+    
+    def _present_time_series(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Revenue and order count per day, week or month"""
+        trend_data = results['trend']
+        if trend_data.empty:
+            return self._no_orders(plan, 'line')
         
         return {
             'data': {
-                'labels': monthly_data['month'].tolist(),
-                'revenue': monthly_data['total_amount'].tolist(),
-                'orders': monthly_data['order_id'].tolist()
+                'labels': trend_data['orders.order_date'].to_numpy(),
+                'revenue': trend_data['revenue'].to_numpy(),
+                'orders': trend_data['orders'].to_numpy(),
+                **_error_arrays(trend_data, {'revenue': 'revenue', 'orders': 'orders'})
             },
             'visualization_type': 'line',
             'insights': [
-                f"Peak revenue month: {monthly_data.loc[monthly_data['total_amount'].idxmax(), 'month']}",
-                f"Average monthly revenue: ${monthly_data['total_amount'].mean():,.2f}",
-                f"Total orders analyzed: {monthly_data['order_id'].sum():,}"
+                f"Peak revenue {GRAINS[plan.grain]}: {trend_data.loc[trend_data['revenue'].idxmax(), 'orders.order_date']}",
+                f"Average {GRAIN_ADJECTIVES[plan.grain]} revenue: ${trend_data['revenue'].mean():,.2f}",
+                f"Total orders analyzed: {trend_data['orders'].sum():,}"
             ]
         }
     
-    def _ranking_analysis(self, data_scope: List[str]) -> Dict[str, Any]:
-        """Perform ranking analysis"""
-        if 'products' in data_scope:
-            # Top products by revenue
-            product_revenue = self.lakehouse.order_items.merge(
-                self.lakehouse.products, on='product_id'
-            ).groupby(['product_id', 'product_name'])['total_price'].sum().reset_index()
-            
-            top_products = product_revenue.nlargest(10, 'total_price')
-            
-            return {
-                'data': {
-                    'labels': top_products['product_name'].tolist(),
-                    'values': top_products['total_price'].tolist()
-                },
-                'visualization_type': 'bar',
-                'insights': [
-                    f"Top product: {top_products.iloc[0]['product_name']} (${top_products.iloc[0]['total_price']:,.2f})",
-                    f"Revenue concentration: Top 10 products account for ${top_products['total_price'].sum():,.2f}",
-                    f"Average top product revenue: ${top_products['total_price'].mean():,.2f}"
-                ]
-            }
-        else:
-            # Top customers by order value
-            customer_revenue = self.lakehouse.orders.merge(
-                self.lakehouse.customers, on='customer_id'
-            ).groupby(['customer_id', 'first_name', 'last_name'])['total_amount'].sum().reset_index()
-            
-            top_customers = customer_revenue.nlargest(10, 'total_amount')
-            top_customers['name'] = top_customers['first_name'] + ' ' + top_customers['last_name']
-            
-            return {
-                'data': {
-                    'labels': top_customers['name'].tolist(),
-                    'values': top_customers['total_amount'].tolist()
-                },
-                'visualization_type': 'bar',
-                'insights': [
-                    f"Top customer: {top_customers.iloc[0]['name']} (${top_customers.iloc[0]['total_amount']:,.2f})",
-                    f"Customer concentration: Top 10 customers spent ${top_customers['total_amount'].sum():,.2f}",
-                    f"Average top customer value: ${top_customers['total_amount'].mean():,.2f}"
-                ]
-            }
+    def _present_top_products(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Top products by revenue"""
+        top_products = results['top']
+        if top_products.empty:
+            return self._no_orders(plan, 'bar')
+        
+        return {
+            'data': {
+                'labels': top_products['products.product_name'].to_numpy(),
+                'values': top_products['revenue'].to_numpy(),
+                **_error_arrays(top_products, {'values': 'revenue'})
+            },
+            'visualization_type': 'bar',
+            'insights': [
+                f"Top product: {top_products.iloc[0]['products.product_name']} (${top_products.iloc[0]['revenue']:,.2f})",
+                f"Revenue concentration: Top {len(top_products)} products account for ${top_products['revenue'].sum():,.2f}",
+                f"Average top product revenue: ${top_products['revenue'].mean():,.2f}"
+            ]
+        }
+    
+    def _present_top_customers(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Top customers by order value"""
+        top_customers = results['top']
+        if top_customers.empty:
+            return self._no_orders(plan, 'bar')
+        names = top_customers['customers.first_name'].astype(str) + ' ' + top_customers['customers.last_name'].astype(str)
+        
+        return {
+            'data': {
+                'labels': names.to_numpy(),
+                'values': top_customers['revenue'].to_numpy(),
+                **_error_arrays(top_customers, {'values': 'revenue'})
+            },
+            'visualization_type': 'bar',
+            'insights': [
+                f"Top customer: {names.iloc[0]} (${top_customers.iloc[0]['revenue']:,.2f})",
+                f"Customer concentration: Top {len(top_customers)} customers spent ${top_customers['revenue'].sum():,.2f}",
+                f"Average top customer value: ${top_customers['revenue'].mean():,.2f}"
+            ]
+        }
     
-    def _comparison_analysis(self, data_scope: List[str]) -> Dict[str, Any]:
-        """Perform comparison analysis"""
-        # Compare categories
-        category_data = self.lakehouse.order_items.merge(
-            self.lakehouse.products, on='product_id'
-        ).groupby('category').agg({
-            'total_price': 'sum',
-            'quantity': 'sum'
-        }).reset_index()
+    def _present_category_comparison(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Revenue and units per product category"""
+        category_data = results['categories']
+        if category_data.empty:
+            return self._no_orders(plan, 'bar')
         
         return {
             'data': {
-                'labels': category_data['category'].tolist(),
-                'revenue': category_data['total_price'].tolist(),
-                'quantity': category_data['quantity'].tolist()
+                'labels': category_data['products.category'].to_numpy(),
+                'revenue': category_data['revenue'].to_numpy(),
+                'quantity': category_data['quantity'].to_numpy(),
+                **_error_arrays(category_data, {'revenue': 'revenue', 'quantity': 'quantity'})
             },
             'visualization_type': 'bar',
             'insights': [
-                f"Leading category by revenue: {category_data.loc[category_data['total_price'].idxmax(), 'category']}",
-                f"Leading category by volume: {category_data.loc[category_data['quantity'].idxmax(), 'category']}",
+                f"Leading category by revenue: {category_data.loc[category_data['revenue'].idxmax(), 'products.category']}",
+                f"Leading category by volume: {category_data.loc[category_data['quantity'].idxmax(), 'products.category']}",
                 f"Total categories: {len(category_data)}"
             ]
         }
     
-    def _distribution_analysis(self, data_scope: List[str]) -> Dict[str, Any]:
-        """Perform distribution analysis"""
-        if 'customers' in data_scope:
-            # Customer segment distribution
-            segment_dist = self.lakehouse.customers['customer_segment'].value_counts()
-            
-            return {
-                'data': {
-                    'labels': segment_dist.index.tolist(),
-                    'values': segment_dist.values.tolist()
-                },
-                'visualization_type': 'pie',
-                'insights': [
-                    f"Largest segment: {segment_dist.index[0]} ({segment_dist.iloc[0]} customers)",
-                    f"Segment diversity: {len(segment_dist)} segments",
-                    f"Total customers: {segment_dist.sum():,}"
-                ]
-            }
-        else:
-            # Order status distribution
-            status_dist = self.lakehouse.orders['order_status'].value_counts()
-            
-            return {
-                'data': {
-                    'labels': status_dist.index.tolist(),
-                    'values': status_dist.values.tolist()
-                },
-                'visualization_type': 'pie',
-                'insights': [
-                    f"Most common status: {status_dist.index[0]} ({status_dist.iloc[0]} orders)",
-                    f"Status variety: {len(status_dist)} different statuses",
-                    f"Total orders: {status_dist.sum():,}"
-                ]
-            }
+    def _present_segment_distribution(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Customer segment distribution"""
+        segment_dist = results['segments']
+        
+        return {
+            'data': {
+                'labels': segment_dist['customers.customer_segment'].to_numpy(),
+                'values': segment_dist['customers'].to_numpy()
+            },
+            'visualization_type': 'pie',
+            'insights': [
+                f"Largest segment: {segment_dist.iloc[0]['customers.customer_segment']} ({segment_dist.iloc[0]['customers']} customers)",
+                f"Segment diversity: {len(segment_dist)} segments",
+                f"Total customers: {segment_dist['customers'].sum():,}"
+            ]
+        }
     
-    def _general_analysis(self, data_scope: List[str]) -> Dict[str, Any]:
-        """Perform general analysis"""
-        # General overview metrics
-        total_customers = len(self.lakehouse.customers)
-        total_products = len(self.lakehouse.products)
-        total_orders = len(self.lakehouse.orders)
-        total_revenue = self.lakehouse.orders['total_amount'].sum()
-        avg_order_value = self.lakehouse.orders['total_amount'].mean()
+    def _present_status_distribution(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Order status distribution"""
+        status_dist = results['statuses']
+        if status_dist.empty:
+            return self._no_orders(plan, 'pie')
         
         return {
             'data': {
-                'metrics': {
-                    'total_customers': total_customers,
-                    'total_products': total_products,
-                    'total_orders': total_orders,
-                    'total_revenue': total_revenue,
-                    'avg_order_value': avg_order_value
-                }
+                'labels': status_dist['orders.order_status'].to_numpy(),
+                'values': status_dist['orders'].to_numpy(),
+                **_error_arrays(status_dist, {'values': 'orders'})
             },
-            'visualization_type': 'metrics',
+            'visualization_type': 'pie',
             'insights': [
-                f"Total customers: {total_customers:,}",
-                f"Total products: {total_products:,}",
-                f"Total orders: {total_orders:,}",
-                f"Total revenue: ${total_revenue:,.2f}",
-                f"Average order value: ${avg_order_value:.2f}"
+                f"Most common status: {status_dist.iloc[0]['orders.order_status']} ({status_dist.iloc[0]['orders']} orders)",
+                f"Status variety: {len(status_dist)} different statuses",
+                f"Total orders: {status_dist['orders'].sum():,}"
             ]
         }
+    
+    def _present_overview(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """General overview metrics"""
+        total_customers = int(results['customers']['customers'].iloc[0])
+        total_products = int(results['products']['products'].iloc[0])
+        total_orders = int(results['totals']['orders'].iloc[0])
+        total_revenue = float(results['totals']['revenue'].iloc[0])
+        avg_order_value = total_revenue / total_orders if total_orders else 0.0
+        metrics = {
+            'total_customers': total_customers,
+            'total_products': total_products,
+            'total_orders': total_orders,
+            'total_revenue': total_revenue,
+            'avg_order_value': avg_order_value
+        }
+        insights = [
+            f"Total customers: {total_customers:,}",
+            f"Total products: {total_products:,}",
+            f"Total orders: {total_orders:,}",
+            f"Total revenue: ${total_revenue:,.2f}",
+            f"Average order value: ${avg_order_value:.2f}"
+        ]
+        # Approximate overviews also report active customers and order value percentiles
+        if 'active_customers' in results:
+            active_customers = int(results['active_customers']['active_customers'].iloc[0])
+            metrics['active_customers'] = active_customers
+            insights.append(f"Active customers: {active_customers:,}")
+        if 'order_values' in results:
+            percentiles = results['order_values']
+            for quantile, value in zip(percentiles['quantile'], percentiles['value']):
+                metrics[f'p{quantile * 100:g}_order_value'] = float(value)
+            insights.append("Order value percentiles: " + ', '.join(
+                f"p{quantile * 100:g} ${value:,.2f}" for quantile, value in zip(percentiles['quantile'], percentiles['value'])
+            ))
+        
+        return {
+            'data': {'metrics': metrics},
+            'visualization_type': 'metrics',
+            'insights': insights
+        }
+    
+    def _present_grouped(self, plan: QueryPlan, results: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Any metrics grouped by the dimensions the query named"""
+        params = dict(plan.params)
+        groups = results['groups']
+        if groups.empty:
+            return self._no_orders(plan, params['chart'])
+        
+        label_parts = []
+        for dimension in params['dimensions']:
+            columns = LABEL_COLUMNS.get(dimension, (dimension,))
+            label_parts.append(groups[list(columns)].astype(str).agg(' '.join, axis=1))
+        labels = label_parts[0]
+        for part in label_parts[1:]:
+            labels = labels + ' / ' + part
+        
+        metrics = list(params['metrics'])
+        lead = metrics[0]
+        values = groups[lead]
+        def fmt(name: str, value) -> str:
+            return f"${value:,.2f}" if name in ('revenue', 'avg_order_value') else f"{value:,}"
+        dimension_names = ' / '.join(dimension.split('.', 1)[1].replace('_', ' ') for dimension in params['dimensions'])
+        best = int(np.argmax(values.to_numpy()))
+        insights = [
+            f"Highest {lead.replace('_', ' ')}: {labels.iloc[best]} ({fmt(lead, values.iloc[best])})",
+            f"{dimension_names.capitalize()} groups: {len(groups)}"
+        ]
+        if lead != 'avg_order_value':
+            insights.append(f"Total {lead.replace('_', ' ')}: {fmt(lead, values.sum())}")
+        
+        return {
+            'data': {
+                'labels': labels.to_numpy(),
+                'values': values.to_numpy(),
+                **{name: groups[name].to_numpy() for name in metrics},
+                **_error_arrays(groups, {'values': lead, **{name: name for name in metrics}})
+            },
+            'visualization_type': params['chart'],
+            'insights': insights
+        }
+
+def _error_arrays(frame: pd.DataFrame, columns: Dict[str, str]) -> Dict[str, np.ndarray]:
+    """`<key>_error` arrays for the result columns that were estimated, by response data key"""
+    return {f'{key}_error': frame[f'{column}_error'].to_numpy()
+            for key, column in columns.items() if f'{column}_error' in frame}
+
+def _approximation_insights(results: Dict[str, pd.DataFrame]) -> List[str]:
+    """The largest relative error of each estimated column, and how it was estimated"""
+    insights = []
+    for output, frame in results.items():
+        note = frame.attrs.get('approximation')
+        if not note:
+            continue
+        bounds = []
+        for column in frame.columns:
+            if not column.endswith('_error'):
+                continue
+            name = column[:-len('_error')]
+            if name == ROW_COUNT.name:
+                continue
+            values = np.abs(frame[name].to_numpy(dtype=np.float64))
+            errors = frame[column].to_numpy(dtype=np.float64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                relative = errors / values
+            relative = relative[np.isfinite(relative)]
+            display = (output if name == 'value' else name).replace('_', ' ')
+            if len(relative):
+                bounds.append(f"{display} within ±{relative.max():.1%}")
+        if bounds:
+            insights.append(f"Approximate {', '.join(bounds)} ({note})")
+    return insights
 
 # Initialize LLM Analytics
-llm_analytics = LLMAnalytics()
+cache_ttl = os.getenv('ANALYTICS_CACHE_TTL')
+llm_analytics = LLMAnalytics(cache=ResultCache(
+    max_entries=int(os.getenv('ANALYTICS_CACHE_SIZE', '256')),
+    ttl_seconds=float(cache_ttl) if cache_ttl else None
+))
+
+# Worker pool for pandas work and response encoding, kept off the event loop
+executor = BoundedExecutor.from_env()
+
+async def _run_instrumented(fn, *args):
+    """Run fn in the executor and attach its stage timings to the current request"""
+    start = time.perf_counter()
+    result, timer = await executor.run(instrumented, fn, *args)
+    attach(timer, time.perf_counter() - start)
+    return result
+
+def _warm_up():
+    try:
+        lakehouse.warm_up()
+    except Exception:
+        # Recorded in the table states; requests retry the load on demand
+        pass
+
+# Tables are stored in ascending order of these id columns
+TABLE_KEYS = {
+    'customers': 'customer_id',
+    'products': 'product_id',
+    'orders': 'order_id',
+    'order_items': 'order_item_id'
+}
+
+def _cache_lookups() -> Dict[tuple, float]:
+    if llm_analytics.cache is None:
+        return {}
+    stats = llm_analytics.cache.stats()
+    return {(result,): stats[result] for result in ('hits', 'misses', 'coalesced')}
+
+# Gauges read at scrape time, so they always reflect the current tables and pool
+# Table gauges only cover loaded tables; a scrape never triggers a load
+registry.gauge('lakehouse_table_rows', 'Rows per lakehouse table', ('table',),
+               callback=lambda: {(table,): len(getattr(lakehouse, table)) for table in lakehouse.loaded_tables()})
+registry.gauge('lakehouse_table_bytes', 'Bytes held per lakehouse table, including string payloads', ('table',),
+               callback=lambda: {(table,): usage['total_bytes']
+                                 for table, usage in lakehouse.memory_usage(lakehouse.loaded_tables()).items()})
+registry.gauge('lakehouse_table_loaded', 'Whether each lakehouse table is loaded', ('table',),
+               callback=lambda: {(table,): int(state['state'] == 'loaded')
+                                 for table, state in lakehouse.table_states().items()})
+registry.gauge('lakehouse_data_version', 'Lakehouse data version, bumped by every ingested batch',
+               callback=lambda: {(): lakehouse.data_version})
+registry.gauge('analytics_executor_in_flight', 'Executor tasks running or queued',
+               callback=lambda: {(): executor.stats()['in_flight']})
+registry.counter('analytics_executor_rejected_total', 'Executor submissions rejected with 503',
+                 callback=lambda: {(): executor.rejected})
+registry.counter('analytics_cache_lookups_total', 'Result cache lookups by outcome', ('result',),
+                 callback=_cache_lookups)
+
+DASHBOARD_QUERIES = {
+    'revenue_trend': {
+        'analysis_type': 'time_series',
+        'data_scope': ['revenue'],
+        'interpretation': 'Revenue trend analysis'
+    },
+    'top_products': {
+        'analysis_type': 'ranking',
+        'data_scope': ['products'],
+        'interpretation': 'Top products analysis'
+    },
+    'category_comparison': {
+        'analysis_type': 'comparison',
+        'data_scope': ['products'],
+        'interpretation': 'Category comparison analysis'
+    },
+    'customer_segments': {
+        'analysis_type': 'distribution',
+        'data_scope': ['customers'],
+        'interpretation': 'Customer segment distribution'
+    }
+}
+
+# The functions below run inside executor workers. They are module-level so
+# they can also be sent to a process pool, where they use that process's
+# own lakehouse and analytics instances.
+def _json_bytes(payload: Any) -> bytes:
+    """Encode a payload as JSON, NumPy arrays included"""
+    with stage('encode'):
+        return json_bytes(payload)
+
+def _encoded_response(content: bytes, media_type: str = JSON_MEDIA_TYPE) -> Response:
+    return Response(content=content, media_type=media_type, headers={"Vary": "Accept"})
+
+def _negotiate(accept: Optional[str], offered=TABLE_MEDIA_TYPES) -> str:
+    """The response media type for an Accept header; 406 when none of the offered types is acceptable"""
+    media_type = negotiate(accept, offered)
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Acceptable media types: {', '.join(offered)}")
+    return media_type
+
+def _analysis_body(result: Dict[str, Any], media_type: str) -> Dict[str, Any]:
+    """An analysis result as JSON or columnar JSON; the columnar form has flat, equal-length columns"""
+    if media_type == COLUMNAR_MEDIA_TYPE:
+        return {'columns': table_columns(result['data']),
+                **{name: value for name, value in result.items() if name != 'data'}}
+    return result
+
+def _analysis_bytes(result: Dict[str, Any], media_type: str) -> bytes:
+    with stage('encode'):
+        if media_type == ARROW_MEDIA_TYPE:
+            # Insights and the other response fields travel as schema metadata
+            return arrow_bytes(table_columns(result['data']),
+                               {name: value for name, value in result.items() if name != 'data'})
+        return json_bytes(_analysis_body(result, media_type))
+
+def _execute_query(parsed_query: Dict[str, Any]) -> Dict[str, Any]:
+    label('analysis_type', parsed_query['analysis_type'])
+    return llm_analytics.execute_analytics_query(parsed_query)
+
+def _analytics_query_payload(query: str, media_type: str = JSON_MEDIA_TYPE, approximate: bool = False) -> bytes:
+    # Parse the natural language query
+    with stage('parse'):
+        parsed_query = llm_analytics.parse_natural_language_query(query, approximate)
+    label('analysis_type', parsed_query['analysis_type'])
+    
+    # Execute analytics
+    result = llm_analytics.execute_analytics_query(parsed_query)
+    
+    with stage('validate'):
+        response = AnalyticsResponse(**result)
+    return _analysis_bytes({name: getattr(response, name) for name in AnalyticsResponse.model_fields}, media_type)
+
+def _batch_payload(queries: List[str], media_type: str, approximate: bool = False) -> bytes:
+    label('analysis_type', 'batch')
+    with stage('parse'):
+        parsed_queries = [llm_analytics.parse_natural_language_query(query, approximate) for query in queries]
+    batch = llm_analytics.execute_batch(parsed_queries)
+    with stage('validate'):
+        results = [AnalyticsResponse(**result) for result in batch['results']]
+    if media_type == ARROW_MEDIA_TYPE:
+        # One stream per result, in request order; each also carries the batch's subplan counts
+        return b''.join(_analysis_bytes({'subplans': batch['subplans'],
+                                         **{name: getattr(result, name) for name in AnalyticsResponse.model_fields}},
+                                        media_type) for result in results)
+    return _json_bytes({
+        'results': [_analysis_body({name: getattr(result, name) for name in AnalyticsResponse.model_fields},
+                                   media_type) for result in results],
+        'subplans': batch['subplans']
+    })
+
+def _dashboard_payload(dashboard: Dict[str, Dict[str, Any]], media_type: str) -> bytes:
+    if media_type == ARROW_MEDIA_TYPE:
+        # One stream per panel, named in its schema metadata
+        return b''.join(_analysis_bytes({'name': name, **result}, media_type) for name, result in dashboard.items())
+    return _json_bytes({name: _analysis_body(result, media_type) for name, result in dashboard.items()})
+
+def _overview_payload() -> bytes:
+    if lakehouse.chunks is not None:
+        return _json_bytes(_streamed_overview(lakehouse.chunks))
+    orders = lakehouse.orders
+    return _json_bytes({
+        "customers": len(lakehouse.customers),
+        "products": len(lakehouse.products),
+        "orders": len(orders),
+        "order_items": len(lakehouse.order_items),
+        "total_revenue": orders['total_amount'].sum(),
+        "avg_order_value": orders['total_amount'].mean(),
+        "date_range": {
+            "start": orders['order_date'].min().isoformat(),
+            "end": orders['order_date'].max().isoformat()
+        }
+    })
+
+def _streamed_overview(chunks: ChunkedFacts) -> Dict[str, Any]:
+    """The overview from one streamed aggregation plus the chunk index, without loading orders"""
+    totals = chunks.aggregate(Aggregate(Scan('orders', ('orders.total_amount',)), (
+        Metric('orders', 'count'), Metric('revenue', 'sum', 'orders.total_amount')
+    )), lakehouse)
+    orders, revenue = totals.columns['orders'][0], totals.columns['revenue'][0]
+    return {
+        "customers": len(lakehouse.customers),
+        "products": len(lakehouse.products),
+        "orders": orders,
+        "order_items": chunks.rows['order_items'],
+        "total_revenue": revenue,
+        "avg_order_value": revenue / orders if orders else None,
+        "date_range": {
+            "start": pd.Timestamp(chunks.index.min_date.min()).isoformat(),
+            "end": pd.Timestamp(chunks.index.max_date.max()).isoformat()
+        }
+    }
+
+def _memory_payload() -> Dict[str, Any]:
+    return lakehouse.memory_usage()
+
+def _partitions_payload() -> Dict[str, Any]:
+    partitions = lakehouse.partitions()
+    return {"partitions": partitions.describe(), "total": len(partitions)}
+
+def _page_filters(query: TablePageQuery) -> Tuple[List[Predicate], Optional[str], bool]:
+    """Index predicates, sort column and direction from a page query's filter parameters"""
+    filters = query.model_dump(exclude_none=True, exclude={*TablePageQuery.model_fields, 'sort'})
+    predicates: List[Predicate] = []
+    bounds: Dict[str, Dict[str, Any]] = {}
+    for name, value in filters.items():
+        if isinstance(value, list):
+            # Ids arrive formatted and are matched as surrogate keys
+            values = parse_ids(name, value) if name in ID_FORMATS else value
+            predicates.append(In(name, tuple(values)))
+        else:
+            side, column = name.split('_', 1)
+            bounds.setdefault(column, {})[side] = value
+    for column, bound in bounds.items():
+        high = bound.get('max')
+        if isinstance(high, date):
+            # A max date covers its whole day
+            predicates.append(Range(column, bound.get('min'), high + timedelta(days=1), high_inclusive=False))
+        else:
+            predicates.append(Range(column, bound.get('min'), high))
+    sort = query.sort
+    if sort is None:
+        return predicates, None, False
+    return predicates, sort.lstrip('-'), sort.startswith('-')
+
+def _table_page_payload(table: str, limit: int, offset: int, after: Optional[str] = None,
+                        media_type: str = JSON_MEDIA_TYPE, query: Optional[TablePageQuery] = None) -> bytes:
+    key = TABLE_KEYS[table]
+    predicates, sort, descending = _page_filters(query) if query is not None else ([], None, False)
+    if predicates or sort is not None:
+        frame, indexes = lakehouse.indexes(table)
+        with stage('select'):
+            selection = select(frame, indexes, predicates, sort, descending)
+            start = selection.offset_after(frame, key, parse_id(key, after)) if after is not None else offset
+            rows = selection.page(start, limit)
+        total = len(selection)
+        count('rows_scanned', selection.examined)
+    else:
+        # Runs in the executor, so a table still loading blocks a worker, not the event loop
+        frame = getattr(lakehouse, table)
+        # A cursor resolves to a position by binary search on the sorted id column
+        start = keyset_start(frame, key, parse_id(key, after)) if after is not None else offset
+        rows = slice(start, start + limit)
+        total = len(frame)
+    with stage('page'):
+        # Surrogate keys are rendered as formatted ids only for the returned page
+        page = format_id_columns(frame.iloc[rows] if isinstance(rows, slice) else take_rows(frame, rows))
+        next_cursor = page[key].iloc[-1] if len(page) and start + len(page) < total else None
+        if 'order_date' in page and media_type != ARROW_MEDIA_TYPE:
+            # Convert datetime to string for JSON serialization
+            page['order_date'] = page['order_date'].astype(str)
+    count('rows_scanned', len(page))
+    page_info = {
+        "total": total,
+        "limit": limit,
+        "offset": start,
+        "next_cursor": next_cursor
+    }
+    if predicates or sort is not None:
+        # How the planner found the rows: the driving index (None for a scan) and the rows it checked
+        page_info["index"] = selection.index
+        page_info["rows_examined"] = selection.examined
+    if media_type == ARROW_MEDIA_TYPE:
+        with stage('encode'):
+            return frame_arrow_bytes(page, page_info)
+    if media_type == COLUMNAR_MEDIA_TYPE:
+        return _json_bytes({"columns": frame_columns(page), **page_info})
+    with stage('encode'):
+        # The records are encoded column by column and spliced in ahead of the paging info
+        return b'{"data":' + records_json(page) + b',' + json_bytes(page_info)[1:]
+
+@app.exception_handler(ExecutorOverloaded)
+async def executor_overloaded_handler(request: Request, exc: ExecutorOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server overloaded, retry shortly: {exc}"},
+        headers={"Retry-After": "1"}
+    )
 
 @app.get("/")
 async def root():
@@ -382,117 +1220,218 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now()}
+    return {"status": "healthy", "timestamp": datetime.now(), "executor": executor.stats(),
+            "tables": lakehouse.table_states()}
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving; never waits on the lakehouse"""
+    return {"status": "alive", "timestamp": datetime.now()}
+
+@app.get("/health/ready")
+async def readiness():
+    """200 once every table is loaded, 503 with the per-table load state until then"""
+    ready = lakehouse.ready
+    return LakehouseJSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "loading", "tables": lakehouse.table_states()}
+    )
 
 @app.get("/data/overview")
 async def data_overview():
     """Get data overview from the lakehouse"""
-    return {
-        "customers": len(lakehouse.customers),
-        "products": len(lakehouse.products),
-        "orders": len(lakehouse.orders),
-        "order_items": len(lakehouse.order_items),
-        "total_revenue": lakehouse.orders['total_amount'].sum(),
-        "avg_order_value": lakehouse.orders['total_amount'].mean(),
-        "date_range": {
-            "start": lakehouse.orders['order_date'].min().isoformat(),
-            "end": lakehouse.orders['order_date'].max().isoformat()
-        }
-    }
+    return _encoded_response(await _run_instrumented(_overview_payload))
 
 @app.post("/analytics/query")
-async def analytics_query(request: QueryRequest):
-    """Process natural language analytics query"""
+async def analytics_query(request: QueryRequest, accept: Optional[str] = Header(None)):
+    """Process natural language analytics query; answers in JSON, columnar JSON or Arrow per Accept"""
+    media_type = _negotiate(accept)
     try:
-        # Parse the natural language query
-        parsed_query = llm_analytics.parse_natural_language_query(request.query)
-        
-        # Execute analytics
-        result = llm_analytics.execute_analytics_query(parsed_query)
-        
-        return AnalyticsResponse(**result)
+        return _encoded_response(
+            await _run_instrumented(_analytics_query_payload, request.query, media_type, request.approximate),
+            media_type
+        )
     
+    except ExecutorOverloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/analytics/dashboard")
-async def dashboard_data():
-    """Get dashboard data"""
+@app.post("/analytics/query/batch")
+async def analytics_query_batch(request: BatchQueryRequest, accept: Optional[str] = Header(None)):
+    """Answer several natural language queries at once, computing the scans, joins and
+    group-bys they share once; results come back in request order, as JSON, columnar JSON or Arrow"""
+    media_type = _negotiate(accept)
     try:
-        # Revenue trend
-        revenue_trend = llm_analytics.execute_analytics_query({
-            'analysis_type': 'time_series',
-            'data_scope': ['revenue'],
-            'interpretation': 'Revenue trend analysis'
-        })
-        
-        # Top products
-        top_products = llm_analytics.execute_analytics_query({
-            'analysis_type': 'ranking',
-            'data_scope': ['products'],
-            'interpretation': 'Top products analysis'
-        })
-        
-        # Category comparison
-        category_comparison = llm_analytics.execute_analytics_query({
-            'analysis_type': 'comparison',
-            'data_scope': ['products'],
-            'interpretation': 'Category comparison analysis'
-        })
-        
-        # Customer segments
-        customer_segments = llm_analytics.execute_analytics_query({
-            'analysis_type': 'distribution',
-            'data_scope': ['customers'],
-            'interpretation': 'Customer segment distribution'
-        })
-        
-        return {
-            "revenue_trend": revenue_trend,
-            "top_products": top_products,
-            "category_comparison": category_comparison,
-            "customer_segments": customer_segments
-        }
+        return _encoded_response(
+            await _run_instrumented(_batch_payload, request.queries, media_type, request.approximate), media_type
+        )
     
+    except ExecutorOverloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/data/customers")
-async def get_customers(limit: int = 100, offset: int = 0):
-    """Get customer data"""
-    customers_page = lakehouse.customers.iloc[offset:offset+limit]
+@app.get("/analytics/cache")
+async def analytics_cache_stats():
+    """Get result cache statistics"""
     return {
-        "data": customers_page.to_dict('records'),
-        "total": len(lakehouse.customers),
-        "limit": limit,
-        "offset": offset
+        "data_version": lakehouse.data_version,
+        **llm_analytics.cache.stats()
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, stage and lakehouse metrics in the Prometheus text format"""
+    # Rendered in a plain thread: with a process pool executor the metrics
+    # live in this process, not in the workers
+    return Response(content=await asyncio.to_thread(registry.render), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/analytics/dashboard")
+async def dashboard_data(accept: Optional[str] = Header(None)):
+    """Get dashboard data, as JSON, columnar JSON or Arrow per Accept"""
+    media_type = _negotiate(accept)
+    try:
+        # Revenue trend, top products, category comparison and customer
+        # segments are computed concurrently
+        results = await asyncio.gather(*(
+            _run_instrumented(_execute_query, query) for query in DASHBOARD_QUERIES.values()
+        ))
+        dashboard = dict(zip(DASHBOARD_QUERIES, results))
+        return _encoded_response(await _run_instrumented(_dashboard_payload, dashboard, media_type), media_type)
+    
+    except ExecutorOverloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _table_page(table: str, query: TablePageQuery, accept: Optional[str]) -> Response:
+    media_type = _negotiate(accept)
+    try:
+        return _encoded_response(
+            await _run_instrumented(_table_page_payload, table, query.limit, query.offset, query.after,
+                                    media_type, query),
+            media_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/data/customers")
+async def get_customers(query: Annotated[CustomerPageQuery, Query()], accept: Optional[str] = Header(None)):
+    """Get customer data, optionally filtered and sorted, paged by offset or by the `after` cursor (last id seen)"""
+    return await _table_page('customers', query, accept)
+
 @app.get("/data/products")
-async def get_products(limit: int = 100, offset: int = 0):
-    """Get product data"""
-    products_page = lakehouse.products.iloc[offset:offset+limit]
-    return {
-        "data": products_page.to_dict('records'),
-        "total": len(lakehouse.products),
-        "limit": limit,
-        "offset": offset
-    }
+async def get_products(query: Annotated[ProductPageQuery, Query()], accept: Optional[str] = Header(None)):
+    """Get product data, optionally filtered and sorted, paged by offset or by the `after` cursor (last id seen)"""
+    return await _table_page('products', query, accept)
 
 @app.get("/data/orders")
-async def get_orders(limit: int = 100, offset: int = 0):
-    """Get order data"""
-    orders_page = lakehouse.orders.iloc[offset:offset+limit]
-    # Convert datetime to string for JSON serialization
-    orders_data = orders_page.copy()
-    orders_data['order_date'] = orders_data['order_date'].astype(str)
+async def get_orders(query: Annotated[OrderPageQuery, Query()], accept: Optional[str] = Header(None)):
+    """Get order data, optionally filtered and sorted, paged by offset or by the `after` cursor (last id seen)"""
+    return await _table_page('orders', query, accept)
+
+@app.get("/data/memory")
+async def data_memory():
+    """Get bytes held per lakehouse table and column"""
+    return await _run_instrumented(_memory_payload)
+
+@app.get("/data/partitions")
+async def data_partitions():
+    """Get the monthly order partitions and their date ranges"""
+    return await _run_instrumented(_partitions_payload)
+
+def _export_start(table: str, after: Optional[str]) -> Tuple[pd.DataFrame, int]:
+    """The table to export and the position its export starts at"""
+    frame = getattr(lakehouse, table)
+    key = TABLE_KEYS[table]
+    return frame, keyset_start(frame, key, parse_id(key, after) if after is not None else None)
+
+@app.get("/data/{table}/export")
+async def export_table(table: str, format: str = 'ndjson', after: Optional[str] = None,
+                       chunk_rows: int = Query(DEFAULT_EXPORT_CHUNK_ROWS, ge=1, le=1_000_000)):
+    """Stream a whole table as NDJSON or Arrow IPC record batches"""
+    if table not in TABLE_KEYS:
+        raise HTTPException(status_code=404, detail=f"Unknown table: {table}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        # Resolving the table may load it, so this stays off the event loop too
+        frame, start = await asyncio.to_thread(_export_start, table, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stream = ndjson_stream if format == 'ndjson' else arrow_stream
+    # Sync generators are iterated in a worker thread, so encoding stays off the event loop
+    return StreamingResponse(
+        stream(frame, chunk_rows, start),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'}
+    )
+
+def _order_batch_frames(batch: OrderBatchRequest):
+    """Convert an ingestion request into column-oriented orders/order_items frames"""
+    now = datetime.now()
+    order_refs, product_ids, quantities, unit_prices, discounts = [], [], [], [], []
+    for ref, order in enumerate(batch.orders):
+        for item in order.items:
+            order_refs.append(ref)
+            product_ids.append(item.product_id)
+            quantities.append(item.quantity)
+            unit_prices.append(item.unit_price)
+            discounts.append(item.discount_percentage)
+
+    quantity = np.array(quantities, dtype=np.int64)
+    unit_price = np.round(np.array(unit_prices, dtype=np.float64), 2)
+    total_price = np.round(unit_price * quantity, 2)
+    order_items = pd.DataFrame({
+        'order_ref': np.array(order_refs, dtype=np.int64),
+        'product_id': parse_ids('product_id', product_ids),
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'total_price': total_price,
+        'discount_percentage': discounts
+    })
+
+    # Orders without an explicit total are charged items + shipping + tax - discount
+    items_total = np.bincount(order_items['order_ref'], weights=total_price, minlength=len(batch.orders))
+    orders = pd.DataFrame([
+        order.model_dump(exclude={'items'}) for order in batch.orders
+    ])
+    orders['customer_id'] = parse_ids('customer_id', orders['customer_id'])
+    # Dates with a UTC offset are converted to UTC; naive dates are taken as they are
+    order_dates = pd.to_datetime(orders['order_date'].fillna(now), utc=True)
+    orders['order_date'] = order_dates.dt.tz_convert(None).astype('datetime64[ns]')
+    computed_total = items_total + orders['shipping_cost'] + orders['tax_amount'] - orders['discount_amount']
+    orders['total_amount'] = orders['total_amount'].fillna(computed_total.clip(lower=0).round(2)).astype(np.float64)
+    return orders, order_items
+
+def _ingest_batch(batch: OrderBatchRequest) -> Dict[str, Any]:
+    orders, order_items = _order_batch_frames(batch)
+    orders, order_items = lakehouse.ingest_orders(orders, order_items)
     return {
-        "data": orders_data.to_dict('records'),
-        "total": len(lakehouse.orders),
-        "limit": limit,
-        "offset": offset
+        "ingested_orders": len(orders),
+        "ingested_order_items": len(order_items),
+        "order_ids": format_id_columns(orders[['order_id']])['order_id'].tolist(),
+        "data_version": lakehouse.data_version
     }
 
+@app.post("/data/orders/batch")
+async def ingest_orders_batch(batch: OrderBatchRequest):
+    """Append a batch of orders and their line items"""
+    if executor.kind != 'thread':
+        # Process workers hold their own copies of the tables and would never see the batch
+        raise HTTPException(status_code=409, detail="Order ingestion requires ANALYTICS_EXECUTOR=thread")
+    if lakehouse.shared:
+        # Shared tables are read-only, and other workers would never see the batch
+        raise HTTPException(status_code=409, detail="Order ingestion is not available with shared worker tables")
+    if lakehouse.execution == 'chunked':
+        # Streamed aggregations read the snapshot files, which never change
+        raise HTTPException(status_code=409, detail="Order ingestion is not available with chunked execution")
+    try:
+        return await _run_instrumented(_ingest_batch, batch)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
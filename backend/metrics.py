@@ -0,0 +1,374 @@
+"""Request instrumentation: stage timings, Prometheus metrics and Server-Timing.
+
+Work that runs in executor workers is wrapped with `instrumented`, which
+gives it a fresh StageTimer. Code on the request path marks stages with
+`stage('parse')`, adds counters with `count('rows_scanned', n)` and labels
+the work with `label('analysis_type', ...)`; all of these are no-ops when no
+timer is active. The timer travels back with the result (it is plain data,
+so this also works from a process pool) and is attached to the request,
+which MetricsMiddleware turns into a Server-Timing header and histogram
+observations labeled by route.
+
+The registry implements just the parts of the Prometheus text format this
+app needs (counters, gauges and histograms with labels), so there is no
+client library dependency.
+"""
+import math
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import profiler
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds, and size buckets for row and byte counts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(10.0 ** exponent for exponent in range(2, 11))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value(_Metric):
+    """A metric with one value per label set, updated directly or read from a
+    callback (returning {label values: value}) at scrape time"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._callback = callback
+
+    def samples(self) -> List[str]:
+        if self._callback is not None:
+            values = self._callback()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Counter(_Value):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Value):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last is +Inf), sum]
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = (),
+                callback: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Counter:
+        return self.register(Counter(name, documentation, labels, callback))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            samples = metric.samples()
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method', 'status')
+)
+STAGE_DURATION = registry.histogram(
+    'analytics_stage_duration_seconds', 'Time spent in each request stage',
+    ('endpoint', 'analysis_type', 'stage')
+)
+ROWS_SCANNED = registry.histogram(
+    'analytics_rows_scanned', 'Table rows read per unit of query work',
+    ('endpoint', 'analysis_type'), SIZE_BUCKETS
+)
+BYTES_ALLOCATED = registry.histogram(
+    'analytics_bytes_allocated', 'Bytes of intermediate arrays allocated per unit of query work',
+    ('endpoint', 'analysis_type'), SIZE_BUCKETS
+)
+PROFILES_WRITTEN = registry.counter(
+    'analytics_slow_request_profiles_total', 'Stack profiles written for slow requests', ('endpoint',)
+)
+
+
+class StageTimer:
+    """Stage timings, counters and labels of one unit of request work"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self.labels: Dict[str, str] = {}
+        self.elapsed = 0.0
+        self.profile_path: Optional[str] = None
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name: str, value: float):
+        self.counters[name] = self.counters.get(name, 0.0) + value
+
+
+_current: ContextVar[Optional[StageTimer]] = ContextVar('stage_timer', default=None)
+
+
+class _Stage:
+    # A plain class rather than @contextmanager: stages wrap hot paths
+    __slots__ = ('name', 'timer', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timer = _current.get()
+
+    def __enter__(self):
+        if self.timer is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timer is not None:
+            self.timer.add_stage(self.name, time.perf_counter() - self.start)
+
+
+def stage(name: str) -> _Stage:
+    """Time a with-block as the named stage of the current unit of work"""
+    return _Stage(name)
+
+
+def count(name: str, value: float):
+    timer = _current.get()
+    if timer is not None:
+        timer.add_count(name, value)
+
+
+def label(name: str, value: Any):
+    timer = _current.get()
+    if timer is not None:
+        timer.labels[name] = str(value)
+
+
+def instrumented(fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, StageTimer]:
+    """Run fn under a fresh StageTimer and return its result with the timer.
+
+    Module-level so it can be sent to a process pool along with fn.
+    """
+    timer = StageTimer()
+    token = _current.set(timer)
+    start = time.perf_counter()
+    try:
+        with profiler.sampling() as stacks:
+            result = fn(*args, **kwargs)
+    finally:
+        timer.elapsed = time.perf_counter() - start
+        _current.reset(token)
+    if stacks is not None and timer.elapsed * 1000 >= profiler.slow_threshold_ms():
+        timer.profile_path = profiler.write_profile(stacks, fn.__name__, timer.elapsed)
+    return result, timer
+
+
+def _covered(intervals: Sequence[Tuple[float, float]]) -> float:
+    """Length of the union of (start, end) intervals"""
+    total, reached = 0.0, -math.inf
+    for start, end in sorted(intervals):
+        if end > reached:
+            total += end - max(start, reached)
+            reached = end
+    return total
+
+
+class RequestMetrics:
+    """Worker timers and event-loop stages attached to one HTTP request"""
+
+    def __init__(self):
+        self.units: List[StageTimer] = []
+        self.stages: Dict[str, float] = {}
+        # When each unit waited, from its submission until it started running
+        self._waits: List[Tuple[float, float]] = []
+
+    def attach(self, timer: StageTimer, waited: float):
+        """Add a worker's timer; waited is the wall time the request spent awaiting it, up to now"""
+        self.units.append(timer)
+        now = time.perf_counter()
+        self._waits.append((now - waited, now - timer.elapsed))
+        # Units awaited concurrently wait at the same time, so the queue stage is
+        # the wall time during which any of them waited, not the sum of their waits
+        self.stages['queue'] = _covered([(start, end) for start, end in self._waits if end > start])
+
+    def totals(self) -> Dict[str, float]:
+        stages = dict(self.stages)
+        for timer in self.units:
+            for name, seconds in timer.stages.items():
+                stages[name] = stages.get(name, 0.0) + seconds
+        return stages
+
+
+_request: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+
+def attach(timer: StageTimer, waited: float):
+    """Attach a worker's timer to the current request, if one is being measured"""
+    request = _request.get()
+    if request is not None:
+        request.attach(timer, waited)
+
+
+def server_timing(stages: Dict[str, float], total: float) -> str:
+    entries = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in stages.items()]
+    entries.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(entries)
+
+
+class MetricsMiddleware:
+    """ASGI middleware adding Server-Timing headers and recording request metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics()
+        token = _request.set(request)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                timing = server_timing(request.totals(), time.perf_counter() - start)
+                headers.append((b'server-timing', timing.encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request.reset(token)
+            self._record(scope, request, status, time.perf_counter() - start)
+
+    @staticmethod
+    def _record(scope, request: RequestMetrics, status: int, duration: float):
+        route = scope.get('route')
+        # Route templates keep label cardinality bounded; unmatched paths share one label
+        endpoint = getattr(route, 'path', None) or 'unmatched'
+        REQUEST_DURATION.observe(duration, endpoint=endpoint, method=scope['method'], status=str(status))
+        for name, seconds in request.stages.items():
+            STAGE_DURATION.observe(seconds, endpoint=endpoint, analysis_type='none', stage=name)
+        for timer in request.units:
+            analysis_type = timer.labels.get('analysis_type', 'none')
+            for name, seconds in timer.stages.items():
+                STAGE_DURATION.observe(seconds, endpoint=endpoint, analysis_type=analysis_type, stage=name)
+            if 'rows_scanned' in timer.counters:
+                ROWS_SCANNED.observe(timer.counters['rows_scanned'], endpoint=endpoint, analysis_type=analysis_type)
+            if 'bytes_allocated' in timer.counters:
+                BYTES_ALLOCATED.observe(timer.counters['bytes_allocated'], endpoint=endpoint,
+                                        analysis_type=analysis_type)
+            if timer.profile_path is not None:
+                PROFILES_WRITTEN.inc(endpoint=endpoint)
@@ -0,0 +1,164 @@
+"""Monthly partitions of the orders fact tables.
+
+Orders are clustered by order date (ids are assigned in date order), so each
+calendar month is a contiguous row range of orders and, because order items
+are stored in order id order, a contiguous row range of order items too. A
+partition records both ranges plus the min/max order date of its rows. A
+date-range query skips every partition whose [min, max] misses the range,
+takes fully covered partitions whole, and only filters rows inside the
+partitions on the range's edges, so its cost follows the window rather than
+total history.
+
+Rows that arrive out of date order (e.g. backfilled orders) still get
+correct min/max metadata, just less selective partitions.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# The fact tables partitioned here, and the column they are partitioned on
+PARTITIONED_TABLES = ('orders', 'order_items')
+PARTITION_COLUMN = 'orders.order_date'
+
+# Tails with more month changes than this many rows per run are not clustered
+# by date; they are cut into fixed-size blocks instead of one partition per run
+MIN_RUN_ROWS = 64
+BLOCK_ROWS = 65_536
+
+
+def _runs(months: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start/stop offsets of the partitions for a block of rows"""
+    n = len(months)
+    changes = np.flatnonzero(months[1:] != months[:-1]) + 1
+    if len(changes) + 1 > max(1, n // MIN_RUN_ROWS):
+        changes = np.arange(BLOCK_ROWS, n, BLOCK_ROWS)
+    return np.r_[0, changes], np.r_[changes, n]
+
+
+class PartitionIndex:
+    """Row ranges and date zone maps for the orders/order_items partitions"""
+
+    def __init__(self):
+        self.month: List[Optional[str]] = []
+        self.order_start = np.empty(0, dtype=np.int64)
+        self.order_stop = np.empty(0, dtype=np.int64)
+        self.item_start = np.empty(0, dtype=np.int64)
+        self.item_stop = np.empty(0, dtype=np.int64)
+        self.min_date = np.empty(0, dtype='datetime64[ns]')
+        self.max_date = np.empty(0, dtype='datetime64[ns]')
+
+    def __len__(self) -> int:
+        return len(self.month)
+
+    @property
+    def order_rows(self) -> int:
+        return int(self.order_stop[-1]) if len(self) else 0
+
+    @classmethod
+    def build(cls, orders: pd.DataFrame, order_items: pd.DataFrame) -> 'PartitionIndex':
+        return cls().extended(orders, order_items)
+
+    def extended(self, orders: pd.DataFrame, order_items: pd.DataFrame) -> 'PartitionIndex':
+        """A new index that also covers the order rows appended since this one.
+
+        The tail's first partition is merged into the last existing one when
+        both hold the same month, so ingesting current orders grows the
+        current month's partition instead of adding one per batch. The index
+        itself is never modified, so readers holding it stay consistent.
+        """
+        known = self.order_rows
+        if known >= len(orders):
+            return self
+        dates = orders['order_date'].to_numpy()[known:]
+        order_ids = orders['order_id'].to_numpy()[known:]
+        item_order_ids = order_items['order_id'].to_numpy()
+
+        starts, stops = _runs(dates.astype('datetime64[M]'))
+        min_date = np.minimum.reduceat(dates, starts)
+        max_date = np.maximum.reduceat(dates, starts)
+        month = [str(lo) if lo == hi else None
+                 for lo, hi in zip(min_date.astype('datetime64[M]'), max_date.astype('datetime64[M]'))]
+        tail = {
+            'order_start': known + starts,
+            'order_stop': known + stops,
+            'item_start': np.searchsorted(item_order_ids, order_ids[starts], side='left'),
+            'item_stop': np.searchsorted(item_order_ids, order_ids[stops - 1], side='right'),
+            'min_date': min_date,
+            'max_date': max_date,
+        }
+
+        index = PartitionIndex()
+        head = len(self)
+        if head and self.month[-1] is not None and self.month[-1] == month[0]:
+            # Fold the tail's first partition into the current last one
+            head -= 1
+            tail['order_start'][0] = self.order_start[-1]
+            tail['item_start'][0] = self.item_start[-1]
+            tail['min_date'][0] = min(self.min_date[-1], min_date[0])
+            tail['max_date'][0] = max(self.max_date[-1], max_date[0])
+        index.month = self.month[:head] + month
+        for field, values in tail.items():
+            setattr(index, field, np.concatenate([getattr(self, field)[:head], values]))
+        return index
+
+    def prune(self, start: Optional[np.datetime64], end: Optional[np.datetime64]
+              ) -> Tuple[np.ndarray, np.ndarray]:
+        """Partitions overlapping [start, end), and which of them it fully covers"""
+        overlaps = np.ones(len(self), dtype=bool)
+        covered = np.ones(len(self), dtype=bool)
+        if start is not None:
+            overlaps &= self.max_date >= start
+            covered &= self.min_date >= start
+        if end is not None:
+            overlaps &= self.min_date < end
+            covered &= self.max_date < end
+        selected = np.flatnonzero(overlaps)
+        return selected, covered[selected]
+
+    def scan(self, orders: pd.DataFrame, order_items: pd.DataFrame,
+             start: Optional[np.datetime64], end: Optional[np.datetime64]) -> Dict[str, Any]:
+        """Row positions of the orders and order items dated within [start, end)"""
+        selected, covered = self.prune(start, end)
+        dates = orders['order_date'].to_numpy()
+        order_ids = orders['order_id'].to_numpy()
+        item_order_ids = order_items['order_id'].to_numpy()
+
+        order_rows, item_rows = [], []
+        for partition, whole in zip(selected, covered):
+            lo, hi = self.order_start[partition], self.order_stop[partition]
+            item_lo, item_hi = self.item_start[partition], self.item_stop[partition]
+            if whole:
+                order_rows.append(np.arange(lo, hi))
+                item_rows.append(np.arange(item_lo, item_hi))
+                continue
+            # Edge partition: filter its rows, then keep the items of the kept orders
+            keep = np.ones(hi - lo, dtype=bool)
+            if start is not None:
+                keep &= dates[lo:hi] >= start
+            if end is not None:
+                keep &= dates[lo:hi] < end
+            item_order = np.searchsorted(order_ids[lo:hi], item_order_ids[item_lo:item_hi])
+            order_rows.append(lo + np.flatnonzero(keep))
+            item_rows.append(item_lo + np.flatnonzero(keep[item_order]))
+
+        empty = np.empty(0, dtype=np.int64)
+        return {
+            'orders': np.concatenate(order_rows) if order_rows else empty,
+            'order_items': np.concatenate(item_rows) if item_rows else empty,
+            'partitions_scanned': len(selected),
+            'partitions_total': len(self),
+        }
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """Partition metadata for display"""
+        return [
+            {
+                'month': self.month[i],
+                'orders': int(self.order_stop[i] - self.order_start[i]),
+                'order_items': int(self.item_stop[i] - self.item_start[i]),
+                'min_date': pd.Timestamp(self.min_date[i]).isoformat(),
+                'max_date': pd.Timestamp(self.max_date[i]).isoformat(),
+            }
+            for i in range(len(self))
+        ]
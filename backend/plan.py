@@ -0,0 +1,664 @@
+"""Logical query plans for analytics questions.
+
+A parsed question is turned into a small tree of relational operators (scan,
+filter, join, group-by, aggregate, top-k, order) over qualified columns such
+as 'orders.total_amount'. optimize() rewrites the tree before engine.py runs
+it:
+
+* filters on the order date are pushed into the scan of the orders or
+  order_items table, where they become partition pruning;
+* scans and joins only keep the columns some operator above reads, and
+  joins that no longer contribute a column are dropped;
+* repeated joins to the same table are merged (the executor resolves every
+  join through the lakehouse's shared positional join index);
+* aggregations that match an incrementally maintained aggregate read it
+  instead of scanning the fact table;
+* in approximate plans, the remaining scans of orders and order items read
+  the stratified sample instead, and revenue rankings, distinct customers
+  and order value percentiles read monthly sketches (see sketches.py).
+
+Plan nodes are frozen dataclasses, so identical subplans compare and hash
+equal. share_work() extends this to a batch of optimized plans: it spells
+work that several plans could share identically, so the engine runs it once.
+"""
+import re
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple, Union
+
+from aggregates import MATERIALIZED_VIEWS
+from partitions import PARTITION_COLUMN, PARTITIONED_TABLES
+
+DEFAULT_LIMIT = 10
+
+
+@dataclass(frozen=True)
+class Metric:
+    name: str
+    func: str  # 'sum', 'count', 'mean' or 'count_distinct'
+    column: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Scan:
+    table: str
+    columns: Tuple[str, ...] = ()
+    # [start, end) on the order date, applied through partition pruning
+    time_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+
+
+@dataclass(frozen=True)
+class Filter:
+    source: 'Node'
+    column: str
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Join:
+    """Many-to-one join from the rows of source to a dimension or parent table"""
+    source: 'Node'
+    table: str
+    columns: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class GroupBy:
+    source: 'Node'
+    keys: Tuple[str, ...]
+    # Date keys are truncated to this grain ('D', 'W' or 'M')
+    grain: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    """Metrics per group of a GroupBy source, or over all rows of any other source"""
+    source: 'Node'
+    metrics: Tuple[Metric, ...]
+
+
+@dataclass(frozen=True)
+class TopK:
+    source: 'Node'
+    by: str
+    k: int
+
+
+@dataclass(frozen=True)
+class Order:
+    source: 'Node'
+    by: str
+    descending: bool = False
+
+
+@dataclass(frozen=True)
+class MaterializedScan:
+    """Read a group-by result kept up to date by LakehouseAggregates"""
+    fact: str
+    keys: Tuple[str, ...]
+    grain: Optional[str]
+    metrics: Tuple[Metric, ...]
+
+
+@dataclass(frozen=True)
+class Quantiles:
+    """Values of a column at the given quantiles, over all rows of source"""
+    source: 'Node'
+    column: str
+    quantiles: Tuple[float, ...]
+
+
+@dataclass(frozen=True)
+class SampleScan:
+    """Scan of the stratified sample of orders or their order items, with estimation weights"""
+    table: str
+    columns: Tuple[str, ...] = ()
+    time_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+
+
+@dataclass(frozen=True)
+class HeavyHitters:
+    """Top k keys by revenue from the monthly Space-Saving sketches"""
+    fact: str
+    key: str
+    metric: Metric
+    k: int
+    time_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+
+
+@dataclass(frozen=True)
+class DistinctSketch:
+    """Distinct customers who ordered, from the monthly HyperLogLog sketches"""
+    metric: Metric
+    time_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+
+
+@dataclass(frozen=True)
+class QuantileSketch:
+    """Order value quantiles from the monthly t-digests"""
+    column: str
+    quantiles: Tuple[float, ...]
+    time_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+
+
+Node = Union[Scan, Filter, Join, GroupBy, Aggregate, TopK, Order, Quantiles, MaterializedScan,
+             SampleScan, HeavyHitters, DistinctSketch, QuantileSketch]
+# Nodes without a source
+LEAVES = (Scan, MaterializedScan, SampleScan, HeavyHitters, DistinctSketch, QuantileSketch)
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """Named output relations plus what the presenter needs to render them"""
+    kind: str
+    outputs: Tuple[Tuple[str, Node], ...]
+    grain: str = 'M'
+    time_label: Optional[str] = None
+    params: Tuple[Tuple[str, Any], ...] = field(default=())
+    # Answer from samples and sketches where that avoids a scan
+    approximate: bool = False
+
+
+def table_of(column: str) -> str:
+    return column.split('.', 1)[0]
+
+
+# Phrases naming a group-by dimension, longest first when matching
+DIMENSIONS = {
+    'payment methods': 'orders.payment_method', 'payment method': 'orders.payment_method',
+    'payment': 'orders.payment_method',
+    'shipping methods': 'orders.shipping_method', 'shipping method': 'orders.shipping_method',
+    'shipping': 'orders.shipping_method',
+    'channels': 'orders.channel', 'channel': 'orders.channel',
+    'order status': 'orders.order_status', 'status': 'orders.order_status',
+    'subcategories': 'products.subcategory', 'subcategory': 'products.subcategory',
+    'product categories': 'products.category', 'product category': 'products.category',
+    'categories': 'products.category', 'category': 'products.category',
+    'brands': 'products.brand', 'brand': 'products.brand',
+    'products': 'products.product_id', 'product': 'products.product_id',
+    'customer segments': 'customers.customer_segment', 'customer segment': 'customers.customer_segment',
+    'segments': 'customers.customer_segment', 'segment': 'customers.customer_segment',
+    'genders': 'customers.gender', 'gender': 'customers.gender',
+    'states': 'customers.state', 'state': 'customers.state',
+    'countries': 'customers.country', 'country': 'customers.country',
+    'customers': 'customers.customer_id', 'customer': 'customers.customer_id',
+}
+_DIMENSION_PHRASES = sorted(DIMENSIONS, key=lambda phrase: -len(phrase.split()))
+# Lookahead capture, so a dimension list starting inside another one is still found
+_RE_DIMENSION_START = re.compile(r'\b(?:by|per|across|for each|top(?:\s+\d+)?)\s+(?=(.*))')
+
+# Metric phrases, checked in this order
+METRIC_PHRASES = [
+    ('average order value', 'avg_order_value'), ('avg order value', 'avg_order_value'),
+    ('aov', 'avg_order_value'),
+    ('quantity', 'quantity'), ('units', 'quantity'),
+    ('number of orders', 'orders'), ('order count', 'orders'), ('orders', 'orders'),
+    ('unique customers', 'customers'), ('number of customers', 'customers'),
+    ('customer count', 'customers'),
+    ('revenue', 'revenue'), ('sales', 'revenue'), ('income', 'revenue'), ('spend', 'revenue'),
+]
+
+# Group-bys and metrics each fixed analysis kind answers with its own response shape
+FIXED_GROUPINGS = {
+    'ranking': ({'products.product_id', 'customers.customer_id'}, {'revenue'}),
+    'comparison': ({'products.category'}, {'revenue', 'quantity'}),
+    'distribution': ({'customers.customer_segment', 'orders.order_status'}, {'customers', 'orders'}),
+}
+
+# How each metric is computed at the order and order-item grain
+METRICS = {
+    'revenue': {
+        'orders': Metric('revenue', 'sum', 'orders.total_amount'),
+        'order_items': Metric('revenue', 'sum', 'order_items.total_price'),
+    },
+    'orders': {
+        'orders': Metric('orders', 'count'),
+        'order_items': Metric('orders', 'count_distinct', 'order_items.order_id'),
+    },
+    'avg_order_value': {
+        'orders': Metric('avg_order_value', 'mean', 'orders.total_amount'),
+    },
+    'quantity': {
+        'order_items': Metric('quantity', 'sum', 'order_items.quantity'),
+    },
+    'customers': {
+        'orders': Metric('customers', 'count_distinct', 'orders.customer_id'),
+        'order_items': Metric('customers', 'count_distinct', 'orders.customer_id'),
+    },
+}
+
+# Row count kept next to ranked and compared metrics; presenters do not show it
+ROW_COUNT = Metric('rows', 'count')
+
+# Order value percentiles reported by approximate overviews
+OVERVIEW_QUANTILES = (0.5, 0.9, 0.99)
+
+# Keys whose revenue the monthly Space-Saving sketches track, by fact table
+SKETCHED_KEYS = {'order_items': 'products.product_id', 'orders': 'customers.customer_id'}
+# Sampling draws whole orders, so distinct orders can be estimated from it
+SAMPLE_UNIT_COLUMNS = frozenset({'orders.order_id', 'order_items.order_id'})
+
+# Columns shown in place of a surrogate key
+LABEL_COLUMNS = {
+    'products.product_id': ('products.product_name',),
+    'customers.customer_id': ('customers.first_name', 'customers.last_name'),
+}
+
+
+def extract_dimensions(text: str) -> List[str]:
+    """Group-by dimensions named after 'by', 'per', 'across' or 'top N'"""
+    dimensions: List[str] = []
+    for match in _RE_DIMENSION_START.finditer(text.lower()):
+        words = re.findall(r'[a-z]+', match.group(1))
+        position = 0
+        while position < len(words):
+            if words[position] in ('and', 'the', 'each'):
+                position += 1
+                continue
+            for phrase in _DIMENSION_PHRASES:
+                length = len(phrase.split())
+                if ' '.join(words[position:position + length]) == phrase:
+                    if DIMENSIONS[phrase] not in dimensions:
+                        dimensions.append(DIMENSIONS[phrase])
+                    position += length
+                    break
+            else:
+                break
+    return dimensions
+
+
+def extract_metrics(text: str) -> List[str]:
+    """Metrics mentioned in the query, in order of first mention"""
+    text = text.lower()
+    found: Dict[str, int] = {}
+    for phrase, metric in METRIC_PHRASES:
+        match = re.search(rf'\b{phrase}\b', text)
+        if match and metric not in found:
+            found[metric] = match.start()
+    return sorted(found, key=found.get)
+
+
+def extract_limit(text: str) -> Optional[int]:
+    match = re.search(r'\b(?:top|bottom|first)\s+(\d+)\b', text.lower())
+    return int(match.group(1)) if match else None
+
+
+def _joined(node: Node, fact: str, columns) -> Node:
+    """Join every table besides the fact table that the columns reference"""
+    for table in sorted({table_of(column) for column in columns if column} - {fact}):
+        node = Join(node, table)
+    return node
+
+
+def _fact_scan(fact: str, time_filter: Optional[Dict[str, Any]]) -> Node:
+    node: Node = Scan(fact)
+    if time_filter and fact in PARTITIONED_TABLES:
+        node = _joined(node, fact, [PARTITION_COLUMN])
+        node = Filter(node, PARTITION_COLUMN, time_filter['start'], time_filter['end'])
+    return node
+
+
+def _grouped(fact: str, time_filter, keys: List[str], metrics: List[Metric],
+             grain: Optional[str] = None) -> Node:
+    node = _fact_scan(fact, time_filter)
+    node = _joined(node, fact, keys + [metric.column for metric in metrics])
+    if keys:
+        node = GroupBy(node, tuple(keys), grain)
+    return Aggregate(node, tuple(metrics))
+
+
+def _with_labels(node: Node, keys: List[str]) -> Node:
+    """Fetch display columns for surrogate keys after aggregation, for the surviving groups only"""
+    for key in keys:
+        if key in LABEL_COLUMNS:
+            node = Join(node, table_of(key), LABEL_COLUMNS[key])
+    return node
+
+
+def build_plan(parsed_query: Dict[str, Any]) -> QueryPlan:
+    """Logical plan for a parsed query"""
+    analysis_type = parsed_query.get('analysis_type', 'general')
+    data_scope = parsed_query.get('data_scope', [])
+    time_filter = parsed_query.get('time_filter')
+    grain = parsed_query.get('grain', 'M')
+    dimensions = list(parsed_query.get('group_by') or [])
+    metric_names = list(parsed_query.get('metrics') or [])
+    limit = parsed_query.get('limit') or DEFAULT_LIMIT
+    time_label = time_filter['label'] if time_filter else None
+    approximate = bool(parsed_query.get('approximate'))
+
+    def plan(kind: str, *outputs: Tuple[str, Node], **params) -> QueryPlan:
+        return QueryPlan(kind, tuple(outputs), grain, time_label, tuple(sorted(params.items())), approximate)
+
+    # Questions grouped the way a fixed kind already groups keep that kind's response shape
+    fixed_dimensions, fixed_metrics = FIXED_GROUPINGS.get(analysis_type, (set(), set()))
+    fixed_kind = (
+        analysis_type in FIXED_GROUPINGS
+        and len(dimensions) <= 1 and set(dimensions) <= fixed_dimensions
+        and set(metric_names) <= fixed_metrics
+    )
+
+    if analysis_type == 'time_series':
+        return plan('time_series', ('trend', _grouped(
+            'orders', time_filter, ['orders.order_date'],
+            [METRICS['revenue']['orders'], METRICS['orders']['orders']], grain
+        )))
+
+    if dimensions and not fixed_kind:
+        return _grouped_plan(plan, analysis_type, data_scope, time_filter, dimensions, metric_names, limit)
+
+    if analysis_type == 'ranking':
+        if dimensions == ['products.product_id'] or (not dimensions and 'products' in data_scope):
+            key, fact = 'products.product_id', 'order_items'
+            kind = 'top_products'
+        else:
+            key, fact = 'customers.customer_id', 'orders'
+            kind = 'top_customers'
+        node = _grouped(fact, time_filter, [key], [METRICS['revenue'][fact], ROW_COUNT])
+        return plan(kind, ('top', _with_labels(TopK(node, 'revenue', limit), [key])))
+
+    if analysis_type == 'comparison':
+        return plan('category_comparison', ('categories', _grouped(
+            'order_items', time_filter, ['products.category'],
+            [METRICS['revenue']['order_items'], METRICS['quantity']['order_items'], ROW_COUNT]
+        )))
+
+    if analysis_type == 'distribution':
+        if dimensions == ['customers.customer_segment'] or (not dimensions and 'customers' in data_scope):
+            # Segments are not dated, so the time filter does not apply
+            node = _grouped('customers', None, ['customers.customer_segment'], [Metric('customers', 'count')])
+            return plan('segment_distribution', ('segments', Order(node, 'customers', descending=True)))
+        node = _grouped('orders', time_filter, ['orders.order_status'], [Metric('orders', 'count')])
+        return plan('status_distribution', ('statuses', Order(node, 'orders', descending=True)))
+
+    outputs = [
+        ('totals', _grouped('orders', time_filter, [],
+                            [METRICS['orders']['orders'], METRICS['revenue']['orders']])),
+        ('customers', Aggregate(Scan('customers'), (Metric('customers', 'count'),))),
+        ('products', Aggregate(Scan('products'), (Metric('products', 'count'),))),
+    ]
+    if approximate:
+        # Sketches make these cheap enough to add to every approximate overview
+        outputs += [
+            ('active_customers', _grouped('orders', time_filter, [],
+                                          [Metric('active_customers', 'count_distinct', 'orders.customer_id')])),
+            ('order_values', Quantiles(_fact_scan('orders', time_filter), 'orders.total_amount',
+                                       OVERVIEW_QUANTILES)),
+        ]
+    return plan('overview', *outputs)
+
+
+def _grouped_plan(plan, analysis_type: str, data_scope: List[str], time_filter,
+                  dimensions: List[str], metric_names: List[str], limit: int) -> QueryPlan:
+    """Metrics grouped by the dimensions the query names"""
+    dimension_tables = {table_of(dimension) for dimension in dimensions}
+    if (not metric_names and len(dimension_tables) == 1
+            and next(iter(dimension_tables)) in ('customers', 'products')
+            and not {'orders', 'revenue'} & set(data_scope)):
+        # "customers by state": count rows of the dimension table itself
+        table = next(iter(dimension_tables))
+        fact, metrics = table, [Metric(table, 'count')]
+        time_filter = None
+    else:
+        item_grain = 'products' in dimension_tables or 'quantity' in metric_names
+        fact = 'order_items' if item_grain else 'orders'
+        metrics = [METRICS[name][fact] for name in metric_names if fact in METRICS[name]]
+        if not metrics:
+            metrics = [METRICS['revenue'][fact], METRICS['orders'][fact]]
+
+    node = _grouped(fact, time_filter, dimensions, metrics)
+    if analysis_type == 'ranking':
+        node = TopK(node, metrics[0].name, limit)
+    return plan(
+        'grouped', ('groups', _with_labels(node, dimensions)),
+        dimensions=tuple(dimensions), metrics=tuple(metric.name for metric in metrics),
+        chart='pie' if analysis_type == 'distribution' else 'bar',
+    )
+
+
+# ---------------------------------------------------------------------------
+# Optimizer
+
+def _push_filters(node: Node) -> Node:
+    """Move order-date filters into the scan of a partitioned fact table"""
+    if isinstance(node, LEAVES):
+        return node
+    source = _push_filters(node.source)
+    if isinstance(node, Filter) and node.column == PARTITION_COLUMN:
+        scan, joins = source, []
+        while isinstance(scan, Join):
+            joins.append(scan)
+            scan = scan.source
+        if isinstance(scan, Scan) and scan.table in PARTITIONED_TABLES:
+            start, end = node.start, node.end
+            if scan.time_range is not None:
+                start = max(filter(None, (start, scan.time_range[0])), default=None)
+                end = min(filter(None, (end, scan.time_range[1])), default=None)
+            rebuilt: Node = replace(scan, time_range=(start, end))
+            for join in reversed(joins):
+                rebuilt = replace(join, source=rebuilt)
+            return rebuilt
+    return replace(node, source=source)
+
+
+def _required(node: Node) -> FrozenSet[str]:
+    """Columns and metric names the node itself reads from its source"""
+    if isinstance(node, Filter):
+        return frozenset([node.column])
+    if isinstance(node, GroupBy):
+        return frozenset(node.keys)
+    if isinstance(node, Aggregate):
+        columns = {metric.column for metric in node.metrics if metric.column}
+        return frozenset(columns)
+    if isinstance(node, (TopK, Order)):
+        return frozenset([node.by])
+    if isinstance(node, Quantiles):
+        return frozenset([node.column])
+    return frozenset()
+
+
+def _prune(node: Node, needed: FrozenSet[str]) -> Node:
+    """Keep only needed columns in scans and joins; drop joins nobody reads from"""
+    if isinstance(node, Scan):
+        columns = tuple(sorted(column for column in needed if table_of(column) == node.table))
+        return replace(node, columns=columns)
+    if isinstance(node, MaterializedScan):
+        return node
+    if isinstance(node, Join):
+        wanted = {column for column in needed if table_of(column) == node.table}
+        source = _prune(node.source, frozenset(needed - set(node.columns)))
+        columns = tuple(sorted(wanted | set(node.columns)))
+        if not columns:
+            return source
+        return replace(node, source=source, columns=columns)
+    if isinstance(node, (Aggregate, Quantiles)):
+        # Aggregation outputs new columns: only its own inputs are needed below
+        return replace(node, source=_prune(node.source, _required(node)))
+    return replace(node, source=_prune(node.source, needed | _required(node)))
+
+
+def _merge_joins(node: Node) -> Node:
+    """Collapse joins to a table that is already joined further down"""
+    if isinstance(node, LEAVES):
+        return node
+    source = _merge_joins(node.source)
+    if isinstance(node, Join):
+        below = source
+        while isinstance(below, Join) and below.table != node.table:
+            below = below.source
+        if isinstance(below, Join):
+            merged = replace(below, columns=tuple(sorted(set(below.columns) | set(node.columns))))
+            return _replace_descendant(source, below, merged)
+    return replace(node, source=source)
+
+
+def _replace_descendant(node: Node, old: Node, new: Node) -> Node:
+    if node is old:
+        return new
+    return replace(node, source=_replace_descendant(node.source, old, new))
+
+
+def _materialize(node: Node) -> Node:
+    """Read maintained aggregates for unfiltered group-bys they cover"""
+    if isinstance(node, LEAVES):
+        return node
+    if isinstance(node, Aggregate):
+        grouping = node.source
+        keys, grain = (grouping.keys, grouping.grain) if isinstance(grouping, GroupBy) else ((), None)
+        scan = grouping.source if isinstance(grouping, GroupBy) else grouping
+        while isinstance(scan, Join):
+            scan = scan.source
+        if isinstance(scan, Scan) and scan.time_range is None:
+            view = MATERIALIZED_VIEWS.get((scan.table, keys, grain))
+            if view is not None and all((m.func, m.column) in view for m in node.metrics):
+                return MaterializedScan(scan.table, keys, grain, node.metrics)
+    return replace(node, source=_materialize(node.source))
+
+
+def unmaterialize(node: MaterializedScan) -> Node:
+    """The aggregation a MaterializedScan reads, optimized as if it were not maintained"""
+    grouped = _grouped(node.fact, None, list(node.keys), list(node.metrics), node.grain)
+    return _merge_joins(_prune(grouped, frozenset()))
+
+
+def _scan_below(node: Node) -> Node:
+    while isinstance(node, (Join, GroupBy)):
+        node = node.source
+    return node
+
+
+def _approximate(node: Node) -> Node:
+    """Answer from the sample and sketches instead of scanning orders or order items.
+
+    Maintained aggregates are exact and already cheap, so they are kept.
+    Aggregations whose metrics a sample of orders cannot estimate (distinct
+    counts of anything but orders) stay exact.
+    """
+    if isinstance(node, Scan):
+        if node.table in PARTITIONED_TABLES:
+            return SampleScan(node.table, node.columns, node.time_range)
+        return node
+    if isinstance(node, LEAVES):
+        return node
+    if isinstance(node, TopK) and isinstance(node.source, Aggregate) and isinstance(node.source.source, GroupBy):
+        grouping = node.source.source
+        scan = _scan_below(grouping)
+        ranked = {metric.name: metric for metric in node.source.metrics}.get(node.by)
+        if (isinstance(scan, Scan) and grouping.keys == (SKETCHED_KEYS.get(scan.table),)
+                and ranked == METRICS['revenue'][scan.table] and set(node.source.metrics) <= {ranked, ROW_COUNT}):
+            return HeavyHitters(scan.table, grouping.keys[0], ranked, node.k, scan.time_range)
+    if isinstance(node, (Aggregate, Quantiles)):
+        scan = _scan_below(node.source)
+        if isinstance(scan, Scan) and scan.table == 'orders':
+            if isinstance(node, Quantiles) and node.column == 'orders.total_amount':
+                return QuantileSketch(node.column, node.quantiles, scan.time_range)
+            if (isinstance(node, Aggregate) and not isinstance(node.source, GroupBy)
+                    and node.metrics == (Metric(node.metrics[0].name, 'count_distinct', 'orders.customer_id'),)):
+                return DistinctSketch(node.metrics[0], scan.time_range)
+        if isinstance(node, Quantiles) or any(
+                metric.func == 'count_distinct' and metric.column not in SAMPLE_UNIT_COLUMNS
+                for metric in node.metrics):
+            return node
+    return replace(node, source=_approximate(node.source))
+
+
+def optimize_node(node: Node, approximate: bool = False) -> Node:
+    node = _push_filters(node)
+    node = _prune(node, frozenset())
+    node = _merge_joins(node)
+    node = _materialize(node)
+    return _approximate(node) if approximate else node
+
+
+def optimize(plan: QueryPlan) -> QueryPlan:
+    """Physical plan: pushed-down filters, pruned columns, merged joins, maintained aggregates,
+    and for approximate plans samples and sketches"""
+    return replace(plan, outputs=tuple(
+        (name, optimize_node(node, plan.approximate)) for name, node in plan.outputs
+    ))
+
+
+def _shape(node: Node) -> Node:
+    """A node with its scan and join column lists emptied: which rows it produces, not what it reads"""
+    if isinstance(node, (Scan, SampleScan)):
+        return replace(node, columns=())
+    if isinstance(node, LEAVES):
+        return node
+    shaped = replace(node, source=_shape(node.source))
+    return replace(shaped, columns=()) if isinstance(node, Join) else shaped
+
+
+def share_work(nodes: Sequence[Node]) -> Dict[Node, Node]:
+    """Rewrite optimized output nodes of several plans so they share work.
+
+    Scans and joins producing the same rows read the union of the columns
+    any plan needs from them, and aggregates over the same groups compute
+    the union of their metrics, so such subplans become equal and run once
+    under one memo. Metrics with the same name but different definitions
+    keep their aggregates apart. The rewritten nodes' results are a superset
+    of the originals': read only the original output columns from them.
+    """
+    columns: Dict[Node, Dict[str, None]] = {}
+    metrics: Dict[Node, Dict[str, Metric]] = {}
+    conflicting: Set[Node] = set()
+
+    def collect(node: Node):
+        if isinstance(node, (Scan, SampleScan, Join)):
+            columns.setdefault(_shape(node), {}).update(dict.fromkeys(node.columns))
+        if isinstance(node, Aggregate):
+            groups = _shape(node.source)
+            union = metrics.setdefault(groups, {})
+            for metric in node.metrics:
+                if union.setdefault(metric.name, metric) != metric:
+                    conflicting.add(groups)
+        if not isinstance(node, LEAVES):
+            collect(node.source)
+
+    def rewrite(node: Node) -> Node:
+        shared = node if isinstance(node, LEAVES) else replace(node, source=rewrite(node.source))
+        if isinstance(node, (Scan, SampleScan, Join)):
+            shared = replace(shared, columns=tuple(columns[_shape(node)]))
+        elif isinstance(node, Aggregate) and _shape(node.source) not in conflicting:
+            shared = replace(shared, metrics=tuple(metrics[_shape(node.source)].values()))
+        return shared
+
+    for node in nodes:
+        collect(node)
+    return {node: rewrite(node) for node in nodes}
+
+
+def explain(node: Node, indent: int = 0) -> str:
+    """Indented, one operator per line rendering of a plan"""
+    pad = '  ' * indent
+    if isinstance(node, Scan):
+        extra = f' time_range={node.time_range}' if node.time_range else ''
+        return f'{pad}Scan {node.table} {list(node.columns)}{extra}\n'
+    if isinstance(node, MaterializedScan):
+        metrics = [metric.name for metric in node.metrics]
+        return f'{pad}MaterializedScan {node.fact} keys={list(node.keys)} grain={node.grain} {metrics}\n'
+    if isinstance(node, SampleScan):
+        extra = f' time_range={node.time_range}' if node.time_range else ''
+        return f'{pad}SampleScan {node.table} {list(node.columns)}{extra}\n'
+    if isinstance(node, HeavyHitters):
+        return f'{pad}HeavyHitters {node.k} {node.key} by {node.metric.name} time_range={node.time_range}\n'
+    if isinstance(node, DistinctSketch):
+        return f'{pad}DistinctSketch {node.metric.name}={node.metric.column} time_range={node.time_range}\n'
+    if isinstance(node, QuantileSketch):
+        return f'{pad}QuantileSketch {node.column} {list(node.quantiles)} time_range={node.time_range}\n'
+    if isinstance(node, Filter):
+        line = f'Filter {node.column} in [{node.start}, {node.end})'
+    elif isinstance(node, Join):
+        line = f'Join {node.table} {list(node.columns)}'
+    elif isinstance(node, GroupBy):
+        line = f'GroupBy {list(node.keys)}' + (f' grain={node.grain}' if node.grain else '')
+    elif isinstance(node, Aggregate):
+        line = 'Aggregate ' + ', '.join(
+            f'{m.name}={m.func}({m.column or "*"})' for m in node.metrics
+        )
+    elif isinstance(node, TopK):
+        line = f'TopK {node.k} by {node.by}'
+    elif isinstance(node, Quantiles):
+        line = f'Quantiles {node.column} {list(node.quantiles)}'
+    else:
+        line = f'Order by {node.by}' + (' desc' if node.descending else '')
+    return f'{pad}{line}\n' + explain(node.source, indent + 1)
@@ -0,0 +1,122 @@
+"""Opt-in sampling profiler for slow requests.
+
+With ANALYTICS_PROFILE_SLOW_MS set, a background thread samples the stacks
+of threads running instrumented executor work every
+ANALYTICS_PROFILE_INTERVAL_MS. Work that takes at least the threshold has
+its samples written to ANALYTICS_PROFILE_DIR in the collapsed ("folded")
+stack format read by flamegraph.pl, speedscope and inferno: one line per
+distinct stack, frames root first and separated by semicolons, followed by
+the sample count. At most ANALYTICS_PROFILE_LIMIT files are written per
+process.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+_SLOW_MS = os.getenv('ANALYTICS_PROFILE_SLOW_MS')
+PROFILE_DIR = os.getenv('ANALYTICS_PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'profiles'))
+INTERVAL_SECONDS = float(os.getenv('ANALYTICS_PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_LIMIT = int(os.getenv('ANALYTICS_PROFILE_LIMIT', '100'))
+
+
+def slow_threshold_ms() -> Optional[float]:
+    """Duration from which work is profiled, or None when profiling is off"""
+    return float(_SLOW_MS) if _SLOW_MS else None
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Sampler:
+    """Samples the stacks of registered threads from a daemon thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watched: Dict[int, Counter] = {}
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def watch(self, thread_id: int) -> Counter:
+        stacks = Counter()
+        with self._lock:
+            self._watched[thread_id] = stacks
+        return stacks
+
+    def unwatch(self, thread_id: int):
+        with self._lock:
+            self._watched.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(INTERVAL_SECONDS)
+            with self._lock:
+                if not self._watched:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_stack(frame)] += 1
+
+
+_sampler: Optional[_Sampler] = None
+_sampler_pid: Optional[int] = None
+_sampler_lock = threading.Lock()
+_written = itertools.count()
+
+
+def _get_sampler() -> _Sampler:
+    global _sampler, _sampler_pid
+    with _sampler_lock:
+        # Process pool workers start their own sampler thread
+        if _sampler is None or _sampler_pid != os.getpid():
+            _sampler, _sampler_pid = _Sampler(), os.getpid()
+        return _sampler
+
+
+@contextmanager
+def sampling() -> Iterator[Optional[Counter]]:
+    """Sample the current thread while the block runs; yields None when profiling is off"""
+    if slow_threshold_ms() is None:
+        yield None
+        return
+    sampler = _get_sampler()
+    thread_id = threading.get_ident()
+    stacks = sampler.watch(thread_id)
+    try:
+        yield stacks
+    finally:
+        sampler.unwatch(thread_id)
+
+
+def write_profile(stacks: Counter, name: str, elapsed: float) -> Optional[str]:
+    """Write folded stacks to the profile directory; returns the path, or None past the limit"""
+    if not stacks:
+        return None
+    sequence = next(_written)
+    if sequence >= PROFILE_LIMIT:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        PROFILE_DIR,
+        f'{time.strftime("%Y%m%dT%H%M%S")}-{name}-{elapsed * 1000:.0f}ms-{os.getpid()}-{sequence}.folded'
+    )
+    with open(path, 'w') as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write(f'{stack} {samples}\n')
+    return path
@@ -0,0 +1,119 @@
+"""Compact in-memory schema for the lakehouse tables.
+
+Keys are stored as integer surrogates (CUST_000042 is held as 42) and
+low-cardinality text columns as categoricals with a fixed vocabulary, so
+joins and group-bys work on small integers instead of hashing Python
+strings. The formatted string ids only exist at the API boundary: use
+format_id_columns on the way out and parse_ids on the way in.
+"""
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home & Garden', 'Sports', 'Books', 'Beauty', 'Toys']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL', 'One Size']
+GENDERS = ['M', 'F', 'Other']
+CUSTOMER_SEGMENTS = ['Premium', 'Standard', 'Basic']
+ORDER_STATUSES = ['Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled']
+PAYMENT_METHODS = ['Credit Card', 'Debit Card', 'PayPal', 'Bank Transfer']
+SHIPPING_METHODS = ['Standard', 'Express', 'Next Day', 'International']
+CHANNELS = ['Website', 'Mobile App', 'Phone', 'Store']
+CURRENCIES = ['USD']
+SUBCATEGORIES = [f'{category} Subcategory {n}' for category in CATEGORIES for n in range(1, 6)]
+
+# Categories are kept in sorted order so codes order the same way as labels
+CATEGORICAL_DTYPES: Dict[str, pd.CategoricalDtype] = {
+    column: pd.CategoricalDtype(sorted(values))
+    for column, values in {
+        'gender': GENDERS,
+        'customer_segment': CUSTOMER_SEGMENTS,
+        'category': CATEGORIES,
+        'subcategory': SUBCATEGORIES,
+        'size': SIZES,
+        'order_status': ORDER_STATUSES,
+        'payment_method': PAYMENT_METHODS,
+        'shipping_method': SHIPPING_METHODS,
+        'currency': CURRENCIES,
+        'channel': CHANNELS,
+    }.items()
+}
+
+# Surrogate key columns and how they are rendered at the API boundary
+ID_FORMATS: Dict[str, Tuple[str, int]] = {
+    'customer_id': ('CUST_', 6),
+    'product_id': ('PROD_', 6),
+    'order_id': ('ORD_', 8),
+    'order_item_id': ('OI_', 8),
+    'supplier_id': ('SUPP_', 3),
+}
+MAX_ID_DIGITS = 18
+
+
+def format_ids(prefix: str, numbers: np.ndarray, width: int) -> np.ndarray:
+    """Format integer ids as zero-padded strings, e.g. CUST_000042"""
+    numbers = np.asarray(numbers)
+    if not len(numbers):
+        # np.char.zfill cannot size an empty array's output
+        return np.empty(0, dtype=object)
+    digits = np.char.zfill(numbers.astype(str), width)
+    return np.char.add(prefix, digits).astype(object)
+
+
+def format_id(column: str, number: int) -> str:
+    prefix, width = ID_FORMATS[column]
+    return f'{prefix}{int(number):0{width}d}'
+
+
+def parse_ids(column: str, values: Iterable[str]) -> np.ndarray:
+    """Parse formatted ids back to surrogate integers.
+
+    Raises ValueError naming the first value that is not a well-formed id.
+    """
+    prefix, _ = ID_FORMATS[column]
+    values = pd.Series(list(values), dtype=object)
+    digits = values.str.slice(len(prefix))
+    # Up to 18 ASCII digits, so every valid id fits in an int64
+    valid = values.str.startswith(prefix) & digits.str.fullmatch(f'[0-9]{{1,{MAX_ID_DIGITS}}}')
+    if not valid.all():
+        raise ValueError(f"Invalid {column}: {values[~valid].iloc[0]}")
+    return digits.astype(np.int64).to_numpy()
+
+
+def parse_id(column: str, value: str) -> int:
+    return int(parse_ids(column, [value])[0])
+
+
+def categorical_from_codes(column: str, values: list, codes: np.ndarray) -> pd.Categorical:
+    """Build a column's categorical from indices into a vocabulary list"""
+    dtype = CATEGORICAL_DTYPES[column]
+    remap = dtype.categories.get_indexer(values)
+    return pd.Categorical.from_codes(remap[codes], dtype=dtype)
+
+
+def format_id_columns(frame: pd.DataFrame) -> pd.DataFrame:
+    """Copy of frame with surrogate key columns rendered as formatted string ids"""
+    frame = frame.copy()
+    for column, (prefix, width) in ID_FORMATS.items():
+        if column in frame:
+            frame[column] = format_ids(prefix, frame[column].to_numpy(), width)
+    return frame
+
+
+def conform(frame: pd.DataFrame, like: pd.DataFrame) -> pd.DataFrame:
+    """Reorder and cast frame to the columns and dtypes of an existing table.
+
+    Raises ValueError if a categorical column holds a value outside its
+    vocabulary.
+    """
+    frame = frame[list(like.columns)].copy()
+    for column, dtype in like.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            # Checked before casting: pandas is deprecating casts of values outside the categories
+            unknown = frame[column].notna() & ~frame[column].isin(dtype.categories)
+            if unknown.any():
+                raise ValueError(f"Unknown {column}: {frame[column][unknown].iloc[0]}")
+            frame[column] = frame[column].astype(dtype)
+        elif frame[column].dtype != dtype:
+            frame[column] = frame[column].astype(dtype)
+    return frame
@@ -0,0 +1,86 @@
+"""Serve the lakehouse from several uvicorn workers sharing one copy of its tables.
+
+`uvicorn --workers N` imports main.py once per worker, and each import builds
+its own lakehouse. This launcher builds or loads the tables once, publishes
+them as an Arrow snapshot in shared memory (/dev/shm), and starts the
+workers with LAKEHOUSE_SHARED_DIR pointing at it. Every worker memory-maps
+the same read-only pages, so all of them answer from identical data at
+roughly the memory cost of one copy. The published tables are removed when
+the server stops.
+
+    python shared.py --workers 4 --port 8000
+
+Order ingestion is refused in this mode: a batch would only reach the worker
+that received it.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+
+from datagen import DataGenerator
+from snapshot import (DEFAULT_SNAPSHOT_ROOT, TABLES, open_table, read_manifest, snapshot_path,
+                      write_snapshot, write_tables)
+
+SHARED_DIR_ENV = 'LAKEHOUSE_SHARED_DIR'
+DEFAULT_SHM_ROOT = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def source_tables(scale: float, seed: int, snapshot_root: Optional[str]) -> Dict[str, Any]:
+    """The tables as the lakehouse would load them: from the snapshot if configured, else generated"""
+    if snapshot_root:
+        path = snapshot_path(snapshot_root, scale, seed)
+        manifest = read_manifest(path)
+        if manifest is None:
+            manifest = write_snapshot(path, scale=scale, seed=seed)
+        tables = {table: open_table(path, table) for table in TABLES}
+        return {'tables': tables, 'as_of': manifest['as_of']}
+    generator = DataGenerator(scale=scale, seed=seed)
+    tables = {table: pa.Table.from_pandas(frame, preserve_index=False)
+              for table, frame in generator.generate().items()}
+    return {'tables': tables, 'as_of': generator.as_of.isoformat()}
+
+
+def publish(scale: float, seed: int, snapshot_root: Optional[str], shm_root: str = DEFAULT_SHM_ROOT) -> str:
+    """Write the tables to a fresh shared-memory directory and return its path"""
+    source = source_tables(scale, seed, snapshot_root)
+    path = tempfile.mkdtemp(prefix='lakehouse-', dir=shm_root)
+    try:
+        write_tables(path, source['tables'], {'scale': scale, 'seed': seed, 'as_of': source['as_of']})
+    except BaseException:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    return path
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Serve the API from several workers sharing one lakehouse")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--scale', type=float, default=float(os.getenv('LAKEHOUSE_SCALE', '1.0')))
+    parser.add_argument('--seed', type=int, default=int(os.getenv('LAKEHOUSE_SEED', '42')))
+    parser.add_argument('--snapshot-root', default=os.getenv('LAKEHOUSE_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_ROOT),
+                        help="Snapshot to publish from; empty to generate the tables")
+    parser.add_argument('--shm-root', default=DEFAULT_SHM_ROOT, help="Directory on a memory-backed filesystem")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    path = publish(args.scale, args.seed, args.snapshot_root, args.shm_root)
+    manifest = read_manifest(path)
+    print(f"Published {sum(manifest['rows'].values()):,} rows to {path}")
+    # Workers inherit the environment, and so do their process pool executors
+    os.environ[SHARED_DIR_ENV] = path
+    try:
+        uvicorn.run('main:app', host=args.host, port=args.port, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
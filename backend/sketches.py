@@ -0,0 +1,451 @@
+"""Samples and sketches behind approximate analytics queries.
+
+Everything here is kept per calendar month of the order date. It is built
+with one scan on first use and updated with every ingested batch, like the
+maintained aggregates:
+
+* a stratified sample of orders: per month, the orders with the k smallest
+  random priorities (a bottom-k sample, which stays uniform as rows arrive),
+  together with their order items. Sums and counts over any window and
+  grouping are estimated with per-month weights and a 95% confidence bound;
+* Space-Saving summaries of revenue per product and per customer, giving
+  guaranteed lower and upper bounds for the heaviest keys;
+* HyperLogLog registers of the customers who ordered;
+* t-digests of order values, for percentiles.
+
+A time window is answered from the sketches of the months it covers whole.
+The partial months at its edges, at most two, have their rows read exactly.
+Windows whose months the sample covers densely (small tables) are scanned
+exactly rather than estimated.
+"""
+import heapq
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_PER_MONTH = int(os.getenv('ANALYTICS_SAMPLE_PER_MONTH', '2000'))
+SKETCH_CAPACITY = int(os.getenv('ANALYTICS_SKETCH_CAPACITY', '1024'))
+HLL_PRECISION = 12
+TDIGEST_COMPRESSION = 200
+
+# Months sampled more densely than this are scanned exactly instead: the
+# sample would save little work
+SAMPLE_MAX_FRACTION = 0.25
+
+# Two-sided 95% normal quantile, for confidence bounds
+Z_95 = 1.96
+
+
+def hash64(keys: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: well-mixed 64-bit hashes of integer keys"""
+    x = np.asarray(keys).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Bit length of uint64 values; each 32-bit half converts to float exactly"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class HyperLogLog:
+    """Distinct count estimate from 2**precision registers"""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[np.ndarray] = None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add(self, keys: np.ndarray):
+        hashes = hash64(keys)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # Position of the first set bit after the index bits
+        rank = (64 - self.precision) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merged(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return m * float(np.log(m / zeros))
+        return float(raw)
+
+    @property
+    def relative_error(self) -> float:
+        """95% relative error bound of the estimate"""
+        return Z_95 * 1.04 / np.sqrt(len(self.registers))
+
+
+class SpaceSaving:
+    """Weighted Space-Saving summary of the heaviest keys.
+
+    A monitored key holds an overestimate of its weight and the most the
+    estimate can exceed it by; a key that is not monitored weighs at most
+    `floor`. Weights are assumed non-negative.
+    """
+
+    def __init__(self, capacity: int = SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.counters: Dict[int, List[float]] = {}  # key -> [estimate, error]
+        self.floor = 0.0
+        # One (estimate, key) entry per monitored key. Estimates only grow, so
+        # an entry may lag behind its counter; it is refreshed when it surfaces
+        self._heap: List[Tuple[float, int]] = []
+
+    @classmethod
+    def from_totals(cls, keys: np.ndarray, weights: np.ndarray, capacity: int = SKETCH_CAPACITY) -> 'SpaceSaving':
+        """Summary of exact per-key totals: the heaviest keys, with no error"""
+        summary = cls(capacity)
+        order = np.argsort(-weights, kind='stable')
+        kept = order[:capacity]
+        summary.counters = {key: [weight, 0.0] for key, weight in zip(keys[kept].tolist(), weights[kept].tolist())}
+        summary._heap = [(counter[0], key) for key, counter in summary.counters.items()]
+        heapq.heapify(summary._heap)
+        if len(order) > capacity:
+            summary.floor = float(weights[order[capacity]])
+        return summary
+
+    def update(self, keys: np.ndarray, weights: np.ndarray):
+        for key, weight in zip(keys.tolist(), weights.tolist()):
+            counter = self.counters.get(key)
+            if counter is not None:
+                counter[0] += weight
+                continue
+            if len(self.counters) >= self.capacity:
+                # Evict the lightest key; nothing unmonitored can weigh more than it did
+                self.floor = max(self.floor, self._pop_lightest())
+            self.counters[key] = [self.floor + weight, self.floor]
+            heapq.heappush(self._heap, (self.floor + weight, key))
+
+    def _pop_lightest(self) -> float:
+        """Stop monitoring the key with the smallest estimate, returning the estimate"""
+        while True:
+            estimate, key = heapq.heappop(self._heap)
+            current = self.counters[key][0]
+            if current == estimate:
+                del self.counters[key]
+                return estimate
+            heapq.heappush(self._heap, (current, key))
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Monitored keys, their estimates and their errors"""
+        keys = np.fromiter(self.counters, dtype=np.int64, count=len(self.counters))
+        values = np.array(list(self.counters.values()), dtype=np.float64).reshape(-1, 2)
+        return keys, values[:, 0], values[:, 1]
+
+
+def merge_bounds(summaries: Sequence[SpaceSaving], exact_keys: np.ndarray, exact_weights: np.ndarray
+                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keys with lower and upper bounds on their total weight.
+
+    The summaries and the exact per-key weights must cover disjoint rows.
+    Every key monitored anywhere or given exactly is returned.
+    """
+    parts = [summary.arrays() for summary in summaries]
+    keys = np.concatenate([part[0] for part in parts] + [exact_keys])
+    estimates = np.concatenate([part[1] for part in parts] + [np.zeros(len(exact_keys))])
+    errors = np.concatenate([part[2] for part in parts] + [np.zeros(len(exact_keys))])
+    floors = np.concatenate([np.full(len(part[0]), summary.floor) for part, summary in zip(parts, summaries)]
+                            + [np.zeros(len(exact_keys))])
+    exact = np.concatenate([np.zeros(len(keys) - len(exact_keys)), exact_weights])
+
+    unique, inverse = np.unique(keys, return_inverse=True)
+    size = len(unique)
+    lower = np.bincount(inverse, weights=estimates - errors + exact, minlength=size)
+    # A summary that does not monitor a key still allows up to its floor
+    unmonitored = sum(summary.floor for summary in summaries) - np.bincount(inverse, weights=floors, minlength=size)
+    upper = np.bincount(inverse, weights=estimates + exact, minlength=size) + unmonitored
+    return unique, lower, upper
+
+
+class TDigest:
+    """Merging t-digest: centroids that are small near the tails and larger near the median"""
+
+    def __init__(self, compression: int = TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def add(self, values: np.ndarray, weights: Optional[np.ndarray] = None):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, weights]))
+
+    def merged(self, other: 'TDigest') -> 'TDigest':
+        digest = TDigest(self.compression)
+        digest.min, digest.max = min(self.min, other.min), max(self.max, other.max)
+        digest._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+        return digest
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        if not len(weights):
+            self.means, self.weights = means, weights
+            return
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        q = (np.cumsum(weights) - weights) / weights.sum()
+        # Points whose quantile falls in the same unit of the k1 scale share a centroid
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        _, cluster = np.unique(k, return_inverse=True)
+        self.weights = np.bincount(cluster, weights=weights)
+        self.means = np.bincount(cluster, weights=weights * means) / self.weights
+
+    def quantiles(self, qs: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Values at the given quantiles, and half the spread of the centroids around each"""
+        if not len(self.weights):
+            return np.full(len(qs), np.nan), np.full(len(qs), np.nan)
+        total = self.count
+        centers = np.cumsum(self.weights) - self.weights / 2
+        targets = np.asarray(qs, dtype=np.float64) * total
+        values = np.interp(targets, np.r_[0.0, centers, total], np.r_[self.min, self.means, self.max])
+        index = np.searchsorted(centers, targets)
+        below = self.means[np.clip(index - 1, 0, len(self.means) - 1)]
+        above = self.means[np.clip(index, 0, len(self.means) - 1)]
+        return values, (above - below) / 2
+
+
+@dataclass(frozen=True)
+class SampleState:
+    """Sampled orders (sorted by row position) and their months"""
+    months: np.ndarray       # strata, sorted datetime64[M]
+    population: np.ndarray   # orders per stratum
+    sampled: np.ndarray      # sampled orders per stratum
+    positions: np.ndarray    # order rows
+    priorities: np.ndarray
+    stratum: np.ndarray      # stratum of each sampled order
+    dates: np.ndarray        # order date of each sampled order
+
+
+def _empty_state() -> SampleState:
+    return SampleState(
+        months=np.empty(0, dtype='datetime64[M]'), population=np.empty(0, dtype=np.int64),
+        sampled=np.empty(0, dtype=np.int64), positions=np.empty(0, dtype=np.int64),
+        priorities=np.empty(0), stratum=np.empty(0, dtype=np.int64), dates=np.empty(0, dtype='datetime64[ns]'),
+    )
+
+
+def _concatenated_ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)]), vectorized"""
+    lengths = stops - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+
+class StratifiedSample:
+    """Bottom-k sample of the orders of each month, plus the order items of the sampled orders"""
+
+    def __init__(self, per_month: int = SAMPLE_PER_MONTH, seed: int = 0):
+        self.per_month = per_month
+        self.rng = np.random.default_rng(seed)
+        self.state = _empty_state()
+        self._items: Optional[Tuple[SampleState, np.ndarray, np.ndarray]] = None
+
+    def add(self, first_position: int, dates: np.ndarray):
+        """Offer the order rows first_position, first_position + 1, ... dated `dates`"""
+        state = self.state
+        new_months = dates.astype('datetime64[M]')
+        months = np.union1d(state.months, new_months)
+        population = np.bincount(np.searchsorted(months, new_months), minlength=len(months))
+        population[np.searchsorted(months, state.months)] += state.population
+
+        # The sample so far competes with the new rows on priority, per month
+        positions = np.concatenate([state.positions, first_position + np.arange(len(dates))])
+        priorities = np.concatenate([state.priorities, self.rng.random(len(dates))])
+        stratum = np.concatenate([np.searchsorted(months, state.months[state.stratum]),
+                                  np.searchsorted(months, new_months)])
+        all_dates = np.concatenate([state.dates, dates.astype('datetime64[ns]')])
+        order = np.lexsort((priorities, stratum))
+        rank = np.arange(len(order)) - np.searchsorted(stratum[order], stratum[order])
+        keep = np.sort(order[rank < self.per_month])
+
+        self.state = SampleState(
+            months=months, population=population.astype(np.int64),
+            sampled=np.bincount(stratum[keep], minlength=len(months)).astype(np.int64),
+            positions=positions[keep], priorities=priorities[keep], stratum=stratum[keep], dates=all_dates[keep],
+        )
+
+    def items(self, lakehouse) -> Tuple[SampleState, np.ndarray, np.ndarray]:
+        """The sample state, the order item rows of the sampled orders and each one's sampled order"""
+        items = self._items
+        if items is None or items[0] is not self.state:
+            state = self.state
+            order_ids = lakehouse.orders['order_id'].to_numpy()[state.positions]
+            item_order_ids = lakehouse.order_items['order_id'].to_numpy()
+            starts = np.searchsorted(item_order_ids, order_ids, side='left')
+            stops = np.searchsorted(item_order_ids, order_ids, side='right')
+            items = (state, _concatenated_ranges(starts, stops), np.repeat(np.arange(len(starts)), stops - starts))
+            self._items = items
+        return items
+
+
+def _by_month(months: np.ndarray) -> List[Tuple[np.datetime64, np.ndarray]]:
+    """Row indices per distinct month"""
+    unique, inverse = np.unique(months, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+    return [(month, order[bounds[i]:bounds[i + 1]]) for i, month in enumerate(unique)]
+
+
+def month_window(months: Sequence[np.datetime64], start: Optional[str], end: Optional[str]
+                 ) -> Tuple[List[np.datetime64], List[Tuple[str, str]]]:
+    """Months the window [start, end) covers whole, and the date ranges of the partial ones"""
+    lo = np.datetime64(start, 'ns') if start else None
+    hi = np.datetime64(end, 'ns') if end else None
+    whole, partial = [], []
+    for month in months:
+        month_start = month.astype('datetime64[ns]')
+        month_end = (month + 1).astype('datetime64[ns]')
+        if (lo is not None and lo >= month_end) or (hi is not None and hi <= month_start):
+            continue
+        if (lo is None or lo <= month_start) and (hi is None or hi >= month_end):
+            whole.append(month)
+        else:
+            partial.append((str(max(lo, month_start) if lo is not None else month_start),
+                            str(min(hi, month_end) if hi is not None else month_end)))
+    return whole, partial
+
+
+class LakehouseSketches:
+    """Per-month sample and sketches over orders and order items"""
+
+    def __init__(self, per_month: int = SAMPLE_PER_MONTH, capacity: int = SKETCH_CAPACITY, seed: int = 0):
+        self.capacity = capacity
+        self.sample = StratifiedSample(per_month, seed)
+        self.product_revenue: Dict[np.datetime64, SpaceSaving] = {}
+        self.customer_revenue: Dict[np.datetime64, SpaceSaving] = {}
+        self.customers: Dict[np.datetime64, HyperLogLog] = {}
+        self.order_values: Dict[np.datetime64, TDigest] = {}
+
+    @classmethod
+    def build(cls, lakehouse, **options) -> 'LakehouseSketches':
+        """Bootstrap the sample and sketches with one full scan of the lakehouse"""
+        join_index = lakehouse.join_index()
+        sketches = cls(seed=lakehouse.seed, **options)
+        sketches.apply(lakehouse.orders, lakehouse.order_items,
+                       join_index['order_customer'], join_index['item_product'], first_position=0)
+        return sketches
+
+    @property
+    def months(self) -> List[np.datetime64]:
+        return sorted(self.order_values)
+
+    def apply(self, orders: pd.DataFrame, order_items: pd.DataFrame,
+              order_customer: np.ndarray, item_product: np.ndarray, first_position: int):
+        """Fold a batch of orders, stored from row first_position on, and their items into the sketches"""
+        dates = orders['order_date'].to_numpy()
+        months = dates.astype('datetime64[M]')
+        amounts = orders['total_amount'].to_numpy(dtype=np.float64)
+        self.sample.add(first_position, dates)
+
+        # Order items take the month of their order (orders are sorted by id)
+        order_ids = orders['order_id'].to_numpy()
+        item_order_ids = order_items['order_id'].to_numpy()
+        item_order = np.minimum(np.searchsorted(order_ids, item_order_ids), max(len(order_ids) - 1, 0))
+        matched = (order_ids[item_order] == item_order_ids) if len(order_ids) else np.zeros(len(item_order_ids), bool)
+        self._update_heavy(self.product_revenue, months[item_order[matched]], item_product[matched],
+                           order_items['total_price'].to_numpy(dtype=np.float64)[matched])
+        self._update_heavy(self.customer_revenue, months, order_customer, amounts)
+
+        for month, rows in _by_month(months):
+            customers = order_customer[rows]
+            self.customers.setdefault(month, HyperLogLog()).add(customers[customers >= 0])
+            self.order_values.setdefault(month, TDigest()).add(amounts[rows])
+
+    def _update_heavy(self, summaries: Dict[np.datetime64, SpaceSaving], months: np.ndarray,
+                      keys: np.ndarray, weights: np.ndarray):
+        valid = keys >= 0
+        for month, rows in _by_month(months[valid]):
+            unique, inverse = np.unique(keys[valid][rows], return_inverse=True)
+            totals = np.bincount(inverse, weights=weights[valid][rows], minlength=len(unique))
+            if month in summaries:
+                summaries[month].update(unique, totals)
+            else:
+                summaries[month] = SpaceSaving.from_totals(unique, totals, self.capacity)
+
+    def _edge_rows(self, lakehouse, partial: List[Tuple[str, str]]) -> Dict[str, np.ndarray]:
+        """Order and order item rows of the partial months, read exactly"""
+        slices = [lakehouse.time_slice(start, end) for start, end in partial]
+        return {table: np.concatenate([np.empty(0, dtype=np.int64)] + [rows[table] for rows in slices])
+                for table in ('orders', 'order_items')}
+
+    @staticmethod
+    def _note(whole: List, partial: List, sketch: str) -> str:
+        parts = []
+        if whole:
+            parts.append(f"{len(whole)} monthly sketch{'es' if len(whole) != 1 else ''}")
+        if partial:
+            parts.append(f"{len(partial)} partial month{'s' if len(partial) != 1 else ''} read exactly")
+        return f"{sketch} over {' and '.join(parts) or 'no orders'}"
+
+    def heavy_hitters(self, lakehouse, key: str, start: Optional[str], end: Optional[str], k: int
+                      ) -> Dict[str, Any]:
+        """Top k products or customers by revenue within [start, end), with bounds on each revenue"""
+        whole, partial = month_window(self.months, start, end)
+        edges = self._edge_rows(lakehouse, partial)
+        join_index = lakehouse.join_index()
+        if key == 'products.product_id':
+            summaries = [self.product_revenue[month] for month in whole if month in self.product_revenue]
+            exact_keys = join_index['item_product'][edges['order_items']]
+            exact_weights = lakehouse.order_items['total_price'].to_numpy(dtype=np.float64)[edges['order_items']]
+        else:
+            summaries = [self.customer_revenue[month] for month in whole if month in self.customer_revenue]
+            exact_keys = join_index['order_customer'][edges['orders']]
+            exact_weights = lakehouse.orders['total_amount'].to_numpy(dtype=np.float64)[edges['orders']]
+        matched = exact_keys >= 0
+        exact_unique, inverse = np.unique(exact_keys[matched], return_inverse=True)
+        exact_totals = np.bincount(inverse, weights=exact_weights[matched], minlength=len(exact_unique))
+
+        keys, lower, upper = merge_bounds(summaries, exact_unique, exact_totals)
+        estimate = (lower + upper) / 2
+        top = np.argsort(-estimate, kind='stable')[:k]
+        return {
+            'positions': keys[top],
+            'estimate': estimate[top],
+            'error': (upper - lower)[top] / 2,
+            'note': self._note(whole, partial, 'Space-Saving bounds'),
+        }
+
+    def distinct_customers(self, lakehouse, start: Optional[str], end: Optional[str]) -> Dict[str, Any]:
+        """Distinct customers who ordered within [start, end)"""
+        whole, partial = month_window(self.months, start, end)
+        merged = HyperLogLog()
+        for month in whole:
+            merged = merged.merged(self.customers[month])
+        customers = lakehouse.join_index()['order_customer'][self._edge_rows(lakehouse, partial)['orders']]
+        merged.add(customers[customers >= 0])
+        estimate = merged.estimate()
+        return {'estimate': estimate, 'error': estimate * merged.relative_error,
+                'note': self._note(whole, partial, 'HyperLogLog, 95% confidence')}
+
+    def order_value_quantiles(self, lakehouse, qs: Sequence[float], start: Optional[str], end: Optional[str]
+                              ) -> Dict[str, Any]:
+        """Order value percentiles within [start, end)"""
+        whole, partial = month_window(self.months, start, end)
+        merged = TDigest()
+        for month in whole:
+            merged = merged.merged(self.order_values[month])
+        edge_orders = self._edge_rows(lakehouse, partial)['orders']
+        merged.add(lakehouse.orders['total_amount'].to_numpy(dtype=np.float64)[edge_orders])
+        values, errors = merged.quantiles(qs)
+        return {'values': values, 'error': errors, 'note': self._note(whole, partial, 't-digest')}
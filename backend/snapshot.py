@@ -0,0 +1,253 @@
+"""Columnar snapshots of the lakehouse tables.
+
+Tables are written once as uncompressed Arrow IPC files and memory-mapped on
+later starts, so a restart neither regenerates data nor copies it: pages are
+only faulted in for the columns that are actually read.
+
+Build a snapshot from the command line:
+
+    python snapshot.py build --scale 10 --seed 42
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from datagen import DEFAULT_CHUNK_ROWS, DataGenerator
+
+TABLES = ['customers', 'products', 'orders', 'order_items']
+MANIFEST_FILE = 'manifest.json'
+SNAPSHOT_FORMAT_VERSION = 3
+
+DEFAULT_SNAPSHOT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lakehouse')
+
+
+def snapshot_path(root: str, scale: float, seed: int) -> str:
+    """Directory holding the snapshot for a given scale factor and seed"""
+    return os.path.join(root, f'sf{scale:g}_seed{seed}')
+
+
+def table_file(path: str, table: str) -> str:
+    return os.path.join(path, f'{table}.arrow')
+
+
+def _to_arrow(df: pd.DataFrame, schema: Optional[pa.Schema] = None) -> pa.Table:
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+class _TableWriter:
+    """Appends DataFrame chunks to one Arrow IPC file as record batches"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.schema: Optional[pa.Schema] = None
+        self.rows = 0
+        self._sink = None
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        table = _to_arrow(df, self.schema)
+        if self._writer is None:
+            self.schema = table.schema
+            self._sink = pa.OSFile(self.path, 'wb')
+            self._writer = ipc.new_file(self._sink, self.schema)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+
+
+def _publish(staging: str, path: str) -> Dict[str, Any]:
+    """Move a complete snapshot directory into place at path and return the manifest there.
+
+    Other processes may be memory-mapping the files of a snapshot already at
+    path, so those files are never truncated or rewritten. An incomplete or
+    outdated snapshot is renamed aside and then deleted; open mappings keep
+    their unlinked files. If another process published a complete snapshot
+    first, that one is kept and staging is discarded.
+    """
+    parent, name = os.path.split(os.path.abspath(path))
+    while True:
+        try:
+            os.replace(staging, path)
+            break
+        except OSError:
+            # path exists and is not empty
+            manifest = read_manifest(path)
+            if manifest is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+                return manifest
+            aside = tempfile.mkdtemp(prefix=f'.{name}.old-', dir=parent)
+            try:
+                os.replace(path, aside)
+            except FileNotFoundError:
+                # Another process moved it first
+                pass
+            shutil.rmtree(aside, ignore_errors=True)
+    return read_manifest(path)
+
+
+def write_snapshot(path: str, scale: float = 1.0, seed: int = 42,
+                   chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict[str, Any]:
+    """Generate every table at the given scale and write it to path.
+
+    Orders and order items are streamed chunk by chunk, so memory stays flat
+    regardless of scale. The tables and the manifest are written to a
+    temporary sibling directory, which is renamed to path once complete.
+    Several processes can therefore build the same snapshot at once, and
+    none of them ever sees a half-written one.
+    """
+    parent, name = os.path.split(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f'.{name}.tmp-', dir=parent)
+    try:
+        generator = DataGenerator(scale=scale, seed=seed)
+        writers = {table: _TableWriter(table_file(staging, table)) for table in TABLES}
+        try:
+            writers['customers'].write(generator.customers())
+            writers['products'].write(generator.products())
+            for orders, order_items in generator.iter_order_chunks(chunk_rows):
+                writers['orders'].write(orders)
+                writers['order_items'].write(order_items)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        manifest = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'scale': scale,
+            'seed': seed,
+            'as_of': generator.as_of.isoformat(),
+            'created_at': datetime.now().isoformat(),
+            'rows': {table: writer.rows for table, writer in writers.items()},
+        }
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return _publish(staging, path)
+
+
+def write_tables(path: str, tables: Dict[str, pa.Table], manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Write whole tables as a snapshot, each as a single record batch.
+
+    A table read back from one batch maps every column onto a single
+    buffer, so loading it copies nothing. manifest supplies scale, seed and
+    as_of.
+    """
+    os.makedirs(path, exist_ok=True)
+    for table, arrow_table in tables.items():
+        arrow_table = arrow_table.combine_chunks()
+        with pa.OSFile(table_file(path, table), 'wb') as sink, \
+                ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+    manifest = {
+        **manifest,
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'rows': {table: arrow_table.num_rows for table, arrow_table in tables.items()},
+    }
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Return the snapshot manifest, or None if the snapshot is missing or incomplete"""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def open_table(path: str, table: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """Memory-map one snapshot table, optionally projecting a subset of columns"""
+    source = pa.memory_map(table_file(path, table), 'r')
+    arrow_table = ipc.open_file(source).read_all()
+    if columns is not None:
+        arrow_table = arrow_table.select(columns)
+    return arrow_table
+
+
+def _categorical_views(arrow_table: pa.Table, frame: pd.DataFrame) -> pd.DataFrame:
+    """Point categorical columns at the mapped dictionary indices.
+
+    to_pandas copies dictionary indices into new code arrays even when it can
+    leave numeric and string columns on the mapped buffers. Single-chunk
+    columns are rebuilt from views of the indices instead.
+    """
+    for name in arrow_table.column_names:
+        column = arrow_table.column(name)
+        if pa.types.is_dictionary(column.type) and column.num_chunks == 1 and column.null_count == 0:
+            codes = column.chunk(0).indices.to_numpy(zero_copy_only=True)
+            frame[name] = pd.Series(
+                pd.Categorical.from_codes(codes, dtype=frame[name].dtype, validate=False), copy=False
+            )
+    return frame
+
+
+def to_frame(arrow_table: pa.Table) -> pd.DataFrame:
+    """A mapped table, or a slice of one, as a DataFrame sharing its buffers where it can"""
+    return _categorical_views(arrow_table, arrow_table.to_pandas(split_blocks=True))
+
+
+def load_table(path: str, table: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load one snapshot table as a DataFrame backed by the memory-mapped file"""
+    return to_frame(open_table(path, table, columns))
+
+
+def load_snapshot(path: str) -> Dict[str, pd.DataFrame]:
+    """Load every table of a snapshot"""
+    return {table: load_table(path, table) for table in TABLES}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or inspect lakehouse snapshots")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Generate tables and write a snapshot")
+    build.add_argument('--scale', type=float, default=1.0, help="Scale factor (1.0 = 5,000 orders)")
+    build.add_argument('--seed', type=int, default=42)
+    build.add_argument('--root', default=os.getenv('LAKEHOUSE_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_ROOT))
+    build.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+
+    info = subparsers.add_parser('info', help="Print the manifest of an existing snapshot")
+    info.add_argument('--scale', type=float, default=1.0)
+    info.add_argument('--seed', type=int, default=42)
+    info.add_argument('--root', default=os.getenv('LAKEHOUSE_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_ROOT))
+
+    args = parser.parse_args(argv)
+    path = snapshot_path(args.root, args.scale, args.seed)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        manifest = write_snapshot(path, args.scale, args.seed, args.chunk_rows)
+        elapsed = time.perf_counter() - start
+        print(f"Wrote snapshot to {path} in {elapsed:.2f}s")
+        for table, rows in manifest['rows'].items():
+            print(f"  {table}: {rows:,} rows")
+    else:
+        manifest = read_manifest(path)
+        if manifest is None:
+            raise SystemExit(f"No complete snapshot at {path}")
+        print(json.dumps(manifest, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Shared fixtures.
+
+The app reads its configuration on import, so the environment is set here,
+before any test imports main: small tables, generated in memory, loaded on
+first use rather than by a warm-up thread.
+"""
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault('LAKEHOUSE_SNAPSHOT_DIR', '')
+os.environ.setdefault('LAKEHOUSE_WARM_UP', '0')
+os.environ.setdefault('LAKEHOUSE_SCALE', '0.2')
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from cache import ResultCache  # noqa: E402
+from executor import BoundedExecutor  # noqa: E402
+
+TEST_SCALE = 0.2
+TEST_SEED = 7
+
+
+def make_lakehouse(**kwargs) -> main.DataLakehouse:
+    return main.DataLakehouse(**{'scale': TEST_SCALE, 'seed': TEST_SEED, 'snapshot_root': None, **kwargs})
+
+
+def ingest(lakehouse: main.DataLakehouse, customers, products, amounts, order_date=pd.Timestamp('2024-01-15')):
+    """Ingest one order per customer, each with one item of the matching product and amount"""
+    orders = pd.DataFrame({'customer_id': customers, 'order_date': order_date,
+                           'order_status': 'Pending', 'payment_method': 'PayPal', 'shipping_method': 'Standard',
+                           'shipping_cost': 0.0, 'tax_amount': 0.0, 'discount_amount': 0.0,
+                           'total_amount': amounts, 'shipping_address': '', 'billing_address': '',
+                           'currency': 'USD', 'channel': 'Website'})
+    order_items = pd.DataFrame({'order_ref': np.arange(len(products)), 'product_id': products, 'quantity': 1,
+                                'unit_price': amounts, 'total_price': amounts, 'discount_percentage': 0.0})
+    lakehouse.ingest_orders(orders, order_items)
+
+
+@pytest.fixture(scope='session')
+def lakehouse() -> main.DataLakehouse:
+    """A small lakehouse shared by the tests that only read it"""
+    shared = make_lakehouse()
+    shared.warm_up()
+    return shared
+
+
+@pytest.fixture
+def fresh_lakehouse() -> main.DataLakehouse:
+    """A small lakehouse of the test's own, for tests that ingest into it"""
+    return make_lakehouse()
+
+
+def serve(monkeypatch, lakehouse: main.DataLakehouse) -> TestClient:
+    """A client for the app serving lakehouse, with an empty cache and its own executor"""
+    monkeypatch.setattr(main, 'lakehouse', lakehouse)
+    monkeypatch.setattr(main.llm_analytics, 'lakehouse', lakehouse)
+    monkeypatch.setattr(main.llm_analytics, 'cache', ResultCache())
+    # Leaving the client shuts the executor down
+    monkeypatch.setattr(main, 'executor', BoundedExecutor())
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def client(monkeypatch, lakehouse):
+    with serve(monkeypatch, lakehouse) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def ingest_client(monkeypatch, fresh_lakehouse):
+    with serve(monkeypatch, fresh_lakehouse) as test_client:
+        yield test_client
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+from aggregates import LakehouseAggregates
+from conftest import ingest
+from engine import execute
+from plan import optimize
+
+
+def _ranked(view, metric, k):
+    """The view's k largest groups by metric, ranked the way the engine ranks a full view"""
+    positions = next(iter(view['positions'].values()))
+    scores = view['metrics'][metric]
+    order = np.argsort(-scores, kind='stable')[:k]
+    return positions[order], scores[order]
+
+
+def test_maintained_top_k_matches_a_full_ranking_afteringest(fresh_lakehouse):
+    aggregates = fresh_lakehouse.aggregates
+    # Lift low-ranked products and customers into the top
+    ingest(fresh_lakehouse, customers=[5, 6, 7], products=[3, 4, 5], amounts=[50_000.0, 20_000.0, 20_000.0])
+    for keys, fact, metric in ((('products.product_id',), 'order_items', ('sum', 'order_items.total_price')),
+                               (('customers.customer_id',), 'orders', ('sum', 'orders.total_amount'))):
+        top = aggregates.top(fact, keys, metric, 10)
+        positions, scores = _ranked(aggregates.view(fact, keys, None), metric, 10)
+        np.testing.assert_array_equal(next(iter(top['positions'].values())), positions)
+        np.testing.assert_array_equal(top['metrics'][metric], scores)
+
+
+def test_rankings_longer_than_the_top_k_fall_back_to_the_view(fresh_lakehouse):
+    aggregates = LakehouseAggregates.build(fresh_lakehouse, top_k=3)
+    metric = ('sum', 'order_items.total_price')
+    assert aggregates.top('order_items', ('products.product_id',), metric, 3) is not None
+    assert aggregates.top('order_items', ('products.product_id',), metric, 4) is None
+    assert aggregates.top('order_items', ('products.product_id',), ('count', None), 3) is None
+
+
+def test_ranked_queries_read_the_maintained_top_k(lakehouse):
+    plan = optimize(main.llm_analytics.parse_natural_language_query('top 5 customers by revenue')['plan'])
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(LakehouseAggregates, 'top', lambda *args: None)
+        ranked_view = execute(plan, lakehouse)['top']
+    with pytest.MonkeyPatch.context() as patch:
+        # Reading the whole view is the work the maintained top-k saves
+        patch.setattr(LakehouseAggregates, 'view', _fail)
+        maintained = execute(plan, lakehouse)['top']
+    pd.testing.assert_frame_equal(maintained, ranked_view)
+    assert len(maintained) == 5
+
+
+def _fail(*args):
+    raise AssertionError("the whole view was read")
@@ -0,0 +1,61 @@
+import pytest
+
+import main
+from plan import Aggregate, Scan, build_plan, optimize, share_work
+
+SHARED_GROUPS = ['revenue by channel', 'number of orders by channel', 'average order value by channel']
+
+
+def _batch(client, queries, **body) -> dict:
+    response = client.post('/analytics/query/batch', json={'queries': queries, **body})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize('queries', [
+    SHARED_GROUPS,
+    ['revenue by channel in the last 90 days', 'number of orders by channel in the last 90 days'],
+    ['top 5 products by revenue', 'revenue by product category', 'units sold by product category'],
+    ['business overview', 'monthly revenue trend', 'revenue by channel', 'business overview'],
+])
+def test_batch_answers_like_each_query_alone(client, queries):
+    results = _batch(client, queries)['results']
+    # Cleared so the single queries are computed rather than read back from the batch
+    main.llm_analytics.cache.clear()
+    assert results == [client.post('/analytics/query', json={'query': query}).json() for query in queries]
+
+
+def test_shared_groupings_run_once(client):
+    stats = _batch(client, SHARED_GROUPS)['subplans']
+    # Three plans of three operators each, over one grouping and its aggregate
+    assert stats == {'subplans': 9, 'executed': 2}
+
+
+def test_cached_queries_run_nothing(client):
+    _batch(client, SHARED_GROUPS)
+    assert _batch(client, SHARED_GROUPS)['subplans'] == {'subplans': 0, 'executed': 0}
+    assert _batch(client, SHARED_GROUPS + ['revenue by payment method'])['subplans']['subplans'] > 0
+
+
+def test_shared_nodes_read_the_union_of_columns_and_metrics():
+    parse = main.llm_analytics.parse_natural_language_query
+    queries = ('revenue by channel in the last 7 days', 'number of orders by channel in the last 7 days')
+    nodes = [node for query in queries for _, node in optimize(build_plan(parse(query))).outputs]
+    shared = share_work(nodes)
+    aggregates = [_first(shared[node], Aggregate) for node in nodes]
+    assert aggregates[0] == aggregates[1]
+    assert {metric.name for metric in aggregates[0].metrics} >= {'revenue', 'orders'}
+    scans = [_first(shared[node], Scan) for node in nodes]
+    assert scans[0] == scans[1]
+    assert set(scans[0].columns) == set(_first(nodes[0], Scan).columns) | set(_first(nodes[1], Scan).columns)
+
+
+def _first(node, kind):
+    while not isinstance(node, kind):
+        node = node.source
+    return node
+
+
+@pytest.mark.parametrize('queries', [[], ['revenue by channel'] * 101])
+def test_batch_size_is_validated(client, queries):
+    assert client.post('/analytics/query/batch', json={'queries': queries}).status_code == 422
@@ -0,0 +1,77 @@
+"""The benchmark suite runs end to end and flags regressions against a baseline."""
+import json
+import subprocess
+import sys
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+sys.path.insert(0, str(BACKEND_DIR / 'benchmarks'))
+
+from bench_suite import LOAD_SCENARIOS, compare  # noqa: E402
+
+
+def _run_suite(tmp_path, *args):
+    command = [sys.executable, 'benchmarks/bench_suite.py', '--scales', '0.1', '--repeat', '2', '--requests', '8',
+               '--concurrency', '2', '--skip-construction', '--snapshot-root', str(tmp_path / 'snapshots'), *args]
+    return subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True, timeout=300)
+
+
+def _results(timings):
+    return {'results': {'1': {'analyses': {name: {'p50_ms': value, 'max_ms': value} for name, value in timings.items()},
+                              'parsing': {'queries_per_second': 1000.0}}}}
+
+
+def _faster(tree):
+    """Results with latencies cut and throughputs raised a hundredfold"""
+    faster = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            faster[key] = _faster(value)
+        elif isinstance(value, float) and key.endswith(('_ms', '_us')):
+            faster[key] = value / 100
+        elif isinstance(value, float) and key.endswith('per_second'):
+            faster[key] = value * 100
+        else:
+            faster[key] = value
+    return faster
+
+
+def test_suite_writes_results_and_flags_regressions(tmp_path):
+    output = tmp_path / 'bench.json'
+    result = _run_suite(tmp_path, '--output', str(output))
+    assert result.returncode == 0, result.stderr
+    results = json.loads(output.read_text())
+    scale = results['results']['0.1']
+    assert {'analyses', 'approximate', 'parsing', 'serialization', 'filtered_pages', 'load'} <= scale.keys()
+    assert scale['load'].keys() == LOAD_SCENARIOS.keys()
+    assert all(load['errors'] == 0 for load in scale['load'].values())
+
+    # Against a baseline a hundred times faster, every timing regressed
+    baseline = {**results, 'results': _faster(results['results'])}
+    baseline_file = tmp_path / 'baseline.json'
+    baseline_file.write_text(json.dumps(baseline))
+    result = _run_suite(tmp_path, '--baseline', str(baseline_file))
+    assert result.returncode == 1
+    assert 'REGRESSION' in result.stdout
+
+
+def test_only_slowdowns_beyond_tolerance_and_noise_regress():
+    baseline = _results({'fast': 1.0, 'slow': 10.0, 'tiny': 0.01})
+    current = _results({'fast': 1.1, 'slow': 15.0, 'tiny': 0.03})
+    rows = {row['metric']: row for row in compare(current, baseline, tolerance=0.2, min_delta_ms=0.05)}
+    assert not rows['1.analyses.fast.p50_ms']['regression']
+    assert rows['1.analyses.slow.p50_ms']['regression']
+    assert rows['1.analyses.slow.p50_ms']['change'] == pytest.approx(0.5)
+    # Tripled, but by less than min_delta_ms
+    assert not rows['1.analyses.tiny.p50_ms']['regression']
+    # Single-sample extremes are not compared
+    assert '1.analyses.slow.max_ms' not in rows
+
+
+def test_throughput_drops_regress():
+    baseline, current = _results({}), _results({})
+    current['results']['1']['parsing']['queries_per_second'] = 700.0
+    [row] = compare(current, baseline, tolerance=0.2, min_delta_ms=0.05)
+    assert row['regression'] and row['metric'] == '1.parsing.queries_per_second'
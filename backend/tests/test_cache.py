@@ -0,0 +1,86 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import cache
+from cache import ResultCache, query_cache_key
+from conftest import ingest
+
+
+def test_least_recently_used_entry_is_evicted():
+    results = ResultCache(max_entries=2)
+    results.get_or_compute('a', lambda: 1)
+    results.get_or_compute('b', lambda: 2)
+    results.get_or_compute('a', lambda: 'recomputed')
+    results.get_or_compute('c', lambda: 3)
+    assert results.get_or_compute('a', lambda: 'recomputed') == 1
+    assert results.get_or_compute('b', lambda: 'recomputed') == 'recomputed'
+    assert results.stats()['evictions'] == 2
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: clock[0])
+    results = ResultCache(ttl_seconds=10)
+    results.get_or_compute('a', lambda: 1)
+    clock[0] += 9.9
+    assert results.get_or_compute('a', lambda: 2) == 1
+    clock[0] += 0.1
+    assert results.get_or_compute('a', lambda: 2) == 2
+    assert results.stats()['expirations'] == 1
+
+
+def test_concurrent_misses_compute_once():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    results = ResultCache()
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(results.get_or_compute, 'key', compute)
+        started.wait(5)
+        followers = [pool.submit(results.get_or_compute, 'key', compute) for _ in range(3)]
+        # Let the followers reach the in-flight computation before it finishes
+        while results.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        assert [future.result() for future in (leader, *followers)] == ['value'] * 4
+    assert len(calls) == 1
+    assert results.stats()['misses'] == 1
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    results = ResultCache()
+    with pytest.raises(ZeroDivisionError):
+        results.get_or_compute('key', lambda: 1 / 0)
+    assert results.get_or_compute('key', lambda: 'ok') == 'ok'
+
+
+def test_keys_ignore_phrasing_but_not_the_data_version():
+    parsed = {'analysis_type': 'ranking', 'data_scope': ['products', 'revenue'], 'limit': 5,
+              'original_query': 'top 5 products', 'interpretation': 'Top products'}
+    rephrased = {**parsed, 'data_scope': ['revenue', 'products'], 'original_query': 'best 5 products'}
+    assert query_cache_key(parsed, 3) == query_cache_key(rephrased, 3)
+    assert query_cache_key(parsed, 3) != query_cache_key(parsed, 4)
+    assert query_cache_key(parsed, 3) != query_cache_key({**parsed, 'limit': 10}, 3)
+
+
+def test_ingesting_orders_invalidates_cached_answers(ingest_client, fresh_lakehouse):
+    def revenue():
+        return ingest_client.post('/analytics/query', json={'query': 'total revenue by channel'}).json()
+
+    before = revenue()
+    assert revenue() == before
+    assert ingest_client.get('/analytics/cache').json()['hits'] == 1
+    ingest(fresh_lakehouse, customers=[1], products=[1], amounts=[1000.0])
+    after = revenue()
+    stats = ingest_client.get('/analytics/cache').json()
+    assert (stats['misses'], stats['data_version']) == (2, fresh_lakehouse.data_version)
+    assert sum(after['data']['values']) == pytest.approx(sum(before['data']['values']) + 1000.0)
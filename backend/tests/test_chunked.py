@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from chunked import ChunkedFacts
+from conftest import make_lakehouse, serve
+from metrics import instrumented
+from plan import Aggregate, GroupBy, Metric, Scan
+
+QUERIES = [
+    'revenue by channel', 'number of orders by order status', 'average order value by payment method',
+    'revenue by customer segment', 'top 5 products by revenue', 'top 5 customers by revenue',
+    'monthly revenue trend', 'weekly revenue trend in the last 3 months', 'revenue by channel in the last 90 days',
+    'number of customers by channel', 'units sold by product category', 'business overview',
+]
+
+
+@pytest.fixture(scope='module')
+def snapshot_root(tmp_path_factory) -> str:
+    return str(tmp_path_factory.mktemp('snapshots'))
+
+
+@pytest.fixture(scope='module')
+def loaded(snapshot_root):
+    """The snapshot's tables held in memory, to compare streamed answers with"""
+    lakehouse = make_lakehouse(snapshot_root=snapshot_root)
+    lakehouse.warm_up()
+    return lakehouse
+
+
+@pytest.fixture
+def streamed(monkeypatch, snapshot_root):
+    # Small chunks and a small spill threshold, so queries read many chunks and spill their groups
+    monkeypatch.setenv('ANALYTICS_CHUNK_ROWS', '100')
+    monkeypatch.setenv('ANALYTICS_SPILL_ROWS', '20')
+    lakehouse = make_lakehouse(snapshot_root=snapshot_root, execution='chunked')
+    yield lakehouse
+    lakehouse.close()
+
+
+def _assert_close(got, expected):
+    if isinstance(expected, dict):
+        assert got.keys() == expected.keys()
+        for key in expected:
+            _assert_close(got[key], expected[key])
+    elif isinstance(expected, list) and expected and isinstance(expected[0], str):
+        assert got == expected
+    else:
+        assert got == pytest.approx(expected)
+
+
+def test_chunked_execution_requires_a_snapshot():
+    with pytest.raises(RuntimeError, match='snapshot'):
+        make_lakehouse(execution='chunked')
+
+
+def test_streamed_answers_match_loaded_tables(monkeypatch, loaded, streamed):
+    with serve(monkeypatch, loaded) as client:
+        expected = [client.post('/analytics/query', json={'query': query}).json() for query in QUERIES]
+    with serve(monkeypatch, streamed) as client:
+        for query, answer in zip(QUERIES, expected):
+            _assert_close(client.post('/analytics/query', json={'query': query}).json()['data'], answer['data'])
+    # The fact tables were streamed, never loaded
+    states = streamed.table_states()
+    assert states['orders']['state'] == states['order_items']['state'] == 'streamed'
+    assert states['orders']['chunks'] == 10
+
+
+def _revenue_by_customer() -> Aggregate:
+    return Aggregate(GroupBy(Scan('orders', ('orders.customer_id', 'orders.total_amount')), ('orders.customer_id',)),
+                     (Metric('revenue', 'sum', 'orders.total_amount'), Metric('orders', 'count'),
+                      Metric('average', 'mean', 'orders.total_amount')))
+
+
+def _metrics(relation) -> pd.DataFrame:
+    return pd.DataFrame({name: relation.columns[name] for name in ('revenue', 'orders', 'average')})
+
+
+def test_spilled_groups_merge_like_in_memory_ones(loaded):
+    node = _revenue_by_customer()
+    in_memory = ChunkedFacts(loaded.snapshot_path, chunk_rows=100)
+    spilling = ChunkedFacts(loaded.snapshot_path, chunk_rows=100, spill_rows=20)
+    expected, timer = instrumented(in_memory.aggregate, node, loaded)
+    assert 'rows_spilled' not in timer.counters
+    got, timer = instrumented(spilling.aggregate, node, loaded)
+    assert timer.counters['rows_spilled'] > 0
+    pd.testing.assert_frame_equal(_metrics(got), _metrics(expected))
+
+    totals = loaded.orders.groupby('customer_id', observed=True)['total_amount'].agg(['sum', 'count'])
+    np.testing.assert_allclose(np.sort(expected.columns['revenue']), np.sort(totals['sum'].to_numpy()))
+    assert expected.columns['orders'].sum() == len(loaded.orders)
+
+
+def test_worker_processes_give_the_same_result(loaded):
+    node = _revenue_by_customer()
+    serial = ChunkedFacts(loaded.snapshot_path, chunk_rows=100).aggregate(node, loaded)
+    pooled = ChunkedFacts(loaded.snapshot_path, chunk_rows=100, workers=2)
+    try:
+        parallel = pooled.aggregate(node, loaded)
+    finally:
+        pooled.close()
+    pd.testing.assert_frame_equal(_metrics(parallel), _metrics(serial))
+
+
+def test_windows_skip_chunks_they_miss(loaded):
+    chunks = ChunkedFacts(loaded.snapshot_path, chunk_rows=100)
+    everything = chunks.index.overlapping(None)
+    assert len(everything) == 10
+    latest = pd.Timestamp(chunks.index.max_date.max())
+    recent = chunks.index.overlapping(((latest - pd.Timedelta(days=7)).isoformat(), None))
+    assert 0 < len(recent) < len(everything)
+
+
+def test_chunked_lakehouses_refuse_ingestion(monkeypatch, streamed):
+    order = {'customer_id': 'CUST_000001',
+             'items': [{'product_id': 'PROD_000001', 'quantity': 1, 'unit_price': 1.0}]}
+    with serve(monkeypatch, streamed) as client:
+        assert client.post('/data/orders/batch', json={'orders': [order]}).status_code == 409
+
+
+def test_invalid_chunk_settings_are_rejected(loaded):
+    with pytest.raises(ValueError):
+        ChunkedFacts(loaded.snapshot_path, chunk_rows=0)
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from datagen import DataGenerator
+
+AS_OF = datetime(2024, 6, 1)
+
+
+def _generator(**kwargs) -> DataGenerator:
+    return DataGenerator(**{'scale': 0.2, 'seed': 11, 'as_of': AS_OF, 'pool_size': 50, **kwargs})
+
+
+def test_same_seed_same_tables():
+    first, second = _generator().generate(), _generator().generate()
+    for table in first:
+        pd.testing.assert_frame_equal(first[table], second[table])
+    other = _generator(seed=12).generate()
+    assert not first['orders']['total_amount'].equals(other['orders']['total_amount'])
+
+
+def test_scale_sets_row_counts():
+    generator = _generator(scale=0.5)
+    tables = generator.generate()
+    assert (len(tables['customers']), len(tables['products']), len(tables['orders'])) == (500, 250, 2500)
+    # One to five items per order
+    items_per_order = tables['order_items'].groupby('order_id').size()
+    assert len(items_per_order) == 2500 and items_per_order.between(1, 5).all()
+    with pytest.raises(ValueError):
+        DataGenerator(scale=0)
+
+
+def test_chunked_generation_keeps_ids_and_dates_in_order():
+    orders, order_items = _generator().order_tables(chunk_rows=300)
+    np.testing.assert_array_equal(orders['order_id'], np.arange(1, len(orders) + 1))
+    np.testing.assert_array_equal(order_items['order_item_id'], np.arange(1, len(order_items) + 1))
+    assert order_items['order_id'].isin(orders['order_id']).all()
+    assert orders['order_date'].is_monotonic_increasing
+    assert orders['order_date'].min() >= AS_OF - timedelta(days=365)
+    assert orders['order_date'].max() <= AS_OF
+
+
+def test_keys_reference_the_dimensions():
+    tables = _generator().generate()
+    assert tables['orders']['customer_id'].between(1, len(tables['customers'])).all()
+    assert tables['order_items']['product_id'].between(1, len(tables['products'])).all()
+    products = tables['products'].set_index('product_id')
+    items = tables['order_items']
+    # Line prices stay within 20% of the list price
+    ratio = items['unit_price'].to_numpy() / products.loc[items['product_id'], 'price'].to_numpy()
+    assert ((ratio > 0.79) & (ratio < 1.21)).all()
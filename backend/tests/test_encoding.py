@@ -0,0 +1,106 @@
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pytest
+
+from encoding import (ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, arrow_bytes, frame_arrow_bytes, json_bytes, negotiate,
+                      records_json)
+
+
+def _streams(content: bytes) -> list:
+    """Every Arrow IPC stream in a response, in order"""
+    source = pa.BufferReader(content)
+    tables = []
+    while source.tell() < source.size():
+        tables.append(ipc.open_stream(source).read_all())
+    return tables
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'id': [1, 2, 3],
+        'price': [1.5, np.nan, 1e-7],
+        'in_stock': [True, False, True],
+        'name': ['plain', 'quote " and, comma', 'line\nbreak \\ \x01 é'],
+        'segment': pd.Categorical(['b', None, 'a'], categories=['a', 'b']),
+        'registered': pd.to_datetime(['2024-01-01 10:00', '2024-02-29', '2024-03-01 00:00:00.123456'],
+                                     format='ISO8601'),
+        'shipped': pd.to_datetime(['2024-01-02', None, '2024-03-02']),
+    })
+
+
+def _json_value(value):
+    if pd.isna(value):
+        return None
+    return value.to_pydatetime() if isinstance(value, pd.Timestamp) else value
+
+
+def test_records_match_row_dicts():
+    frame = _frame()
+    expected = [{name: _json_value(value) for name, value in row.items()}
+                for row in frame.astype(object).to_dict('records')]
+    assert records_json(frame) == orjson.dumps(expected)
+
+
+@pytest.mark.parametrize('frame', [pd.DataFrame({'id': []}), pd.DataFrame(index=range(2))])
+def test_records_of_empty_frames(frame):
+    assert orjson.loads(records_json(frame)) == [{} for _ in range(len(frame))]
+
+
+def test_numpy_arrays_encode_like_lists():
+    values = np.array([0.1, np.nan, np.inf, 3.0])
+    assert orjson.loads(json_bytes({'values': values, 'ids': np.arange(3, dtype=np.int32)})) == {
+        'values': [0.1, None, None, 3.0], 'ids': [0, 1, 2]}
+
+
+def test_arrow_streams_round_trip():
+    frame = _frame().drop(columns='segment')
+    table = _streams(frame_arrow_bytes(frame, {'total': 3, 'note': 'x'}))[0]
+    pd.testing.assert_frame_equal(table.to_pandas(), frame, check_dtype=False)
+    assert table.schema.metadata[b'total'] == b'3' and table.schema.metadata[b'note'] == b'x'
+    table = _streams(arrow_bytes({'labels': ['a', 'b'], 'values': np.array([1.0, 2.0])}))[0]
+    assert table.to_pydict() == {'labels': ['a', 'b'], 'values': [1.0, 2.0]}
+
+
+def test_negotiation_prefers_quality_then_offer_order():
+    offered = ('application/json', COLUMNAR_MEDIA_TYPE, ARROW_MEDIA_TYPE)
+    assert negotiate(None, offered) == 'application/json'
+    assert negotiate(f'{ARROW_MEDIA_TYPE}, application/json;q=0.5', offered) == ARROW_MEDIA_TYPE
+    assert negotiate('application/*;q=0.2, */*;q=0.1', offered) == 'application/json'
+    assert negotiate('text/csv', offered) is None
+
+
+def test_pages_encode_the_same_rows_in_every_format(client):
+    params = {'limit': 20, 'offset': 5}
+    records = client.get('/data/orders', params=params).json()
+    columns = client.get('/data/orders', params=params, headers={'Accept': COLUMNAR_MEDIA_TYPE}).json()
+    table = _streams(client.get('/data/orders', params=params, headers={'Accept': ARROW_MEDIA_TYPE}).content)[0]
+    assert records['total'] == columns['total'] == int(table.schema.metadata[b'total'])
+    assert pd.DataFrame(records['data']).to_dict('list') == columns['columns']
+    assert table.column('order_id').to_pylist() == columns['columns']['order_id']
+
+
+def test_dashboard_answers_one_arrow_stream_per_panel(client):
+    panels = client.get('/analytics/dashboard').json()
+    response = client.get('/analytics/dashboard', headers={'Accept': ARROW_MEDIA_TYPE})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == ARROW_MEDIA_TYPE
+    tables = _streams(response.content)
+    assert [table.schema.metadata[b'name'].decode() for table in tables] == list(panels)
+    for table, panel in zip(tables, panels.values()):
+        assert table.column('labels').to_pylist() == panel['data']['labels']
+
+
+def test_batch_answers_one_arrow_stream_per_query(client):
+    queries = ['top 5 products by revenue', 'revenue by channel']
+    batch = client.post('/analytics/query/batch', json={'queries': queries}).json()
+    response = client.post('/analytics/query/batch', json={'queries': queries}, headers={'Accept': ARROW_MEDIA_TYPE})
+    assert response.status_code == 200
+    tables = _streams(response.content)
+    assert len(tables) == len(queries)
+    for table, result in zip(tables, batch['results']):
+        assert table.column('values').to_pylist() == pytest.approx(result['data']['values'])
+        # The second batch is answered from the cache, so only the counts' shape is compared
+        assert orjson.loads(table.schema.metadata[b'subplans']).keys() == batch['subplans'].keys()
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import main
+from executor import BoundedExecutor, ExecutorOverloaded
+
+
+def _occupy(executor: BoundedExecutor, release: threading.Event) -> threading.Thread:
+    """Hold one of the executor's slots until release is set"""
+    thread = threading.Thread(target=asyncio.run, args=(executor.run(release.wait, 10),))
+    thread.start()
+    while executor.stats()['in_flight'] == 0:
+        time.sleep(0.005)
+    return thread
+
+
+def test_submissions_beyond_workers_and_queue_are_rejected():
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    holders = [_occupy(executor, release)]
+    holders.append(threading.Thread(target=asyncio.run, args=(executor.run(release.wait, 10),)))
+    holders[-1].start()
+    while executor.stats()['in_flight'] < 2:
+        time.sleep(0.005)
+    assert executor.stats()['queued'] == 1
+    with pytest.raises(ExecutorOverloaded):
+        asyncio.run(executor.run(lambda: None))
+    release.set()
+    for holder in holders:
+        holder.join()
+    # Slots are released once the work finishes, failed work included
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(executor.run(lambda: 1 / 0))
+    assert asyncio.run(executor.run(sum, [1, 2])) == 3
+    stats = executor.stats()
+    assert (stats['in_flight'], stats['rejected'], stats['completed']) == (0, 1, 4)
+    executor.shutdown()
+
+
+def test_event_loop_keeps_running_while_work_blocks():
+    executor = BoundedExecutor(max_workers=1)
+
+    async def scenario():
+        ticks = 0
+        work = asyncio.ensure_future(executor.run(time.sleep, 0.2))
+        while not work.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+    executor.shutdown()
+
+
+def test_overloaded_api_answers_503(client, monkeypatch):
+    executor = BoundedExecutor(max_workers=1, max_queue=0)
+    monkeypatch.setattr(main, 'executor', executor)
+    release = threading.Event()
+    holder = _occupy(executor, release)
+    try:
+        response = client.get('/data/overview')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        # Liveness never waits on the pool
+        assert client.get('/health/live').status_code == 200
+    finally:
+        release.set()
+        holder.join()
+    assert client.get('/data/overview').status_code == 200
+    executor.shutdown()
+
+
+def test_dashboard_fans_out_its_queries(client, monkeypatch):
+    # Every panel waits for all the others, so they only finish if they run at the same time
+    panels = threading.Barrier(len(main.DASHBOARD_QUERIES), timeout=5)
+    execute = main._execute_query
+
+    def _execute_together(parsed_query):
+        panels.wait()
+        return execute(parsed_query)
+
+    monkeypatch.setattr(main, '_execute_query', _execute_together)
+    monkeypatch.setattr(main, 'executor', BoundedExecutor(max_workers=len(main.DASHBOARD_QUERIES)))
+    response = client.get('/analytics/dashboard')
+    assert response.status_code == 200, response.text
+    assert list(response.json()) == list(main.DASHBOARD_QUERIES)
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pytest
+
+from export import keyset_start
+from schema import format_id_columns
+
+
+def test_cursor_pages_walk_the_table_in_id_order(client, lakehouse):
+    ids, cursor = [], None
+    while True:
+        page = client.get('/data/customers', params={'limit': 70, **({'after': cursor} if cursor else {})}).json()
+        ids += [row['customer_id'] for row in page['data']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+        assert cursor == ids[-1]
+    assert ids == format_id_columns(lakehouse.customers)['customer_id'].tolist()
+
+
+def test_offset_and_cursor_pages_agree(client):
+    by_offset = client.get('/data/orders', params={'limit': 25, 'offset': 50}).json()
+    cursor = by_offset['data'][0]['order_id']
+    by_cursor = client.get('/data/orders', params={'limit': 24, 'after': cursor}).json()
+    assert by_cursor['data'] == by_offset['data'][1:]
+    assert by_cursor['offset'] == 51
+
+
+def test_keyset_start_finds_the_row_after_the_cursor():
+    frame = pd.DataFrame({'id': [1, 2, 5, 9]})
+    assert [keyset_start(frame, 'id', after) for after in (None, 0, 1, 4, 5, 9, 12)] == [0, 0, 1, 2, 3, 4, 4]
+
+
+def test_ndjson_export_matches_the_table(client, lakehouse):
+    response = client.get('/data/orders/export', params={'format': 'ndjson', 'chunk_rows': 333})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    expected = format_id_columns(lakehouse.orders)
+    assert len(rows) == len(expected)
+    exported = pd.DataFrame(rows)
+    assert exported['order_id'].tolist() == expected['order_id'].tolist()
+    np.testing.assert_allclose(exported['total_amount'], expected['total_amount'])
+    assert (pd.to_datetime(exported['order_date']) == expected['order_date']).all()
+
+
+def test_arrow_export_resumes_after_a_cursor(client, lakehouse):
+    cursor = 'PROD_000020'
+    response = client.get('/data/products/export', params={'format': 'arrow', 'chunk_rows': 64, 'after': cursor})
+    reader = ipc.open_stream(pa.BufferReader(response.content))
+    batches = list(reader)
+    assert max(batch.num_rows for batch in batches) == 64
+    exported = pa.Table.from_batches(batches, reader.schema).to_pandas()
+    expected = format_id_columns(lakehouse.products.iloc[20:]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(exported, expected, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('url, params, status', [
+    ('/data/orders/export', {'format': 'csv'}, 400),
+    ('/data/orders/export', {'after': 'ORD_x'}, 400),
+    ('/data/orders/export', {'chunk_rows': 0}, 422),
+    ('/data/reviews/export', {}, 404),
+])
+def test_bad_export_requests(client, url, params, status):
+    assert client.get(url, params=params).status_code == status
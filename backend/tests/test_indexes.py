@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ingest
+from indexes import In, Range, TableIndexes, build_index, select
+from schema import parse_id
+
+ROWS = 2_000
+
+
+@pytest.fixture(scope='module')
+def table() -> pd.DataFrame:
+    rng = np.random.default_rng(11)
+    price = rng.integers(0, 200, ROWS).astype(np.float64)
+    price[rng.random(ROWS) < 0.02] = np.nan
+    return pd.DataFrame({
+        'id': np.arange(ROWS, dtype=np.int64),
+        'owner': rng.integers(0, 400, ROWS).astype(np.int32),
+        'price': price,
+        'day': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, ROWS), unit='D'),
+        'status': pd.Categorical(rng.choice(['new', 'paid', 'sent', 'gone'], ROWS, p=[0.1, 0.4, 0.45, 0.05]),
+                                 categories=['new', 'paid', 'sent', 'gone', 'lost']),
+    })
+
+
+def _reference(frame: pd.DataFrame, predicates, sort, descending) -> np.ndarray:
+    """Matching row positions via pandas: filtered, then stably sorted; descending reverses ties too"""
+    keep = pd.Series(True, index=frame.index)
+    for predicate in predicates:
+        column = frame[predicate.column]
+        if isinstance(predicate, In):
+            keep &= column.isin(predicate.values)
+            continue
+        if predicate.low is not None:
+            keep &= column >= predicate.low
+        if predicate.high is not None:
+            keep &= (column <= predicate.high) if predicate.high_inclusive else (column < predicate.high)
+    positions = np.flatnonzero(keep.to_numpy())
+    if sort is not None:
+        values = frame[sort].cat.codes.to_numpy() if frame[sort].dtype == 'category' else frame[sort].to_numpy()
+        positions = positions[np.argsort(values[positions], kind='stable')]
+        if descending:
+            positions = positions[::-1]
+    return positions
+
+
+CASES = [
+    # Selective equality: driven by an index
+    ([In('owner', (3, 17, 250))], None),
+    ([In('owner', (3, 17, 250))], 'price'),
+    ([In('status', ('new',)), Range('price', 10, 20)], 'price'),
+    ([In('status', ('paid', 'sent')), Range('day', '2024-03-01', '2024-06-01', high_inclusive=False)], 'day'),
+    # Broad predicates: scanned
+    ([In('status', ('paid', 'sent'))], None),
+    ([Range('price', low=150)], 'owner'),
+    # Nothing matches
+    ([In('status', ('lost',))], 'price'),
+    ([In('owner', (10_000,))], None),
+    # A sort alone
+    ([], 'day'),
+]
+
+
+@pytest.mark.parametrize('predicates, sort', CASES)
+@pytest.mark.parametrize('descending', [False, True])
+def test_select_matches_pandas(table, predicates, sort, descending):
+    selection = select(table, TableIndexes(len(table)), predicates, sort, descending and sort is not None)
+    expected = _reference(table, predicates, sort, descending and sort is not None)
+    assert len(selection) == len(expected)
+    np.testing.assert_array_equal(selection.page(0, len(expected)), expected)
+    # Pages tile the result
+    pages = [selection.page(start, 7) for start in range(0, len(expected), 7)]
+    np.testing.assert_array_equal(np.concatenate(pages or [expected]), expected)
+
+
+def test_planner_uses_the_most_selective_index(table):
+    indexes = TableIndexes(len(table))
+    selection = select(table, indexes, [In('status', ('paid', 'sent', 'new')), In('owner', (5,))])
+    assert selection.index == 'owner'
+    assert selection.examined == int((table['owner'] == 5).sum())
+    scanned = select(table, indexes, [In('status', ('paid', 'sent'))])
+    assert scanned.index is None and scanned.examined == len(table)
+
+
+def test_missing_values_match_no_range(table):
+    selection = select(table, TableIndexes(len(table)), [Range('price', low=0)], 'price')
+    assert len(selection) == int(table['price'].notna().sum())
+
+
+@pytest.mark.parametrize('column', ['owner', 'price', 'day', 'status'])
+def test_extended_indexes_equal_a_rebuild(table, column):
+    index = build_index(table[column].iloc[:1_500]).extended(table[column])
+    rebuilt = build_index(table[column])
+    np.testing.assert_array_equal(index.order, rebuilt.order)
+    np.testing.assert_array_equal(index.values, rebuilt.values)
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_cursors_resume_after_the_last_row(table, descending):
+    selection = select(table, TableIndexes(len(table)), [Range('price', 20, 120)], 'price', descending)
+    everything = selection.page(0, len(selection))
+    for row in everything[[0, 10, len(everything) // 2]]:
+        start = selection.offset_after(table, 'id', int(table['id'].iat[row]))
+        assert start == list(everything).index(row) + 1
+
+
+def test_order_pages_filter_and_sort_like_pandas(client, lakehouse):
+    # Orders span the year before as_of; a max date covers its whole day
+    last_day = (pd.Timestamp(lakehouse.as_of) - pd.Timedelta(days=180)).date()
+    params = {'channel': ['Website', 'Store'], 'min_total_amount': 500, 'max_order_date': last_day.isoformat(),
+              'sort': '-total_amount', 'limit': 25}
+    page = client.get('/data/orders', params=params).json()
+    orders = lakehouse.orders
+    keep = (orders['channel'].isin(['Website', 'Store']) & (orders['total_amount'] >= 500)
+            & (orders['order_date'] < pd.Timestamp(last_day) + pd.Timedelta(days=1)))
+    expected = orders[keep].iloc[::-1].sort_values('total_amount', ascending=False, kind='stable')
+    assert page['total'] == len(expected) > 25
+    assert [parse_id('order_id', order['order_id']) for order in page['data']] == expected['order_id'][:25].tolist()
+    assert {'index', 'rows_examined'} <= page.keys()
+
+
+def test_customer_cursor_walk_covers_every_match(client, lakehouse):
+    params = {'customer_segment': ['Premium'], 'sort': 'age', 'limit': 15}
+    seen, after = [], None
+    while True:
+        page = client.get('/data/customers', params={**params, **({'after': after} if after else {})}).json()
+        seen += [customer['customer_id'] for customer in page['data']]
+        after = page['next_cursor']
+        if after is None:
+            break
+    customers = lakehouse.customers
+    expected = customers[customers['customer_segment'] == 'Premium'].sort_values('age', kind='stable')
+    assert [parse_id('customer_id', customer) for customer in seen] == expected['customer_id'].tolist()
+
+
+def test_ingested_orders_are_found_by_filters(ingest_client, fresh_lakehouse):
+    params = {'customer_id': ['CUST_000007'], 'sort': 'order_date'}
+    before = ingest_client.get('/data/orders', params=params).json()['total']
+    ingest(fresh_lakehouse, customers=[7], products=[1], amounts=[5.0], order_date=pd.Timestamp('2030-01-01'))
+    page = ingest_client.get('/data/orders', params=params).json()
+    assert page['total'] == before + 1
+    assert page['data'][-1]['order_date'].startswith('2030-01-01')
+
+
+@pytest.mark.parametrize('params', [{'order_status': 'Lost'}, {'sort': 'shipping_address'},
+                                    {'min_total_amount': 'cheap'}])
+def test_invalid_filters_are_rejected(client, params):
+    assert client.get('/data/orders', params=params).status_code == 422
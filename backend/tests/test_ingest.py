@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import MATERIALIZED_VIEWS, LakehouseAggregates
+from conftest import ingest
+
+
+def _order(**fields):
+    return {'customer_id': 'CUST_000001', 'items': [{'product_id': 'PROD_000001', 'quantity': 2, 'unit_price': 10.0}],
+            **fields}
+
+
+def test_order_dates_with_utc_offsets_are_stored_in_utc(ingest_client, fresh_lakehouse):
+    response = ingest_client.post('/data/orders/batch', json={'orders': [
+        _order(order_date='2024-05-01T10:00:00+02:00'),
+        _order(order_date='2024-05-01T10:00:00'),
+        _order(order_date='2024-05-01T10:00:00Z'),
+    ]})
+    assert response.status_code == 200, response.text
+    dates = fresh_lakehouse.orders['order_date'].iloc[-3:]
+    assert dates.dtype == 'datetime64[ns]'
+    assert dates.tolist() == [pd.Timestamp('2024-05-01 08:00'), pd.Timestamp('2024-05-01 10:00'),
+                              pd.Timestamp('2024-05-01 10:00')]
+
+
+def test_batch_of_only_offset_dates_is_accepted(ingest_client, fresh_lakehouse):
+    batch = {'orders': [_order(order_date='2024-05-01T23:30:00-05:00')]}
+    response = ingest_client.post('/data/orders/batch', json=batch)
+    assert response.status_code == 200, response.text
+    assert fresh_lakehouse.orders['order_date'].iloc[-1] == pd.Timestamp('2024-05-02 04:30')
+
+
+def _assert_views_equal(maintained: LakehouseAggregates, rescanned: LakehouseAggregates):
+    for fact, keys, grain in MATERIALIZED_VIEWS:
+        got, expected = maintained.view(fact, keys, grain), rescanned.view(fact, keys, grain)
+        for part in ('columns', 'positions'):
+            assert got[part].keys() == expected[part].keys()
+            for name in got[part]:
+                np.testing.assert_array_equal(got[part][name], expected[part][name])
+        for metric in MATERIALIZED_VIEWS[(fact, keys, grain)]:
+            np.testing.assert_allclose(got['metrics'][metric], expected['metrics'][metric], err_msg=str(keys))
+
+
+def test_ingested_batches_match_a_rescan(ingest_client, fresh_lakehouse):
+    maintained = fresh_lakehouse.aggregates
+    # A month the snapshot has no orders in, a new order status and several items per order
+    batch = [
+        _order(customer_id='CUST_000003', order_date='2020-02-10T12:00:00', order_status='Cancelled',
+               items=[{'product_id': 'PROD_000004', 'quantity': 3, 'unit_price': 12.5},
+                      {'product_id': 'PROD_000009', 'quantity': 1, 'unit_price': 99.0}]),
+        _order(customer_id='CUST_000003'),
+        _order(customer_id='CUST_000150', payment_method='PayPal', channel='Mobile App'),
+    ]
+    for orders in (batch, batch[1:]):
+        assert ingest_client.post('/data/orders/batch', json={'orders': orders}).status_code == 200
+    assert fresh_lakehouse.aggregates is maintained
+    _assert_views_equal(maintained, LakehouseAggregates.build(fresh_lakehouse))
+
+
+def test_monthly_revenue_matches_pandas_after_ingest(fresh_lakehouse):
+    ingest(fresh_lakehouse, customers=[1, 2], products=[1, 2], amounts=[100.0, 250.0])
+    orders = fresh_lakehouse.orders
+    expected = orders.groupby(orders['order_date'].dt.to_period('M').astype(str))['total_amount'].agg(['sum', 'size'])
+    view = fresh_lakehouse.aggregates.view('orders', ('orders.order_date',), 'M')
+    np.testing.assert_array_equal(view['columns']['orders.order_date'], expected.index.to_numpy())
+    np.testing.assert_allclose(view['metrics'][('sum', 'orders.total_amount')], expected['sum'])
+    np.testing.assert_array_equal(view['metrics'][('count', None)], expected['size'])
+
+
+def test_rejected_batches_leave_the_aggregates_alone(ingest_client, fresh_lakehouse):
+    total, rows = fresh_lakehouse.aggregates.total_revenue, len(fresh_lakehouse.orders)
+    response = ingest_client.post('/data/orders/batch', json={'orders': [
+        _order(), _order(items=[{'product_id': 'PROD_999999', 'quantity': 1, 'unit_price': 1.0}])]})
+    assert response.status_code == 422
+    assert fresh_lakehouse.aggregates.total_revenue == pytest.approx(total)
+    assert len(fresh_lakehouse.orders) == rows
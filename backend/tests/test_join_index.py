@@ -0,0 +1,47 @@
+import numpy as np
+
+from conftest import ingest
+from main import LLMAnalytics
+
+
+def _analytics(lakehouse) -> LLMAnalytics:
+    analytics = LLMAnalytics()
+    analytics.lakehouse = lakehouse
+    return analytics
+
+
+def test_join_index_points_at_the_matching_dimension_rows(lakehouse):
+    index = lakehouse.join_index()
+    items, orders = lakehouse.order_items, lakehouse.orders
+    np.testing.assert_array_equal(lakehouse.products['product_id'].to_numpy()[index['item_product']],
+                                  items['product_id'].to_numpy())
+    np.testing.assert_array_equal(orders['order_id'].to_numpy()[index['item_order']], items['order_id'].to_numpy())
+    np.testing.assert_array_equal(lakehouse.customers['customer_id'].to_numpy()[index['order_customer']],
+                                  orders['customer_id'].to_numpy())
+    np.testing.assert_array_equal(index['categories'][index['product_category']],
+                                  lakehouse.products['category'].to_numpy())
+
+
+def test_join_index_extends_over_ingested_rows(fresh_lakehouse):
+    before = {key: value.copy() for key, value in fresh_lakehouse.join_index().items()}
+    ingest(fresh_lakehouse, customers=[4, 9], products=[2, 7], amounts=[10.0, 20.0])
+    index = fresh_lakehouse.join_index()
+    for key in ('item_product', 'item_order', 'order_customer'):
+        np.testing.assert_array_equal(index[key][:len(before[key])], before[key])
+    np.testing.assert_array_equal(index['item_product'][-2:], fresh_lakehouse.product_index.get_indexer([2, 7]))
+    np.testing.assert_array_equal(index['order_customer'][-2:], fresh_lakehouse.customer_index.get_indexer([4, 9]))
+    assert (index['item_order'][-2:] == [len(fresh_lakehouse.orders) - 2, len(fresh_lakehouse.orders) - 1]).all()
+
+
+def test_product_analyses_match_a_hash_join(lakehouse):
+    analytics = _analytics(lakehouse)
+    items = lakehouse.order_items.merge(lakehouse.products, on='product_id')
+    top = items.groupby('product_id')['total_price'].sum().nlargest(10)
+    answer = analytics.execute_analytics_query(analytics.parse_natural_language_query('top products'))
+    np.testing.assert_allclose(answer['data']['values'], top.to_numpy())
+
+    categories = items.groupby('category', observed=True)[['total_price', 'quantity']].sum()
+    answer = analytics.execute_analytics_query(analytics.parse_natural_language_query('compare categories'))
+    expected = categories.loc[answer['data']['labels']]
+    np.testing.assert_allclose(answer['data']['revenue'], expected['total_price'])
+    np.testing.assert_array_equal(answer['data']['quantity'], expected['quantity'])
@@ -0,0 +1,100 @@
+import re
+
+import pytest
+
+from metrics import PROMETHEUS_CONTENT_TYPE, Registry, RequestMetrics, StageTimer, _covered, instrumented, stage
+
+
+def _timer(elapsed: float) -> StageTimer:
+    timer = StageTimer()
+    timer.elapsed = elapsed
+    return timer
+
+
+def _durations(header: str) -> dict:
+    return {name: float(ms) for name, ms in re.findall(r'(\w+);dur=([\d.]+)', header)}
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency', ('endpoint',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, endpoint='/a')
+    assert registry.render().splitlines() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{endpoint="/a",le="0.1"} 1',
+        'latency_seconds_bucket{endpoint="/a",le="1"} 3',
+        'latency_seconds_bucket{endpoint="/a",le="+Inf"} 4',
+        'latency_seconds_sum{endpoint="/a"} 4.05',
+        'latency_seconds_count{endpoint="/a"} 4',
+    ]
+
+
+def test_metrics_check_labels_and_names():
+    registry = Registry()
+    counter = registry.counter('events_total', 'Events', ('kind',))
+    with pytest.raises(ValueError):
+        counter.inc(kind='a', extra='b')
+    with pytest.raises(ValueError):
+        registry.gauge('events_total', 'Again')
+    counter.inc(kind='quote"d')
+    registry.gauge('depth', 'Depth', callback=lambda: {(): 7})
+    assert 'events_total{kind="quote\\"d"} 1' in registry.render()
+    assert 'depth 7' in registry.render()
+
+
+def test_stages_are_timed_only_under_a_timer():
+    def work():
+        with stage('parse'):
+            pass
+        with stage('parse'):
+            pass
+        return 'done'
+
+    with stage('outside'):
+        pass
+    result, timer = instrumented(work)
+    assert result == 'done'
+    assert list(timer.stages) == ['parse'] and timer.stages['parse'] <= timer.elapsed
+
+
+def test_queries_report_their_stages_in_server_timing(client):
+    response = client.post('/analytics/query', json={'query': 'revenue by channel'})
+    assert response.status_code == 200
+    durations = _durations(response.headers['server-timing'])
+    assert {'parse', 'validate', 'encode', 'total'} <= set(durations)
+    assert sum(seconds for name, seconds in durations.items() if name != 'total') <= durations['total'] + 1
+
+
+def test_metrics_endpoint_exposes_requests_stages_and_tables(client):
+    client.get('/data/orders', params={'limit': 5})
+    client.post('/analytics/query', json={'query': 'revenue by channel'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == PROMETHEUS_CONTENT_TYPE
+    text = response.text
+    assert re.search(r'http_request_duration_seconds_count\{endpoint="/data/orders",method="GET",'
+                     r'status="200"\} \d+', text)
+    assert re.search(r'analytics_stage_duration_seconds_count\{endpoint="/analytics/query",'
+                     r'analysis_type="[a-z_]+",stage="parse"\} \d+', text)
+    assert re.search(r'lakehouse_table_rows\{table="orders"\} [1-9]\d*', text)
+    assert re.search(r'analytics_cache_lookups_total\{result="misses"\} \d+', text)
+
+
+def test_covered_counts_overlapping_intervals_once():
+    assert _covered([(0.0, 2.0), (1.0, 3.0), (5.0, 6.0), (5.5, 5.8)]) == 4.0
+    assert _covered([]) == 0.0
+
+
+def test_queue_is_the_wall_time_concurrent_units_waited():
+    request = RequestMetrics()
+    # Four units submitted together, each waiting 0.1 s before 0.05 s of work
+    for _ in range(4):
+        request.attach(_timer(0.05), waited=0.15)
+    assert 0.1 <= request.totals()['queue'] < 0.11
+
+
+def test_dashboard_queue_never_exceeds_the_request_total(client):
+    durations = _durations(client.get('/analytics/dashboard').headers['server-timing'])
+    assert durations['queue'] <= durations['total']
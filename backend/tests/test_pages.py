@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.mark.parametrize('params', [{'limit': 0}, {'limit': -1}, {'limit': 10_001}, {'offset': -5}])
+def test_out_of_range_paging_is_rejected(client, params):
+    assert client.get('/data/orders', params=params).status_code == 422
+    assert client.get('/data/orders', params={**params, 'sort': 'total_amount'}).status_code == 422
+
+
+def test_paging_bounds_are_inclusive(client, lakehouse):
+    assert len(client.get('/data/products', params={'limit': 1}).json()['data']) == 1
+    page = client.get('/data/products', params={'limit': 10_000, 'offset': 0}).json()
+    assert len(page['data']) == len(lakehouse.products)
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import partitions
+from conftest import ingest
+from main import LLMAnalytics
+from partitions import PartitionIndex
+
+
+def _full_scan(lakehouse, start, end):
+    """Positions of the orders and items dated within [start, end), by filtering every row"""
+    dates = lakehouse.orders['order_date']
+    keep = np.ones(len(dates), dtype=bool)
+    if start is not None:
+        keep &= (dates >= start).to_numpy()
+    if end is not None:
+        keep &= (dates < end).to_numpy()
+    items = lakehouse.order_items['order_id'].isin(lakehouse.orders['order_id'][keep]).to_numpy()
+    return np.flatnonzero(keep), np.flatnonzero(items)
+
+
+def _windows(lakehouse):
+    as_of = pd.Timestamp(lakehouse.as_of)
+    return [
+        (None, None),
+        (as_of - pd.Timedelta(days=45), None),
+        (None, as_of - pd.Timedelta(days=200)),
+        (as_of - pd.Timedelta(days=100, hours=7), as_of - pd.Timedelta(days=40, hours=3)),
+        (as_of - pd.Timedelta(days=10), as_of - pd.Timedelta(days=10)),
+        (pd.Timestamp('1999-01-01'), pd.Timestamp('2000-01-01')),
+    ]
+
+
+def _assert_scan_matches(lakehouse, start, end):
+    scan = lakehouse.time_slice(start and start.isoformat(), end and end.isoformat())
+    orders, items = _full_scan(lakehouse, start, end)
+    np.testing.assert_array_equal(np.sort(scan['orders']), orders)
+    np.testing.assert_array_equal(np.sort(scan['order_items']), items)
+    return scan
+
+
+def test_pruned_scans_match_a_full_scan(lakehouse):
+    for start, end in _windows(lakehouse):
+        _assert_scan_matches(lakehouse, start, end)
+
+
+def test_narrow_windows_skip_partitions(lakehouse):
+    as_of = pd.Timestamp(lakehouse.as_of)
+    scan = _assert_scan_matches(lakehouse, as_of - pd.Timedelta(days=20), as_of)
+    assert scan['partitions_scanned'] <= 2 < scan['partitions_total']
+    assert lakehouse.time_slice('1999-01-01', '2000-01-01')['partitions_scanned'] == 0
+
+
+def test_partitions_are_contiguous_months(lakehouse):
+    index = lakehouse.partitions()
+    np.testing.assert_array_equal(index.order_start[1:], index.order_stop[:-1])
+    np.testing.assert_array_equal(index.item_start[1:], index.item_stop[:-1])
+    assert index.order_rows == len(lakehouse.orders)
+    assert index.month == sorted(set(index.month))
+
+
+def test_ingested_and_backfilled_orders_stay_prunable(fresh_lakehouse):
+    before = len(fresh_lakehouse.partitions())
+    # Dated in the last partition's month, and backfilled far into the past
+    last_month = pd.Timestamp(fresh_lakehouse.partitions().min_date[-1])
+    for date in (last_month, pd.Timestamp('2001-03-04')):
+        ingest(fresh_lakehouse, customers=[1], products=[1], amounts=[10.0], order_date=date)
+    index = fresh_lakehouse.partitions()
+    assert index.order_rows == len(fresh_lakehouse.orders)
+    assert len(index) <= before + 2
+    for start, end in _windows(fresh_lakehouse) + [(pd.Timestamp('2001-03-01'), pd.Timestamp('2001-04-01'))]:
+        _assert_scan_matches(fresh_lakehouse, start, end)
+
+
+def test_extending_merges_the_current_month(monkeypatch):
+    # Few enough rows per month to count as clustered by date
+    monkeypatch.setattr(partitions, 'MIN_RUN_ROWS', 1)
+    dates = pd.to_datetime(['2024-01-05', '2024-01-20', '2024-02-02', '2024-02-10', '2024-02-11'])
+    orders = pd.DataFrame({'order_id': np.arange(1, 6), 'order_date': dates})
+    items = pd.DataFrame({'order_id': np.repeat(np.arange(1, 6), 2)})
+    index = PartitionIndex.build(orders.iloc[:3], items.iloc[:6])
+    extended = index.extended(orders, items)
+    assert extended.month == ['2024-01', '2024-02']
+    assert extended.order_stop.tolist() == [2, 5] and extended.item_stop.tolist() == [4, 10]
+    assert index.month == ['2024-01', '2024-02'] and index.order_stop.tolist() == [2, 3]
+
+
+@pytest.mark.parametrize('question', ['revenue by channel last 3 months', 'orders by status in the past 6 weeks'])
+def test_windowed_answers_match_pandas(lakehouse, question):
+    analytics = LLMAnalytics()
+    analytics.lakehouse = lakehouse
+    parsed = analytics.parse_natural_language_query(question)
+    answer = analytics.execute_analytics_query(parsed)
+    window = parsed['time_filter']
+    orders = lakehouse.orders
+    orders = orders[(orders['order_date'] >= window['start']) & (orders['order_date'] < window['end'])]
+    column = 'channel' if 'channel' in question else 'order_status'
+    grouped = orders.groupby(column, observed=True)['total_amount']
+    expected = grouped.sum() if 'revenue' in question else grouped.size()
+    expected = expected.loc[answer['data']['labels']]
+    np.testing.assert_allclose(answer['data']['values'], expected.to_numpy())
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import plan as plans
+from engine import execute
+from main import LLMAnalytics
+from plan import Filter, MaterializedScan, Scan, explain, optimize
+
+# The answers of the pandas analyses the plans replaced, per question
+
+
+def _time_series(lakehouse):
+    orders = lakehouse.orders[lakehouse.orders['order_id'].isin(lakehouse.order_items['order_id'])]
+    monthly = orders.groupby(orders['order_date'].dt.to_period('M')).agg(
+        revenue=('total_amount', 'sum'), orders=('order_id', 'count'))
+    return {'labels': monthly.index.astype(str).tolist(), 'revenue': monthly['revenue'].tolist(),
+            'orders': monthly['orders'].tolist()}
+
+
+def _top_products(lakehouse):
+    revenue = lakehouse.order_items.merge(lakehouse.products, on='product_id').groupby(
+        ['product_id', 'product_name'])['total_price'].sum().reset_index().nlargest(10, 'total_price')
+    return {'labels': revenue['product_name'].tolist(), 'values': revenue['total_price'].tolist()}
+
+
+def _top_customers(lakehouse):
+    spend = lakehouse.orders.merge(lakehouse.customers, on='customer_id').groupby(
+        ['customer_id', 'first_name', 'last_name'])['total_amount'].sum().reset_index().nlargest(10, 'total_amount')
+    return {'labels': (spend['first_name'] + ' ' + spend['last_name']).tolist(),
+            'values': spend['total_amount'].tolist()}
+
+
+def _categories(lakehouse):
+    categories = lakehouse.order_items.merge(lakehouse.products, on='product_id').groupby(
+        'category', observed=True).agg({'total_price': 'sum', 'quantity': 'sum'}).reset_index()
+    return {'labels': categories['category'].tolist(), 'revenue': categories['total_price'].tolist(),
+            'quantity': categories['quantity'].tolist()}
+
+
+def _distribution(column):
+    def counts(lakehouse):
+        table = lakehouse.customers if column == 'customer_segment' else lakehouse.orders
+        values = table[column].value_counts()
+        return dict(zip(values.index.tolist(), values.tolist()))
+    return counts
+
+
+def _overview(lakehouse):
+    return {'total_customers': len(lakehouse.customers), 'total_products': len(lakehouse.products),
+            'total_orders': len(lakehouse.orders), 'total_revenue': lakehouse.orders['total_amount'].sum(),
+            'avg_order_value': lakehouse.orders['total_amount'].mean()}
+
+
+def _analytics(lakehouse) -> LLMAnalytics:
+    analytics = LLMAnalytics()
+    analytics.lakehouse = lakehouse
+    return analytics
+
+
+def _answer(lakehouse, question):
+    analytics = _analytics(lakehouse)
+    return analytics.execute_analytics_query(analytics.parse_natural_language_query(question))['data']
+
+
+def _assert_same(data, expected):
+    assert data.keys() == expected.keys()
+    for key, values in expected.items():
+        if isinstance(values[0], str):
+            assert list(data[key]) == values
+        else:
+            np.testing.assert_allclose(data[key], values, err_msg=key)
+
+
+@pytest.mark.parametrize('question, reference', [
+    ('revenue trend', _time_series),
+    ('top products', _top_products),
+    ('top customers', _top_customers),
+    ('compare categories', _categories),
+])
+def test_answers_match_the_pandas_analyses(lakehouse, question, reference):
+    _assert_same(_answer(lakehouse, question), reference(lakehouse))
+
+
+@pytest.mark.parametrize('question, reference', [
+    ('customer segment distribution', _distribution('customer_segment')),
+    ('order status distribution', _distribution('order_status')),
+])
+def test_distributions_match_value_counts(lakehouse, question, reference):
+    data = _answer(lakehouse, question)
+    assert dict(zip(data['labels'], data['values'])) == reference(lakehouse)
+
+
+def test_overview_matches_pandas(lakehouse):
+    metrics = _answer(lakehouse, 'give me an overview')['metrics']
+    assert metrics == pytest.approx(_overview(lakehouse))
+
+
+@pytest.mark.parametrize('question', ['revenue trend', 'top products', 'compare categories',
+                                      'order status distribution', 'weekly revenue for the last 8 weeks',
+                                      'top 5 customers by revenue in q1'])
+def test_maintained_aggregates_match_scans(lakehouse, question, monkeypatch):
+    logical = _analytics(lakehouse).parse_natural_language_query(question)['plan']
+    maintained = execute(optimize(logical), lakehouse)
+    monkeypatch.setattr(plans, '_materialize', lambda node: node)
+    scanned = execute(optimize(logical), lakehouse)
+    for name, frame in maintained.items():
+        pd.testing.assert_frame_equal(frame, scanned[name], check_dtype=False)
+
+
+def _nodes(node):
+    yield node
+    if hasattr(node, 'source'):
+        yield from _nodes(node.source)
+
+
+def test_date_filters_become_partition_pruning(lakehouse):
+    planned = optimize(_analytics(lakehouse).parse_natural_language_query('revenue by channel last 3 months')['plan'])
+    nodes = [node for _, output in planned.outputs for node in _nodes(output)]
+    assert not any(isinstance(node, Filter) for node in nodes)
+    scans = [node for node in nodes if isinstance(node, Scan)]
+    assert scans and all(scan.time_range is not None for scan in scans)
+    # Only the columns the question reads
+    assert set(scans[0].columns) <= {'orders.order_date', 'orders.channel', 'orders.total_amount'}
+    assert 'MaterializedScan' not in explain(planned.outputs[0][1])
+
+
+def test_unfiltered_group_bys_read_maintained_aggregates(lakehouse):
+    planned = optimize(_analytics(lakehouse).parse_natural_language_query('revenue trend')['plan'])
+    assert any(isinstance(node, MaterializedScan) for _, output in planned.outputs for node in _nodes(output))
@@ -0,0 +1,32 @@
+"""The process executor serves requests while the lakehouse warms up.
+
+The app reads its configuration on import, so each case runs it in a fresh
+interpreter, under a timeout: a worker deadlocked on a lock it inherited
+would otherwise hang the test run.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# The first request reaches the pool while warm-up is still generating tables
+CLIENT = """
+from fastapi.testclient import TestClient
+import main
+
+with TestClient(main.app) as client:
+    response = client.get('/data/orders', params={'limit': 1})
+    assert response.status_code == 200, response.text
+    assert len(response.json()['data']) == 1
+    assert client.get('/health').status_code == 200
+"""
+
+
+def test_process_executor_with_warm_up():
+    env = dict(os.environ, ANALYTICS_EXECUTOR='process', ANALYTICS_WORKERS='2', LAKEHOUSE_WARM_UP='1',
+               LAKEHOUSE_SNAPSHOT_DIR='', LAKEHOUSE_SCALE='20')
+    result = subprocess.run([sys.executable, '-c', CLIENT], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from schema import (CATEGORICAL_DTYPES, CHANNELS, categorical_from_codes, conform, format_id, format_id_columns,
+                    parse_id, parse_ids)
+
+TOO_LONG = 'CUST_99999999999999999999999'
+
+
+def test_ids_round_trip():
+    assert format_id('customer_id', 42) == 'CUST_000042'
+    assert parse_id('customer_id', 'CUST_000042') == 42
+    np.testing.assert_array_equal(parse_ids('order_id', ['ORD_00000001', 'ORD_123456789']), [1, 123456789])
+
+
+@pytest.mark.parametrize('value', ['PROD_000001', 'CUST_', 'CUST_12a', 'CUST_-1', 'CUST_١٢', TOO_LONG])
+def test_malformed_ids_raise_value_error(value):
+    with pytest.raises(ValueError, match='Invalid customer_id'):
+        parse_ids('customer_id', [value])
+
+
+def test_ids_too_long_for_int64_are_client_errors(client):
+    assert client.get('/data/customers', params={'after': TOO_LONG}).status_code == 400
+    assert client.get('/data/orders', params={'customer_id': TOO_LONG}).status_code == 400
+
+
+def test_ingesting_an_id_too_long_for_int64_is_rejected(ingest_client):
+    order = {'customer_id': TOO_LONG, 'items': [{'product_id': 'PROD_000001', 'quantity': 1, 'unit_price': 5.0}]}
+    response = ingest_client.post('/data/orders/batch', json={'orders': [order]})
+    assert response.status_code == 422
+    assert 'Invalid customer_id' in response.json()['detail']
+
+
+def test_tables_use_surrogate_keys_and_categoricals(lakehouse):
+    for table, column in (('customers', 'customer_id'), ('products', 'product_id'), ('orders', 'customer_id'),
+                          ('order_items', 'product_id')):
+        assert getattr(lakehouse, table)[column].dtype.kind == 'i'
+    for column, dtype in CATEGORICAL_DTYPES.items():
+        for table in ('customers', 'products', 'orders'):
+            frame = getattr(lakehouse, table)
+            if column in frame:
+                assert frame[column].dtype == dtype
+
+
+def test_compact_tables_are_smaller_than_object_columns(lakehouse):
+    orders = lakehouse.orders
+    as_objects = format_id_columns(orders).astype({name: object for name in CATEGORICAL_DTYPES if name in orders})
+    assert orders.memory_usage(deep=True).sum() < as_objects.memory_usage(deep=True).sum()
+
+
+def test_categorical_codes_follow_the_sorted_vocabulary():
+    values = pd.Series(categorical_from_codes('channel', CHANNELS, np.array([0, 3, 1])))
+    assert values.tolist() == ['Website', 'Store', 'Mobile App']
+    assert values.cat.categories.tolist() == sorted(CHANNELS)
+
+
+def test_conform_rejects_values_outside_the_vocabulary(lakehouse):
+    batch = lakehouse.orders.head(2).astype({'channel': object})
+    batch.loc[batch.index[1], 'channel'] = 'Carrier Pigeon'
+    with pytest.raises(ValueError, match='Unknown channel: Carrier Pigeon'):
+        conform(batch, lakehouse.orders)
+
+
+def test_api_renders_formatted_ids_and_labels(client, lakehouse):
+    row = client.get('/data/orders', params={'limit': 1}).json()['data'][0]
+    first = lakehouse.orders.iloc[0]
+    assert row['order_id'] == format_id('order_id', first['order_id'])
+    assert row['customer_id'] == format_id('customer_id', first['customer_id'])
+    assert row['channel'] == first['channel']
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import main
+from conftest import TEST_SCALE, TEST_SEED, make_lakehouse, serve
+from shared import publish
+from snapshot import TABLES, read_manifest
+
+
+@pytest.fixture(scope='module')
+def published(tmp_path_factory) -> str:
+    return publish(TEST_SCALE, TEST_SEED, None, str(tmp_path_factory.mktemp('shm')))
+
+
+def test_publish_writes_every_table_under_the_shm_root(published, lakehouse):
+    manifest = read_manifest(published)
+    assert Path(published).name.startswith('lakehouse-')
+    assert (manifest['scale'], manifest['seed']) == (TEST_SCALE, TEST_SEED)
+    assert manifest['as_of'] == lakehouse.as_of.isoformat()
+    assert manifest['rows'] == {table: len(getattr(lakehouse, table)) for table in TABLES}
+
+
+def test_workers_read_the_published_tables(published, lakehouse):
+    # Scale and seed come from the published manifest, not the worker's arguments
+    worker = main.DataLakehouse(scale=1.0, seed=0, shared_path=published)
+    assert worker.shared and (worker.scale, worker.seed) == (TEST_SCALE, TEST_SEED)
+    assert worker.as_of == lakehouse.as_of
+    for table in TABLES:
+        pd.testing.assert_frame_equal(getattr(worker, table), getattr(lakehouse, table))
+
+
+def test_missing_shared_tables_are_an_error(tmp_path):
+    with pytest.raises(RuntimeError, match='No shared lakehouse tables'):
+        main.DataLakehouse(shared_path=str(tmp_path))
+
+
+def test_shared_workers_answer_like_a_private_lakehouse(monkeypatch, published):
+    queries = ['revenue by channel', 'top 5 products by revenue', 'monthly revenue trend']
+    with serve(monkeypatch, make_lakehouse()) as private:
+        expected = [private.post('/analytics/query', json={'query': query}).json()['data'] for query in queries]
+    with serve(monkeypatch, main.DataLakehouse(shared_path=published)) as worker:
+        for query, data in zip(queries, expected):
+            assert worker.post('/analytics/query', json={'query': query}).json()['data'] == pytest.approx(data)
+        order = {'customer_id': 'CUST_000001',
+                 'items': [{'product_id': 'PROD_000001', 'quantity': 1, 'unit_price': 1.0}]}
+        assert worker.post('/data/orders/batch', json={'orders': [order]}).status_code == 409
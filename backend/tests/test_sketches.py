@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ingest, make_lakehouse, serve
+from sketches import HyperLogLog, LakehouseSketches, SpaceSaving, StratifiedSample, TDigest, merge_bounds, month_window
+
+
+@pytest.fixture(scope='module')
+def sampled_lakehouse():
+    """A lakehouse whose sample is sparse enough, at test scale, to be estimated from"""
+    lakehouse = make_lakehouse()
+    lakehouse.warm_up()
+    lakehouse._sketches = LakehouseSketches.build(lakehouse, per_month=8, capacity=16)
+    return lakehouse
+
+
+@pytest.fixture
+def sampled_client(monkeypatch, sampled_lakehouse):
+    with serve(monkeypatch, sampled_lakehouse) as test_client:
+        yield test_client
+
+
+def _ask(client, query: str, approximate: bool) -> dict:
+    response = client.post('/analytics/query', json={'query': query, 'approximate': approximate})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_hyperloglog_is_within_its_error_and_merges_like_one_sketch():
+    keys = np.random.default_rng(1).integers(0, 200_000, 60_000)
+    whole, first, second = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    whole.add(keys)
+    first.add(keys[:20_000])
+    second.add(keys[20_000:])
+    distinct = len(np.unique(keys))
+    assert abs(whole.estimate() - distinct) <= whole.relative_error * distinct
+    np.testing.assert_array_equal(first.merged(second).registers, whole.registers)
+
+
+def test_space_saving_bounds_hold_for_every_key():
+    rng = np.random.default_rng(2)
+    keys = rng.zipf(1.5, 5_000) % 500
+    weights = rng.random(len(keys)) * 10
+    first = SpaceSaving.from_totals(*_totals(keys[:2_000], weights[:2_000]), capacity=32)
+    first.update(*_totals(keys[2_000:4_000], weights[2_000:4_000]))
+    second = SpaceSaving(capacity=32)
+    second.update(keys[4_500:], weights[4_500:])
+    exact_keys, exact_weights = _totals(keys[4_000:4_500], weights[4_000:4_500])
+
+    bounded, lower, upper = merge_bounds([first, second], exact_keys, exact_weights)
+    true_keys, true_totals = _totals(keys, weights)
+    true = dict(zip(true_keys.tolist(), true_totals.tolist()))
+    for key, low, high in zip(bounded.tolist(), lower, upper):
+        assert low - 1e-9 <= true[key] <= high + 1e-9
+    # Keys outside the summaries weigh no more than the floors allow
+    unbounded = np.setdiff1d(true_keys, bounded)
+    assert true_totals[np.isin(true_keys, unbounded)].max(initial=0) <= first.floor + second.floor + 1e-9
+    # The heaviest key is always monitored
+    assert true_keys[np.argmax(true_totals)] in bounded
+
+
+def _totals(keys, weights):
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights)
+
+
+def test_tdigest_quantiles_track_the_data():
+    values = np.random.default_rng(3).lognormal(3, 1, 50_000)
+    digest = TDigest()
+    for chunk in np.array_split(values, 5):
+        digest = digest.merged(_digest(chunk))
+    assert digest.count == len(values)
+    qs = [0.01, 0.5, 0.9, 0.99]
+    estimates, _ = digest.quantiles(qs)
+    np.testing.assert_allclose(estimates, np.quantile(values, qs), rtol=0.02)
+
+
+def _digest(values) -> TDigest:
+    digest = TDigest()
+    digest.add(values)
+    return digest
+
+
+def test_month_window_splits_whole_and_partial_months():
+    months = list(np.array(['2024-01', '2024-02', '2024-03', '2024-04'], dtype='datetime64[M]'))
+    whole, partial = month_window(months, '2024-01-15', '2024-04-01')
+    assert whole == months[1:3]
+    assert partial == [('2024-01-15T00:00:00.000000000', '2024-02-01T00:00:00.000000000')]
+    assert month_window(months, None, None) == (months, [])
+
+
+def test_stratified_sample_keeps_per_month_counts_across_batches():
+    dates = np.sort(np.random.default_rng(4).integers(0, 120, 3_000)).astype('datetime64[D]')
+    sample = StratifiedSample(per_month=50, seed=5)
+    sample.add(0, dates[:1_000])
+    sample.add(1_000, dates[1_000:])
+    state = sample.state
+    months, population = np.unique(dates.astype('datetime64[M]'), return_counts=True)
+    np.testing.assert_array_equal(state.months, months)
+    np.testing.assert_array_equal(state.population, population)
+    np.testing.assert_array_equal(state.sampled, np.minimum(population, 50))
+    np.testing.assert_array_equal(dates[state.positions].astype('datetime64[M]'), months[state.stratum])
+
+
+@pytest.mark.parametrize('query', ['revenue by channel', 'number of orders by shipping method',
+                                   'average order value by payment method'])
+def test_sampled_estimates_are_within_their_error(sampled_client, query):
+    approximate, exact = _ask(sampled_client, query, True), _ask(sampled_client, query, False)
+    assert approximate['insights'][-1].startswith('Approximate')
+    expected = dict(zip(exact['data']['labels'], exact['data']['values']))
+    for label, value, error in zip(approximate['data']['labels'], approximate['data']['values'],
+                                   approximate['data']['values_error']):
+        # 95% bounds: allow the odd group just outside them
+        assert abs(value - expected[label]) <= 2 * error
+
+
+def test_heavy_hitter_bounds_contain_the_exact_revenue(sampled_client):
+    query = 'top 5 customers by revenue in the last 90 days'
+    approximate = _ask(sampled_client, query, True)
+    assert 'Space-Saving' in approximate['insights'][-1]
+    exact = _ask(sampled_client, query.replace('top 5', 'top 200'), False)['data']
+    expected = dict(zip(exact['labels'], exact['values']))
+    for label, value, error in zip(*(approximate['data'][key] for key in ('labels', 'values', 'values_error'))):
+        assert value - error - 1e-6 <= expected[label] <= value + error + 1e-6
+
+
+def test_maintained_aggregates_answer_approximate_queries_exactly(sampled_client):
+    approximate = _ask(sampled_client, 'top 5 products by revenue', True)
+    assert approximate['data'] == _ask(sampled_client, 'top 5 products by revenue', False)['data']
+    assert approximate['insights'][-1] == "Exact result: this query was answered without sampling"
+
+
+def test_approximate_overview_adds_sketched_metrics(sampled_client, sampled_lakehouse):
+    metrics = _ask(sampled_client, 'business overview', True)['data']['metrics']
+    orders = sampled_lakehouse.orders
+    distinct = orders['customer_id'].nunique()
+    assert abs(metrics['active_customers'] - distinct) <= HyperLogLog().relative_error * distinct
+    amounts = orders['total_amount'].to_numpy(dtype=np.float64)
+    assert metrics['p50_order_value'] == pytest.approx(np.quantile(amounts, 0.5), rel=0.05)
+    assert metrics['p99_order_value'] <= amounts.max()
+
+
+def test_ingested_batches_update_the_sketches_like_a_rebuild(fresh_lakehouse):
+    sketches = fresh_lakehouse.sketches
+    # A month with no orders yet, then one that has some
+    ingest(fresh_lakehouse, customers=[1, 2], products=[1, 2], amounts=[10.0, 20.0],
+           order_date=pd.Timestamp('2019-03-10'))
+    ingest(fresh_lakehouse, customers=[3], products=[3], amounts=[30.0], order_date=fresh_lakehouse.as_of)
+    assert fresh_lakehouse.sketches is sketches
+    rebuilt = LakehouseSketches.build(fresh_lakehouse)
+    assert sketches.months == rebuilt.months
+    np.testing.assert_array_equal(sketches.sample.state.population, rebuilt.sample.state.population)
+    for month in rebuilt.months:
+        np.testing.assert_array_equal(sketches.customers[month].registers, rebuilt.customers[month].registers)
+        assert sketches.order_values[month].count == rebuilt.order_values[month].count
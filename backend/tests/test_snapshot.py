@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from conftest import make_lakehouse
+from datagen import DataGenerator
+from snapshot import (MANIFEST_FILE, TABLES, load_snapshot, load_table, open_table, read_manifest, snapshot_path,
+                      table_file, write_snapshot)
+
+
+def test_snapshot_round_trips_the_generated_tables(tmp_path):
+    path = snapshot_path(str(tmp_path), 0.2, 5)
+    # Several record batches per fact table
+    manifest = write_snapshot(path, scale=0.2, seed=5, chunk_rows=300)
+    expected = DataGenerator(scale=0.2, seed=5).generate(chunk_rows=300)
+    assert manifest == read_manifest(path)
+    assert manifest['rows'] == {table: len(expected[table]) for table in TABLES}
+    assert open_table(path, 'orders').column('order_id').num_chunks > 1
+    loaded = load_snapshot(path)
+    for table in TABLES:
+        pd.testing.assert_frame_equal(loaded[table], expected[table])
+
+
+def test_loaded_columns_are_projected_and_mapped(tmp_path):
+    path = snapshot_path(str(tmp_path), 0.2, 5)
+    write_snapshot(path, scale=0.2, seed=5)
+    customers = load_table(path, 'customers', ['customer_id', 'customer_segment'])
+    assert list(customers.columns) == ['customer_id', 'customer_segment']
+    # Categorical codes are views of the mapped file rather than copies
+    codes = customers['customer_segment'].cat.codes.to_numpy()
+    assert not codes.flags.owndata
+
+
+def test_incomplete_snapshot_is_rebuilt(tmp_path):
+    path = snapshot_path(str(tmp_path), 0.2, 5)
+    write_snapshot(path, scale=0.2, seed=5)
+    os.remove(os.path.join(path, MANIFEST_FILE))
+    with open(table_file(path, 'orders'), 'wb') as f:
+        f.write(b'truncated')
+    assert read_manifest(path) is None
+    lakehouse = make_lakehouse(seed=5, snapshot_root=str(tmp_path))
+    assert len(lakehouse.orders) == read_manifest(path)['rows']['orders']
+
+
+def test_lakehouse_from_a_snapshot_matches_a_generated_one(tmp_path):
+    from_snapshot = make_lakehouse(snapshot_root=str(tmp_path))
+    generated = make_lakehouse()
+    for table in TABLES:
+        pd.testing.assert_frame_equal(getattr(from_snapshot, table), getattr(generated, table))
+    assert np.isclose(from_snapshot.orders['total_amount'].sum(), generated.orders['total_amount'].sum())
@@ -0,0 +1,88 @@
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from conftest import make_lakehouse
+from main import LLMAnalytics
+from snapshot import MANIFEST_FILE, snapshot_path, write_snapshot
+from timefilter import parse_grain, parse_time_filter, truncate_dates
+
+NOW = datetime(2024, 5, 15, 13, 30)
+
+
+@pytest.mark.parametrize('text, start, end, label', [
+    ('revenue from 2024-01-01 to 2024-01-31', '2024-01-01', '2024-02-01', '2024-01-01 to 2024-01-31'),
+    ('orders since 2024-03-10', '2024-03-10', '2024-05-16', 'since 2024-03-10'),
+    ('orders before 2024-02-01', None, '2024-02-01', 'before 2024-02-01'),
+    ('revenue ytd', '2024-01-01', '2024-05-16', 'year to date'),
+    ('quarter to date sales', '2024-04-01', '2024-05-16', 'quarter to date'),
+    ('orders today', '2024-05-15', '2024-05-16', 'today'),
+    ('orders yesterday', '2024-05-14', '2024-05-15', 'yesterday'),
+    ('daily revenue for the last 7 days', '2024-05-09', '2024-05-16', 'last 7 days'),
+    ('revenue over the past two weeks', '2024-05-02', '2024-05-16', 'last 2 weeks'),
+    ('sales in the last 3 months', '2024-02-16', '2024-05-16', 'last 3 months'),
+    ('revenue last month', '2024-04-01', '2024-05-01', 'last month'),
+    ('revenue this quarter', '2024-04-01', '2024-05-16', 'this quarter'),
+    ('revenue last week', '2024-05-06', '2024-05-13', 'last week'),
+    ('revenue over the past year', '2023-05-16', '2024-05-16', 'past year'),
+    ('top products in q1 2023', '2023-01-01', '2023-04-01', 'Q1 2023'),
+    ('second quarter sales', '2024-04-01', '2024-07-01', 'Q2 2024'),
+    ('revenue in march', '2024-03-01', '2024-04-01', 'March 2024'),
+    ('revenue in june', '2023-06-01', '2023-07-01', 'June 2023'),
+    ('orders since february', '2024-02-01', '2024-05-16', 'since February 2024'),
+    ('order status distribution in 1999', '1999-01-01', '2000-01-01', '1999'),
+])
+def test_time_filter_grammar(text, start, end, label):
+    time_filter = parse_time_filter(text, NOW)
+    assert time_filter == {'start': start and f'{start}T00:00:00', 'end': f'{end}T00:00:00', 'label': label}
+
+
+@pytest.mark.parametrize('text', ['top products', 'what may customers buy', 'compare channels'])
+def test_queries_without_a_range(text):
+    assert parse_time_filter(text, NOW) is None
+
+
+def test_grain_follows_wording_then_window_length():
+    assert parse_grain('weekly revenue for the last 7 days', parse_time_filter('last 7 days', NOW)) == 'W'
+    assert parse_grain('revenue for the last 7 days', parse_time_filter('last 7 days', NOW)) == 'D'
+    assert parse_grain('revenue trend this year', parse_time_filter('this year', NOW)) == 'M'
+
+
+def test_weeks_start_on_monday():
+    dates = pd.to_datetime(['2024-05-12', '2024-05-13', '2024-05-19 23:00'], format='ISO8601').to_numpy()
+    assert pd.to_datetime(truncate_dates(dates, 'W')).strftime('%Y-%m-%d').tolist() == [
+        '2024-05-06', '2024-05-13', '2024-05-13']
+    assert pd.to_datetime(truncate_dates(dates, 'M')).strftime('%Y-%m-%d').tolist() == ['2024-05-01'] * 3
+
+
+def test_relative_ranges_count_back_from_the_snapshot_as_of(tmp_path):
+    root = str(tmp_path)
+    path = snapshot_path(root, 0.05, 3)
+    write_snapshot(path, scale=0.05, seed=3)
+    # As if the snapshot had been built on an earlier day
+    manifest_file = os.path.join(path, MANIFEST_FILE)
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    with open(manifest_file, 'w') as f:
+        json.dump({**manifest, 'as_of': '2023-06-15T00:00:00'}, f)
+    lakehouse = make_lakehouse(scale=0.05, seed=3, snapshot_root=root)
+    assert lakehouse.as_of == datetime(2023, 6, 15)
+
+    analytics = LLMAnalytics()
+    analytics.lakehouse = lakehouse
+    time_filter = analytics.parse_natural_language_query('revenue for the last 30 days')['time_filter']
+    assert (time_filter['start'], time_filter['end']) == ('2023-05-17T00:00:00', '2023-06-16T00:00:00')
+
+
+def test_ingested_orders_dated_later_move_the_as_of(ingest_client, fresh_lakehouse):
+    later = datetime(fresh_lakehouse.as_of.year + 1, 1, 10, 9, 0)
+    order = {'customer_id': 'CUST_000001', 'order_date': later.isoformat(),
+             'items': [{'product_id': 'PROD_000001', 'quantity': 1, 'unit_price': 5.0}]}
+    assert ingest_client.post('/data/orders/batch', json={'orders': [order]}).status_code == 200
+    assert fresh_lakehouse.as_of == later
+    earlier = {**order, 'order_date': '2020-01-01T00:00:00'}
+    assert ingest_client.post('/data/orders/batch', json={'orders': [earlier]}).status_code == 200
+    assert fresh_lakehouse.as_of == later
@@ -0,0 +1,200 @@
+"""Extract date ranges and time grains from natural language queries.
+
+Ranges are half-open [start, end) and snapped to day boundaries, so the same
+question asked twice on the same day yields the same range (and the same
+cache key). Relative ranges are measured from a reference time the caller
+passes in, normally the data's as_of rather than the wall clock. Both bounds
+are ISO strings; a missing start means "from the beginning of history".
+"""
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+MONTHS = {
+    name: number for number, name in enumerate(
+        ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+         'august', 'september', 'october', 'november', 'december'], start=1)
+}
+MONTHS.update({name[:3]: number for name, number in list(MONTHS.items())})
+MONTHS['sept'] = 9
+
+GRAINS = {'D': 'day', 'W': 'week', 'M': 'month'}
+GRAIN_ADJECTIVES = {'D': 'daily', 'W': 'weekly', 'M': 'monthly'}
+
+_UNITS = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+_NUMBER_WORDS = {
+    'a': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+}
+_MONTH_PATTERN = '|'.join(sorted(MONTHS, key=len, reverse=True))
+_ORDINAL_QUARTERS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4}
+
+_ISO_DATE = r'(\d{4}-\d{2}-\d{2})'
+_RE_BETWEEN = re.compile(rf'\b(?:from|between)\s+{_ISO_DATE}\s+(?:to|and|until|through)\s+{_ISO_DATE}')
+_RE_SINCE = re.compile(rf'\b(?:since|after|from)\s+{_ISO_DATE}')
+_RE_BEFORE = re.compile(rf'\b(?:before|until)\s+{_ISO_DATE}')
+_RE_LAST_N = re.compile(
+    r'\b(?:last|past|previous|trailing)\s+(\d+|' + '|'.join(_NUMBER_WORDS) + r')\s+(day|week|month|quarter|year)s?\b'
+)
+_RE_LAST_ONE = re.compile(r'\b(last|previous|past|this|current)\s+(day|week|month|quarter|year)\b')
+_RE_QUARTER = re.compile(r'\bq([1-4])(?:\s+(\d{4}))?\b')
+_RE_ORDINAL_QUARTER = re.compile(r'\b(first|second|third|fourth)\s+quarter(?:\s+(?:of\s+)?(\d{4}))?\b')
+_RE_MONTH = re.compile(rf'\b(?:(in|during|for|of|since)\s+)?({_MONTH_PATTERN})\b(?:\s+(\d{{4}}))?')
+_RE_YEAR = re.compile(r'\b(?:in|during|for|of)\s+(\d{4})\b')
+
+
+def _day(value: date) -> datetime:
+    return datetime(value.year, value.month, value.day)
+
+
+def _range(start: Optional[datetime], end: datetime, label: str) -> Dict[str, Any]:
+    return {
+        'start': start.isoformat() if start is not None else None,
+        'end': end.isoformat(),
+        'label': label,
+    }
+
+
+def _month_start(year: int, month: int) -> datetime:
+    return datetime(year + (month - 1) // 12, (month - 1) % 12 + 1, 1)
+
+
+def _calendar_period(unit: str, today: date, offset: int) -> Tuple[datetime, datetime]:
+    """Bounds of the calendar period containing today, shifted by offset periods"""
+    if unit == 'D':
+        start = _day(today) + timedelta(days=offset)
+        return start, start + timedelta(days=1)
+    if unit == 'W':
+        start = _day(today) - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+        return start, start + timedelta(weeks=1)
+    if unit == 'M':
+        index = today.year * 12 + today.month - 1 + offset
+        return _month_start(index // 12, index % 12 + 1), _month_start(index // 12, index % 12 + 2)
+    if unit == 'Q':
+        index = today.year * 4 + (today.month - 1) // 3 + offset
+        year, quarter = divmod(index, 4)
+        return _month_start(year, quarter * 3 + 1), _month_start(year, quarter * 3 + 4)
+    year = today.year + offset
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def parse_time_filter(text: str, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Return the date range a query refers to, or None if it names none.
+
+    Relative ranges are measured from now, the current time if not given.
+    """
+    text = text.lower()
+    now = now or datetime.now()
+    today = now.date()
+    tomorrow = _day(today) + timedelta(days=1)
+
+    match = _RE_BETWEEN.search(text)
+    if match:
+        start, end = (datetime.fromisoformat(value) for value in match.groups())
+        return _range(start, end + timedelta(days=1), f'{match.group(1)} to {match.group(2)}')
+    match = _RE_SINCE.search(text)
+    if match:
+        return _range(datetime.fromisoformat(match.group(1)), tomorrow, f'since {match.group(1)}')
+    match = _RE_BEFORE.search(text)
+    if match:
+        return _range(None, datetime.fromisoformat(match.group(1)), f'before {match.group(1)}')
+
+    if 'year to date' in text or re.search(r'\bytd\b', text):
+        return _range(datetime(today.year, 1, 1), tomorrow, 'year to date')
+    if 'quarter to date' in text or re.search(r'\bqtd\b', text):
+        return _range(_calendar_period('Q', today, 0)[0], tomorrow, 'quarter to date')
+    if 'month to date' in text or re.search(r'\bmtd\b', text):
+        return _range(_calendar_period('M', today, 0)[0], tomorrow, 'month to date')
+    if re.search(r'\btoday\b', text):
+        return _range(_day(today), tomorrow, 'today')
+    if re.search(r'\byesterday\b', text):
+        return _range(_day(today) - timedelta(days=1), _day(today), 'yesterday')
+
+    # Trailing windows: "last 3 months", "past two weeks"
+    match = _RE_LAST_N.search(text)
+    if match:
+        count_text, unit_name = match.groups()
+        count = int(count_text) if count_text.isdigit() else _NUMBER_WORDS[count_text]
+        offset = {
+            'day': pd.DateOffset(days=count), 'week': pd.DateOffset(weeks=count),
+            'month': pd.DateOffset(months=count), 'quarter': pd.DateOffset(months=3 * count),
+            'year': pd.DateOffset(years=count),
+        }[unit_name]
+        start = (pd.Timestamp(tomorrow) - offset).to_pydatetime()
+        return _range(start, tomorrow, f'last {count} {unit_name}{"s" if count != 1 else ""}')
+
+    # Calendar periods: "last month", "this quarter"; "past year" means a trailing window
+    match = _RE_LAST_ONE.search(text)
+    if match:
+        which, unit_name = match.groups()
+        unit = _UNITS[unit_name]
+        if which == 'past':
+            start = (pd.Timestamp(tomorrow) - pd.DateOffset(**{f'{unit_name}s': 1})).to_pydatetime()
+            return _range(start, tomorrow, f'past {unit_name}')
+        offset = -1 if which in ('last', 'previous') else 0
+        start, end = _calendar_period(unit, today, offset)
+        label = f'{"last" if offset else "this"} {unit_name}'
+        return _range(start, min(end, tomorrow), label)
+
+    match = _RE_QUARTER.search(text) or _RE_ORDINAL_QUARTER.search(text)
+    if match:
+        quarter_text, year_text = match.groups()
+        quarter = int(quarter_text) if quarter_text.isdigit() else _ORDINAL_QUARTERS[quarter_text]
+        year = int(year_text) if year_text else today.year
+        start = _month_start(year, quarter * 3 - 2)
+        return _range(start, _month_start(year, quarter * 3 + 1), f'Q{quarter} {year}')
+
+    for match in _RE_MONTH.finditer(text):
+        preposition, month_name, year_text = match.groups()
+        # "may" is only a month when the phrasing makes it unambiguous
+        if month_name == 'may' and not (preposition or year_text):
+            continue
+        month = MONTHS[month_name]
+        year = int(year_text) if year_text else today.year
+        if not year_text and _month_start(year, month) > now:
+            # A bare month name refers to its most recent occurrence
+            year -= 1
+        start = _month_start(year, month)
+        if preposition == 'since':
+            return _range(start, tomorrow, f'since {start:%B %Y}')
+        return _range(start, _month_start(year, month + 1), f'{start:%B %Y}')
+
+    match = _RE_YEAR.search(text)
+    if match:
+        year = int(match.group(1))
+        return _range(datetime(year, 1, 1), datetime(year + 1, 1, 1), str(year))
+    return None
+
+
+def parse_grain(text: str, time_filter: Optional[Dict[str, Any]] = None) -> str:
+    """Time bucket for trends: 'D', 'W' or 'M'.
+
+    Explicit wording wins; otherwise short windows are bucketed by day and
+    everything else by month.
+    """
+    text = text.lower()
+    if re.search(r'\b(daily|per day|by day|each day|day by day)\b', text):
+        return 'D'
+    if re.search(r'\b(weekly|per week|by week|each week|week over week)\b', text):
+        return 'W'
+    if re.search(r'\b(monthly|per month|by month|each month|month over month)\b', text):
+        return 'M'
+    if time_filter and time_filter['start']:
+        span = datetime.fromisoformat(time_filter['end']) - datetime.fromisoformat(time_filter['start'])
+        if span <= timedelta(days=31):
+            return 'D'
+    return 'M'
+
+
+def truncate_dates(dates: np.ndarray, grain: str) -> np.ndarray:
+    """Truncate datetime64 values to the start of their day, ISO week or month"""
+    if grain == 'M':
+        return dates.astype('datetime64[M]')
+    days = dates.astype('datetime64[D]')
+    if grain == 'W':
+        # Day 0 of the epoch is a Thursday; shift so weeks start on Monday
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    return days